@@ -172,12 +172,9 @@ class MyServerProtocol(WebSocketServerProtocol):
         elif message["command"] == "Get Temperature Data":
             if message["minutes"] is not None:
                 m = int(message["minutes"])
-                n = self.adrServer.tempDataChest.getNumRows()
-                tempData = self.adrServer.tempDataChest.getData(
-                    max(0, n - m * 60), None
-                )
+                tempData = self._recentTemperatures(m)
                 now = deltaT(datetime.datetime.utcnow() - datetime.datetime(1970, 1, 1))
-                tempData = [line for line in tempData if line[0] > now - m * 60]
+                tempData = tempData[tempData[:, 0] > now - m * 60].tolist()
                 # add blank data so if we restart server, there will not be a
                 # big ugly line on the graph where we have a break in time
                 timestamp = deltaT(
@@ -205,6 +202,38 @@ class MyServerProtocol(WebSocketServerProtocol):
                 )  # apparently JSON does not support nan
                 self.sendMessage(text)
 
+    def _recentTemperatures(self, minutes):
+        """
+        Return the last minutes * 60 rows of the temperature log as an
+        array with a column per variable of the log. Rows are cached per
+        connection and a dataCursor is used so that repeated requests only
+        read newly logged rows.
+        """
+        chest = self.adrServer.tempDataChest
+        numRows = minutes * 60
+        cursor = getattr(self, "tempCursor", None)
+        if (
+            cursor is None
+            or cursor.filename != chest.currentHDF5Filename
+            or numRows > self.tempCacheRows
+        ):
+            if numRows == 0:
+                startIndex = chest.getNumRows()  # only rows logged from now on
+            else:
+                startIndex = -numRows
+            cursor = chest.getCursor(startIndex=startIndex)
+            self.tempCursor = cursor
+            numColumns = sum(len(varsList) for varsList in chest.getVariables())
+            self.tempCache = numpy.zeros((0, numColumns))
+            self.tempCacheRows = numRows
+        newData = cursor.getNewData()
+        newRows = numpy.column_stack(
+            [numpy.asarray(column, dtype=float) for column in newData.values()]
+        )
+        self.tempCache = numpy.concatenate((self.tempCache, newRows))
+        self.tempCache = self.tempCache[len(self.tempCache) - self.tempCacheRows :]
+        return self.tempCache[max(0, len(self.tempCache) - numRows) :]
+
 
 class MyFactory(WebSocketServerFactory):
     def __init__(self, *args, **kwargs):
@@ -1,6 +1,8 @@
 # TITLE: Normalize By Column
 # DESCR: Fits plot to blah blah blah
 
+ROW_LOCAL = True
+
 
 def run(data):
     print("SIZE ", data.shape)
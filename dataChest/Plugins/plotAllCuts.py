@@ -1,6 +1,8 @@
 # TITLE: Fitter
 # DESCR: Fits plot to blah blah blah
 
+ROW_LOCAL = True
+
 
 def run(data):
     return data
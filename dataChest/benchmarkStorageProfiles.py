@@ -0,0 +1,165 @@
+# Compares the dataChest storage profiles on the datasets from
+# generateTestDatasets.py, scaled up to log-sized row counts. For every
+# profile this reports the file size, the time to write the data, the time
+# to read everything back and the time to read a small window of rows.
+#
+# Usage (datasets are written under DATA_ROOT/testProject/Storage Benchmark):
+#     python benchmarkStorageProfiles.py [rowScale]
+
+import os
+import sys
+import time
+import numpy as np
+from dataChest import dataChest, STORAGE_PROFILES
+
+WINDOW_ROWS = 100
+NUM_WINDOW_READS = 20
+
+
+def gaussian(x, mu, sig):  # with noise
+    return (
+        np.exp(-np.power(x - mu, 2.0) / (2 * np.power(sig, 2.0)))
+        + np.random.rand() / 5.0
+    )
+
+
+def timeSeries(rowScale):
+    numRows = 1000 * rowScale
+    t = np.arange(numRows, dtype="float64")
+    noise = np.random.rand(numRows)
+    return (
+        "1D_ArbType1_MyFavoriteTimeSeries",
+        [("indepName1", [1], "float64", "s")],
+        [("depName1", [1], "float64", "V")],
+        np.column_stack((t, noise)),
+    )
+
+
+def dampedOscillations(rowScale):
+    timeAxis = np.arange(1, 100, 0.1)
+    rows = [
+        [timeAxis, np.sin(2 * np.pi * timeAxis + ii) / timeAxis]
+        for ii in range(rowScale)
+    ]
+    return (
+        "1D_ArbType2_DampedOscillations",
+        [("time", [len(timeAxis)], "float64", "s")],
+        [("Oscillation", [len(timeAxis)], "float64", "V")],
+        rows,
+    )
+
+
+def linearScan(rowScale):
+    length = 100
+    rows = [
+        [
+            [0.0, 100.0],
+            1.0 + 0.1 * np.random.randn(length),
+            1.0 + 0.1 * np.random.randn(length),
+        ]
+        for ii in range(rowScale)
+    ]
+    return (
+        "1D_Scan_LinearWaveform",
+        [("indepName1", [2], "float64", "s")],
+        [
+            ("depName1", [length], "float64", "V"),
+            ("depName2", [length], "float64", "V"),
+        ],
+        rows,
+    )
+
+
+def qubitFluxSweep(rowScale):
+    rows = []
+    for i in np.arange(5, 6, 0.01 / rowScale):
+        for j in np.arange(-0.5, 0.5, 0.05):
+            rows.append(
+                [float(j), float(i), gaussian(i, 5.5 + 0.2 * np.sin(10 * j), 0.05)]
+            )
+    return (
+        "2D_ArbType1_QubitFluxSweep1",
+        [("Flux Bias", [1], "float64", "V"), ("Frequency", [1], "float64", "GHz")],
+        [("S21", [1], "float64", "dB")],
+        np.array(rows),
+    )
+
+
+def qubitFluxSweepScan(rowScale):
+    freqList = np.arange(5, 6, 0.01)
+    rows = [
+        [
+            float(j),
+            [freqList[0], freqList[1]],
+            gaussian(freqList, 5.5 + 0.2 * np.sin(10 * j), 0.05),
+        ]
+        for j in np.arange(-0.5, 0.5, 0.05 / rowScale)
+    ]
+    return (
+        "2D_Scan_QubitFluxSweepScan",
+        [("Flux Bias", [1], "float64", "V"), ("Frequency", [2], "float64", "GHz")],
+        [("S21", [len(freqList)], "float64", "dB")],
+        rows,
+    )
+
+
+DATASETS = [
+    timeSeries,
+    dampedOscillations,
+    linearScan,
+    qubitFluxSweep,
+    qubitFluxSweepScan,
+]
+
+
+def benchmark(d, profile, name, indeps, deps, rows):
+    d.createDataset(name, indeps, deps, storageProfile=profile)
+    filename = d.getDatasetName()
+    start = time.time()
+    d.addData(rows)
+    d.flush()
+    writeTime = time.time() - start
+    d.close()
+    fileSize = os.path.getsize(d.pwd() + "/" + filename)
+
+    d.openDataset(filename)
+    start = time.time()
+    d.getDataColumns()
+    readTime = time.time() - start
+    numRows = d.getNumRows()
+    starts = np.random.randint(0, max(1, numRows - WINDOW_ROWS), NUM_WINDOW_READS)
+    start = time.time()
+    for ii in starts:
+        d.getDataColumns(int(ii), int(ii) + WINDOW_ROWS)
+    windowTime = (time.time() - start) / NUM_WINDOW_READS
+    d.close()
+    return fileSize, writeTime, readTime, windowTime
+
+
+def main(rowScale):
+    d = dataChest(["testProject", "Storage Benchmark"], bufferedWrites=True)
+    print(
+        "%-32s %-8s %10s %10s %10s %12s"
+        % ("dataset", "profile", "size [kB]", "write [s]", "read [s]", "window [ms]")
+    )
+    for makeDataset in DATASETS:
+        name, indeps, deps, rows = makeDataset(rowScale)
+        for profile in sorted(STORAGE_PROFILES.keys()):
+            fileSize, writeTime, readTime, windowTime = benchmark(
+                d, profile, name, indeps, deps, rows
+            )
+            print(
+                "%-32s %-8s %10.1f %10.3f %10.3f %12.3f"
+                % (
+                    name,
+                    profile,
+                    fileSize / 1024.0,
+                    writeTime,
+                    readTime,
+                    windowTime * 1e3,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
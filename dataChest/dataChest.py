@@ -21,6 +21,7 @@ import string
 import re
 import ast
 import pickle
+from dataChestIndex import dataChestIndex
 
 VAR_NAME_INDEX = 0
 VAR_SHAPE_INDEX = 1
@@ -32,6 +33,70 @@ EXPECTED_TUPLE_TYPES = [str, list, str, str]
 
 ERROR_GRAMMAR = {"0": "th", "1": "st", "2": "nd", "3": "rd", "4": "th"}
 
+# write-back buffer thresholds used when bufferedWrites=True
+DEFAULT_BUFFER_MAX_ROWS = 10000
+DEFAULT_BUFFER_MAX_BYTES = 16 * 1024 * 1024
+
+# dataset storage layouts selectable in createDataset. chunkRows=None keeps
+# the original layout (10000 element chunks for scalars, one row per chunk
+# for arrays) with no filters.
+STORAGE_PROFILES = {
+    "legacy": {
+        "chunkRows": None,
+        "compression": None,
+        "compressionLevel": None,
+        "shuffle": False,
+        "fletcher32": False,
+    },
+    "fast": {
+        "chunkRows": 4096,
+        "compression": "lzf",
+        "compressionLevel": None,
+        "shuffle": True,
+        "fletcher32": False,
+    },
+    "compact": {
+        "chunkRows": 4096,
+        "compression": "gzip",
+        "compressionLevel": 4,
+        "shuffle": True,
+        "fletcher32": False,
+    },
+    "archive": {
+        "chunkRows": 16384,
+        "compression": "gzip",
+        "compressionLevel": 9,
+        "shuffle": True,
+        "fletcher32": True,
+    },
+}
+DEFAULT_STORAGE_PROFILE = "legacy"
+VALID_COMPRESSION_FILTERS = [None, "gzip", "lzf"]
+MAX_CHUNK_BYTES = 512 * 1024  # caps chunkRows for array valued variables
+
+# decimation factors of the optional min/max/mean pyramid kept for scalar
+# variables, each a multiple of the previous one (1x is the raw data)
+DEFAULT_PYRAMID_LEVELS = [16, 256, 4096]
+PYRAMID_DTYPE = np.dtype(
+    [("min", "float64"), ("max", "float64"), ("mean", "float64"), ("count", "int64")]
+)
+PYRAMID_CHUNK_BINS = 1024
+PYRAMID_TYPES = [
+    "bool_",
+    "int8",
+    "int16",
+    "int32",
+    "int64",
+    "uint8",
+    "uint16",
+    "uint32",
+    "uint64",
+    "float16",
+    "float32",
+    "float64",
+    "utc_datetime",
+]
+
 VALID_DATA_TYPES = [
     "bool_",
     "int8",
@@ -107,14 +172,47 @@ TYPE_CASTING_OBJECTS = [
     np.array,
 ]
 
+# parameter types that HDF5 cannot store natively and are pickled
+PICKLED_PARAMETER_TYPES = ["long", "tuple", "dict"]
+# parameter values are attributes of the parameters group, their types and
+# units are rows of this compound dataset
+PARAMETER_INFO_DATASET = "parameterInfo"
+PARAMETER_INFO_DTYPE = np.dtype(
+    [
+        ("name", h5py.special_dtype(vlen=str)),
+        ("dtype", h5py.special_dtype(vlen=str)),
+        ("units", h5py.special_dtype(vlen=str)),
+    ]
+)
+PARAMETER_INFO_CHUNK_ROWS = 256
+# "Parameter Format" attribute of files with parameters in the layout above.
+# Files without it (format 1) store a group per parameter with its value,
+# type and units. dataChest versions before format 2 (and the graphers using
+# them) do not check this attribute. They read format 2 parameters as untyped
+# attributes: plain values come back as stored, long, tuple and dict values
+# as pickled bytes, and every parameter without units.
+PARAMETER_FORMAT_ATTR = "Parameter Format"
+PARAMETER_FORMAT_VERSION = 2
+
 
 class dataChest(dateStamp):
     def __init__(
-        self, path, setWorkingDirectoryToRoot=False
+        self,
+        path,
+        setWorkingDirectoryToRoot=False,
+        bufferedWrites=False,
+        bufferMaxRows=DEFAULT_BUFFER_MAX_ROWS,
+        bufferMaxBytes=DEFAULT_BUFFER_MAX_BYTES,
+        useIndex=True,
     ):  # add for ability to set root path
         self.cwdPath = os.environ["DATA_ROOT"]  # Make sure this exists
         if "\\" in self.cwdPath:
             self.cwdPath = self.cwdPath.replace("\\", "/")
+        self.index = None
+        if useIndex:
+            self.index = dataChestIndex(self.cwdPath)
+            if not self.index.isEnabled():
+                self.index = None
         if not setWorkingDirectoryToRoot:
             self._initializeRoot(path)
         self.root = self.cwdPath
@@ -126,6 +224,14 @@ class dataChest(dateStamp):
         self.varDict["dependents"] = {}
         self.numIndepWrites = 0
         self.numDepWrites = 0
+        self.bufferedWrites = bufferedWrites
+        self.bufferMaxRows = bufferMaxRows
+        self.bufferMaxBytes = bufferMaxBytes
+        self.swmr = False
+        self.storageProfile = dict(STORAGE_PROFILES[DEFAULT_STORAGE_PROFILE])
+        self.pyramidLevels = []
+        self._clearParameterCache()
+        self._clearWriteBuffer()
 
     def _initializeRoot(self, path):
         if isinstance(path, str):
@@ -162,9 +268,12 @@ class dataChest(dateStamp):
         if self._formatFilename(directoryToMake, " /+-.") == directoryToMake:
             if directoryToMake.lower() not in dirContents:
                 if not os.path.isdir(self.cwdPath + "/" + directoryToMake):
+                    mtime = self._directoryMtime()
                     os.mkdir(
                         self.cwdPath + "/" + directoryToMake
                     )  # Try except this even though safe guarded
+                    if self.index is not None:
+                        self.index.addEntry(self.cwdPath, directoryToMake, False, mtime)
             else:
                 raise OSError(
                     "Directory already exists.\r\n\t"
@@ -183,6 +292,10 @@ class dataChest(dateStamp):
 
     def ls(self):
         """Lists the contents of the current working directory."""
+        if self.index is not None:
+            listing, mtime = self.index.getListing(self.cwdPath)
+            if listing is not None:
+                return listing
         cwdContents = os.listdir(self.cwdPath)
         filesList = []
         foldersList = []
@@ -197,8 +310,59 @@ class dataChest(dateStamp):
                     foldersList.append(item)
         filesList = sorted(filesList)  # alphabetize for readibility
         foldersList = sorted(foldersList)
+        if self.index is not None:
+            self.index.setListing(self.cwdPath, mtime, filesList, foldersList)
         return [filesList, foldersList]
 
+    def _directoryMtime(self):
+        if self.index is not None:
+            return self.index.directoryMtime(self.cwdPath)
+        return None
+
+    def rebuildIndex(self):
+        """Rebuilds the index of the root directory tree from its files."""
+        if self.index is None:
+            raise Warning("The dataChest index is disabled.")
+        self.index.clear(self.root)
+        for dirPath, dirNames, fileNames in os.walk(self.root):
+            dirPath = dirPath.replace("\\", "/")
+            dirNames[:] = [x for x in dirNames if not x.startswith(".")]
+            mtime = self.index.directoryMtime(dirPath)
+            filesList = sorted(
+                [x for x in fileNames if ".hdf5" in x and not x.startswith(".")]
+            )
+            foldersList = sorted(
+                dirNames
+                + [x for x in fileNames if ".hdf5" not in x and not x.startswith(".")]
+            )
+            self.index.setListing(dirPath, mtime, filesList, foldersList)
+            for filename in filesList:
+                self._indexDatasetFile(dirPath + "/" + filename)
+
+    def _indexDatasetFile(self, filePath):
+        try:
+            hdf5File = h5py.File(filePath, "r")
+        except (IOError, OSError):
+            return
+        try:
+            varDict = self._readVarDict(hdf5File)
+            self.index.setDataset(
+                filePath, str(hdf5File.attrs["Data Category"]), varDict
+            )
+            self.index.removeParameters(filePath)
+            parameters = self._readParameters(hdf5File)[0]
+            self.index.setParameters(
+                filePath,
+                [
+                    (paramName, paramType, paramUnits)
+                    for paramName, (_, paramType, paramUnits) in parameters.items()
+                ],
+            )
+        except KeyError:
+            pass  # not a dataChest file
+        finally:
+            hdf5File.close()
+
     def pwd(self):
         currentWorkingDirectory = self.cwdPath
         return currentWorkingDirectory
@@ -230,7 +394,6 @@ class dataChest(dateStamp):
 
         if len(path) > 0:
             for ii in range(0, len(path)):
-                cwdContents = self.ls()
                 dirContents = [x.lower() for x in self.ls()[1]]
 
                 if path[ii].lower() in dirContents:
@@ -252,8 +415,35 @@ class dataChest(dateStamp):
         else:
             raise Warning("Calling cd() on an empty list has no meaning.")
 
-    def createDataset(self, datasetName, indepVarsList, depVarsList, dateStamp=None):
-        "Creates a new dataset within the current working directory." ""
+    def createDataset(
+        self,
+        datasetName,
+        indepVarsList,
+        depVarsList,
+        dateStamp=None,
+        swmr=False,
+        storageProfile=DEFAULT_STORAGE_PROFILE,
+        pyramidLevels=None,
+    ):
+        """Creates a new dataset within the current working directory.
+
+        With swmr=True the file is written in the HDF5 single-writer/
+        multi-reader format. SWMR mode is switched on with the first rows
+        written, after which readers that opened the dataset with
+        openDataset(..., swmr=True) see appended rows without reopening
+        the file. Parameters should be added before the first addData().
+
+        storageProfile is either the name of one of the STORAGE_PROFILES
+        or a dict with any of their keys (chunkRows, compression,
+        compressionLevel, shuffle, fletcher32) overriding the legacy
+        layout. The profile is stored with the file.
+
+        pyramidLevels is a list of decimation factors (or True for
+        DEFAULT_PYRAMID_LEVELS). For every scalar numeric variable a
+        min/max/mean summary is then kept at each factor and updated on
+        every append, see getDownsampledData().
+        """
+        self.flush()
         self.currentHDF5Filename = None
         self.readOnlyFlag = False
         self.dataCategory = None  # treat self.dataCategory consistently
@@ -270,14 +460,43 @@ class dataChest(dateStamp):
             RE = re.compile(r"^[a-z]{3}[0-9]{4}[a-z]{3}$")
             if not bool(RE.search(dateStamp)):
                 raise IOError("Invalid dateStamp provided.")
+        profile = self._resolveStorageProfile(storageProfile)
+        if profile is None:
+            raise self.exception
+        if pyramidLevels is True:
+            pyramidLevels = DEFAULT_PYRAMID_LEVELS
+        elif pyramidLevels is None or pyramidLevels is False:
+            pyramidLevels = []
+        if not self._arePyramidLevelsValid(pyramidLevels):
+            raise self.exception
 
         filename = self._generateUniqueFilename(datasetName, dateStamp)
         if len(filename) > 0:
             self.dataCategory = self._categorizeDataset(self.varDict)
+            self.swmr = swmr
+            self.storageProfile = profile
+            self.pyramidLevels = list(pyramidLevels)
+            mtime = self._directoryMtime()
             self._initDataset(self.varDict, filename)
+            if self.index is not None:
+                self.index.addEntry(self.cwdPath, filename, True, mtime)
+                self.index.setDataset(
+                    self.currentHDF5Filename, self.dataCategory, self.varDict
+                )
         else:
             raise RuntimeError("Unable to create a unique filename.")
 
+    def getStorageProfile(self):
+        """Returns the storage profile of the current dataset."""
+        if self.currentHDF5Filename is not None:
+            return dict(self.storageProfile)
+        else:
+            raise Warning(
+                "No file is currently selected. First select a file\r\n\t"
+                + "using openDataset() to open an existing set or\r\n\t"
+                + "create one using createDataset()."
+            )
+
     def getDatasetName(self):
         if self.currentHDF5Filename is not None:
             currentDatasetName = self.currentHDF5Filename.split("/")[-1]
@@ -309,8 +528,22 @@ class dataChest(dateStamp):
                 + "or create a new dataset with createDataset() before\r\n\t"
                 + "using addData()."
             )
+        elif self.currentHDF5Filename is not None and (
+            self.bufferedWrites or self.swmr
+        ):
+            columns = self._dataBlockColumns(data)
+            if columns is None:
+                raise self.exception
+            self._bufferColumns(columns)
+            if (
+                not self.bufferedWrites
+                or self._bufferedRows >= self.bufferMaxRows
+                or self._bufferedBytes >= self.bufferMaxBytes
+            ):
+                self.flush()
         elif self.currentHDF5Filename is not None:
             if self._isDataValid(data):
+                numRowsBefore = self.numIndepWrites
                 numIndeps = len(self.varDict["independents"]["names"])
                 numDeps = len(self.varDict["dependents"]["names"])
                 numRows = len(data)
@@ -377,6 +610,7 @@ class dataChest(dateStamp):
                         self.numIndepWrites = self.numIndepWrites + 1
                         self.numDepWrites = self.numDepWrites + 1
 
+                self._updatePyramid(numRowsBefore, self.numIndepWrites)
                 self.file.attrs["Number Of Rows Added"] = self.numIndepWrites
                 self.file.flush()
             else:
@@ -387,9 +621,75 @@ class dataChest(dateStamp):
                 + "Datasets are created using the createDataset().\r\n\t"
             )
 
+    def setBufferedWrites(self, bufferedWrites):
+        """Enables or disables the addData write-back buffer."""
+        if not bufferedWrites:
+            self.flush()
+        self.bufferedWrites = bufferedWrites
+
+    def flush(self):
+        """Writes any rows held in the addData buffer out to the file."""
+        if self._bufferedRows == 0:
+            return
+        if self.swmr and not self.file.swmr_mode:
+            self.file.swmr_mode = True
+        numIndeps = len(self.varDict["independents"]["names"])
+        for colNum in range(0, len(self._writeBuffer)):
+            if colNum < numIndeps:
+                varGrp = "independents"
+                varIndex = colNum
+            else:
+                varGrp = "dependents"
+                varIndex = colNum - numIndeps
+            varName = self.varDict[varGrp]["names"][varIndex]
+            flatLen = self._flatShape(self.varDict[varGrp]["shapes"][varIndex])[0]
+            pieces = self._writeBuffer[colNum]
+            if len(pieces) == 1:
+                block = pieces[0]
+            else:
+                block = np.concatenate(pieces)
+            dset = self.file[varGrp][varName]
+            start = self.numIndepWrites * flatLen
+            stop = start + self._bufferedRows * flatLen
+            dset.resize((stop,))
+            dset[start:stop] = block
+        self._updatePyramid(
+            self.numIndepWrites, self.numIndepWrites + self._bufferedRows
+        )
+        self.numIndepWrites = self.numIndepWrites + self._bufferedRows
+        self.numDepWrites = self.numIndepWrites
+        self._clearWriteBuffer()
+        os.utime(self.currentHDF5Filename, None)
+        self.file.attrs["Number Of Rows Added"] = self.numIndepWrites
+        self.file.flush()
+
+    def close(self):
+        """Flushes buffered rows and closes the current dataset."""
+        if hasattr(self, "file"):
+            self.flush()
+            self.file.close()
+            del self.file
+        self.currentHDF5Filename = None
+        self._clearParameterCache()
+
+    def _clearWriteBuffer(self):
+        self._writeBuffer = []
+        self._bufferedRows = 0
+        self._bufferedBytes = 0
+
+    def _bufferColumns(self, columns):
+        if len(self._writeBuffer) == 0:
+            self._writeBuffer = [[] for column in columns]
+        for colNum in range(0, len(columns)):
+            flatColumn = np.reshape(columns[colNum], (-1,))
+            self._writeBuffer[colNum].append(flatColumn)
+            self._bufferedBytes = self._bufferedBytes + flatColumn.nbytes
+        self._bufferedRows = self._bufferedRows + len(columns[0])
+
     def getNumRows(self):
         if self.currentHDF5Filename is not None:
-            numRows = self.file.attrs["Number Of Rows Added"]
+            self.flush()
+            numRows = self._getNumRowsInFile()
             return numRows
         else:
             raise Warning("No dataset is currently open.")
@@ -397,75 +697,69 @@ class dataChest(dateStamp):
     def getData(self, startIndex=np.nan, stopIndex=np.nan, variablesList=None):
         """Retrieves data from the current dataset."""
         if self.currentHDF5Filename is not None:
-            dataDict = {}
-            numRows = self.file.attrs["Number Of Rows Added"]
-            sliceIndices = self._sortSliceIndices(startIndex, stopIndex, numRows)
-            if not isinstance(sliceIndices, list):
-                raise self.exception
-            startIndex, stopIndex = sliceIndices[0], sliceIndices[1]
-            for varTypes in list(self.varDict.keys()):
-                if variablesList is not None:
-                    desiredVarList = []
-                    for element in list(self.file[varTypes].keys()):
-                        if element in variablesList:
-                            desiredVarList.append(element)
-                else:
-                    desiredVarList = list(self.file[varTypes].keys())
-                for variables in desiredVarList:
-                    varGrp = self.file[varTypes]
-                    dataset = varGrp[variables]
-                    originalShape = varGrp[variables].attrs["shapes"]
-                    chunkSize = self._flatShape(originalShape)[0]
-                    totalLen = varGrp[variables].shape[0]
-                    numChunks = totalLen / chunkSize
-                    dataDict[variables] = []
-                    if len(originalShape) > 1 or originalShape != [1]:
-                        for ii in range(
-                            0, numRows
-                        ):  # need to add similar .value here too...
-                            chunk = np.asarray(
-                                dataset[ii * chunkSize : (ii + 1) * chunkSize]
-                            )
-                            chunk = np.reshape(chunk, tuple(originalShape))
-                            dataDict[variables].append(chunk.tolist())
-                    else:
-                        if len(dataset) != numRows:
-                            dataset = dataset[0:numRows]
-                        dataDict[variables] = dataset
-
-            data = []
-            allVars = []
             if variablesList is not None:
-                allVars = variablesList
+                allVars = [self._varNameToStr(x) for x in variablesList]
             else:
                 allVars = (
                     self.varDict["independents"]["names"]
                     + self.varDict["dependents"]["names"]
                 )
+            dataDict = self.getDataColumns(startIndex, stopIndex, allVars)
             if self.getDataCategory() == "Arbitrary Type 1":
-                for ii in range(0, len(allVars)):
-                    item = allVars[ii]
-                    if type(item) is bytes:
-                        item = str(item).lstrip("b'")
-                        item = item.rstrip("'")
-                    data.append(dataDict[item][()])
-                    # previous error: key error caused by bytes adding b'...' to key
-                    # current working solution: turn byte into string, and removing the tag
-                    # caveat independend and depenents can't begin with b' or end with '
-                data = np.array(data)
-                data = data.T
-                return data[startIndex:stopIndex]
+                data = np.array([dataDict[item] for item in allVars])
+                return data.T
             else:
-                for ii in range(startIndex, stopIndex):  # making slicing efficient
-                    row = []
-                    for jj in range(0, len(allVars)):
-                        row.append(
-                            dataDict[allVars[jj]][ii]
-                            if isinstance(allVars[jj], str)
-                            else allVars[jj].decode("utf-8")
-                        )
-                    data.append(row)
+                columns = []
+                for varName in allVars:
+                    column = dataDict[varName]
+                    if column.ndim > 1:
+                        column = column.tolist()
+                    columns.append(column)
+                return [list(row) for row in zip(*columns)]
+        else:
+            raise Warning(
+                "No file is currently open. First select a file using\r\n\t"
+                + "either openDataset() to open an existing set or with\r\n\t"
+                + "createDataset()."
+            )
+
+    def getDataColumns(
+        self, startIndex=np.nan, stopIndex=np.nan, variablesList=None, structured=False
+    ):
+        """Retrieves data from the current dataset as one array per variable.
+
+        Each variable is read with a single hyperslab and returned as an
+        array of shape (numRows,) for scalars or (numRows,) + shape otherwise,
+        in a dict keyed by variable name. With structured=True a structured
+        array with one field per variable is returned instead.
+        """
+        if self.currentHDF5Filename is not None:
+            self.flush()
+            numRows = self._getNumRowsInFile()
+            sliceIndices = self._sortSliceIndices(startIndex, stopIndex, numRows)
+            if not isinstance(sliceIndices, list):
+                raise self.exception
+            startIndex, stopIndex = sliceIndices[0], sliceIndices[1]
+            stopIndex = max(startIndex, stopIndex)
+            if variablesList is None:
+                variablesList = (
+                    self.varDict["independents"]["names"]
+                    + self.varDict["dependents"]["names"]
+                )
+            dataDict = {}
+            for varName in variablesList:
+                varName = self._varNameToStr(varName)
+                dataDict[varName] = self._readColumn(varName, startIndex, stopIndex)
+            if structured:
+                fields = [
+                    (varName, column.dtype, column.shape[1:])
+                    for varName, column in dataDict.items()
+                ]
+                data = np.empty(stopIndex - startIndex, dtype=fields)
+                for varName, column in dataDict.items():
+                    data[varName] = column
                 return data
+            return dataDict
         else:
             raise Warning(
                 "No file is currently open. First select a file using\r\n\t"
@@ -473,46 +767,311 @@ class dataChest(dateStamp):
                 + "createDataset()."
             )
 
-    def openDataset(self, filename, modify=False):
-        """Opens a dataset in the current working directory if it exists."""
+    def getCursor(self, variablesList=None, startIndex=0):
+        """Returns a dataCursor that reads rows as they are appended.
+
+        A negative startIndex starts the cursor that many rows before the
+        current end of the dataset.
+        """
+        if self.currentHDF5Filename is not None:
+            if startIndex < 0:
+                startIndex = max(0, self.getNumRows() + startIndex)
+            return dataCursor(self, variablesList, startIndex)
+        else:
+            raise Warning(
+                "No file is currently open. First select a file using\r\n\t"
+                + "either openDataset() to open an existing set or with\r\n\t"
+                + "createDataset()."
+            )
+
+    def getDownsampledData(
+        self,
+        startIndex=None,
+        stopIndex=None,
+        numPoints=1000,
+        variablesList=None,
+        indepRange=None,
+    ):
+        """Retrieves a min/max/mean summary of scalar variables for plotting.
+
+        The coarsest pyramid level that still gives at least numPoints bins
+        over the rows startIndex:stopIndex is used, so the amount of data
+        read does not grow with the length of the dataset. Alternatively
+        indepRange = (low, high) selects the rows whose first independent
+        variable (assumed to be increasing, e.g. time) lies in that range.
+
+        Returns (level, dataDict) where level is the number of rows per bin
+        (1 for raw data) and dataDict maps each variable name to an array
+        with fields min, max, mean and count. Bins are aligned to multiples
+        of level, so the first and last bins may extend past the range.
+        """
+        if self.currentHDF5Filename is None:
+            raise Warning(
+                "No file is currently open. First select a file using\r\n\t"
+                + "either openDataset() to open an existing set or with\r\n\t"
+                + "createDataset()."
+            )
+        self.flush()
+        numRows = self._getNumRowsInFile()
+        if indepRange is not None:
+            startIndex, stopIndex = self._rowRangeForIndepRange(indepRange, numRows)
+        if startIndex is None:
+            startIndex = 0
+        if stopIndex is None:
+            stopIndex = numRows
+        startIndex = min(max(startIndex, 0), numRows)
+        stopIndex = min(max(stopIndex, startIndex), numRows)
+        pyramidVars = [varName for varGrp, varName in self._pyramidVariables()]
+        if variablesList is None:
+            variablesList = pyramidVars
+        level = 1
+        for pyramidLevel in self.pyramidLevels:
+            if (stopIndex - startIndex) // pyramidLevel >= numPoints:
+                level = pyramidLevel
+        dataDict = {}
+        for varName in variablesList:
+            varName = self._varNameToStr(varName)
+            if varName not in pyramidVars:
+                raise IOError("Variable " + str(varName) + " has no downsampled data.")
+            if level == 1:
+                values = self._readColumn(varName, startIndex, stopIndex)
+                values = np.asarray(values, dtype="float64")
+                summary = np.empty(len(values), dtype=PYRAMID_DTYPE)
+                summary["min"] = values
+                summary["max"] = values
+                summary["mean"] = values
+                summary["count"] = ~np.isnan(values)
+            else:
+                dset = self.file["pyramid"][str(level)][varName]
+                if self.swmr and self.readOnlyFlag:
+                    dset.refresh()
+                summary = dset[startIndex // level : -(-stopIndex // level)]
+            dataDict[varName] = summary
+        return level, dataDict
+
+    def _arePyramidLevelsValid(self, pyramidLevels):
+        previousLevel = 1
+        for level in pyramidLevels:
+            if not isinstance(level, int) or level <= previousLevel:
+                self.exception = ValueError(
+                    "Pyramid levels should be increasing integers > 1."
+                )
+                return False
+            elif level % previousLevel != 0:
+                self.exception = ValueError(
+                    "Each pyramid level should be a multiple of the previous one."
+                )
+                return False
+            previousLevel = level
+        return True
+
+    def _pyramidVariables(self):
+        pyramidVars = []
+        for varGrp in ["independents", "dependents"]:
+            for ii in range(0, len(self.varDict[varGrp]["names"])):
+                if (
+                    self.varDict[varGrp]["shapes"][ii] == [1]
+                    and self.varDict[varGrp]["types"][ii] in PYRAMID_TYPES
+                ):
+                    pyramidVars.append((varGrp, self.varDict[varGrp]["names"][ii]))
+        return pyramidVars
+
+    def _initPyramid(self):
+        pyramidGrp = self.file.create_group("pyramid")
+        for level in self.pyramidLevels:
+            levelGrp = pyramidGrp.create_group(str(level))
+            for varGrp, varName in self._pyramidVariables():
+                levelGrp.create_dataset(
+                    varName,
+                    (0,),
+                    dtype=PYRAMID_DTYPE,
+                    chunks=(PYRAMID_CHUNK_BINS,),
+                    maxshape=(None,),
+                    **self._filterOptions()
+                )
+
+    def _updatePyramid(self, numRowsBefore, numRowsAfter):
+        """Recomputes the pyramid bins touched by rows appended to the file.
+
+        Each level is built from the one below it, so an append only reads
+        the last (partial) bin of every level plus the new rows.
+        """
+        if len(self.pyramidLevels) == 0 or numRowsAfter <= numRowsBefore:
+            return
+        for varGrp, varName in self._pyramidVariables():
+            previousLevel = 1
+            for level in self.pyramidLevels:
+                ratio = level // previousLevel
+                firstBin = numRowsBefore // level
+                lastBin = -(-numRowsAfter // level)
+                sourceStart = firstBin * ratio
+                sourceStop = -(-numRowsAfter // previousLevel)
+                if previousLevel == 1:
+                    values = self.file[varGrp][varName][sourceStart:sourceStop]
+                    values = np.asarray(values, dtype="float64")
+                    minValues = maxValues = meanValues = values
+                    counts = (~np.isnan(values)).astype("int64")
+                else:
+                    dset = self.file["pyramid"][str(previousLevel)][varName]
+                    source = dset[sourceStart:sourceStop]
+                    minValues = source["min"]
+                    maxValues = source["max"]
+                    meanValues = source["mean"]
+                    counts = source["count"]
+                bins = self._reduceBins(minValues, maxValues, meanValues, counts, ratio)
+                dset = self.file["pyramid"][str(level)][varName]
+                if dset.shape[0] < lastBin:
+                    dset.resize((lastBin,))
+                dset[firstBin:lastBin] = bins
+                previousLevel = level
+
+    def _reduceBins(self, minValues, maxValues, meanValues, counts, ratio):
+        padding = (-len(minValues)) % ratio
+        if padding > 0:
+            nanPadding = np.full(padding, np.nan)
+            minValues = np.concatenate((minValues, nanPadding))
+            maxValues = np.concatenate((maxValues, nanPadding))
+            meanValues = np.concatenate((meanValues, nanPadding))
+            counts = np.concatenate((counts, np.zeros(padding, dtype="int64")))
+        minValues = np.reshape(minValues, (-1, ratio))
+        maxValues = np.reshape(maxValues, (-1, ratio))
+        meanValues = np.reshape(meanValues, (-1, ratio))
+        counts = np.reshape(counts, (-1, ratio))
+        bins = np.empty(len(counts), dtype=PYRAMID_DTYPE)
+        bins["min"] = np.fmin.reduce(minValues, axis=1)
+        bins["max"] = np.fmax.reduce(maxValues, axis=1)
+        bins["count"] = np.sum(counts, axis=1)
+        totals = np.sum(np.where(counts > 0, meanValues * counts, 0.0), axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            bins["mean"] = totals / bins["count"]
+        return bins
+
+    def _rowRangeForIndepRange(self, indepRange, numRows):
+        indepName = self.varDict["independents"]["names"][0]
+        dset = self.file["independents"][indepName]
+        if self.varDict["independents"]["shapes"][0] != [1]:
+            raise ValueError("indepRange requires a scalar first independent variable.")
+        startIndex = self._bisectColumn(dset, numRows, indepRange[0], False)
+        stopIndex = self._bisectColumn(dset, numRows, indepRange[1], True)
+        return startIndex, stopIndex
+
+    def _bisectColumn(self, dset, numRows, value, right):
+        # first row with a value > (right) or >= (not right) the given value
+        low, high = 0, numRows
+        while low < high:
+            middle = (low + high) // 2
+            if dset[middle] < value or (right and dset[middle] == value):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _getNumRowsInFile(self):
+        if not (self.swmr and self.readOnlyFlag):
+            return self.file.attrs["Number Of Rows Added"]
+        # attributes are not refreshed for SWMR readers, so the row count
+        # comes from the (refreshed) length of every variable's dataset
+        numRows = None
+        for varGrp in ["independents", "dependents"]:
+            for ii in range(0, len(self.varDict[varGrp]["names"])):
+                dset = self.file[varGrp][self.varDict[varGrp]["names"][ii]]
+                dset.refresh()
+                flatLen = self._flatShape(self.varDict[varGrp]["shapes"][ii])[0]
+                varRows = dset.shape[0] // flatLen
+                if numRows is None or varRows < numRows:
+                    numRows = varRows
+        return numRows
+
+    def _readColumn(self, varName, startIndex, stopIndex):
+        for varGrp in ["independents", "dependents"]:
+            if varName in self.varDict[varGrp]["names"]:
+                varIndex = self.varDict[varGrp]["names"].index(varName)
+                varShape = self.varDict[varGrp]["shapes"][varIndex]
+                break
+        else:
+            raise IOError("Variable name " + str(varName) + " not found.")
+        flatLen = self._flatShape(varShape)[0]
+        dset = self.file[varGrp][varName]
+        column = dset[startIndex * flatLen : stopIndex * flatLen]
+        if varShape != [1]:
+            column = np.reshape(column, (stopIndex - startIndex,) + tuple(varShape))
+        return column
+
+    def _varNameToStr(self, varName):
+        if isinstance(varName, bytes):
+            return varName.decode("utf-8")
+        return varName
+
+    def openDataset(self, filename, modify=False, swmr=False):
+        """Opens a dataset in the current working directory if it exists.
+
+        With swmr=True a dataset created with createDataset(..., swmr=True)
+        is opened as an SWMR reader (or as the writer if modify=True), so
+        it can be read while another process keeps appending to it.
+        """
         if ".hdf5" not in filename:  # adds file extension if omitted
             filename = filename + ".hdf5"
         existingFiles = self.ls()[0]
         if filename in existingFiles:
             if hasattr(self, "file"):
+                self.flush()
                 self.file.close()  # close current file if existent
 
-            if modify is True:
+            if swmr is True and modify is True:
+                self.file = h5py.File(
+                    self.pwd() + "/" + filename, "r+", libver="latest"
+                )  # SWMR writer
+                self.currentHDF5Filename = self.pwd() + "/" + filename
+            elif swmr is True:
+                self.file = h5py.File(
+                    self.pwd() + "/" + filename, "r", libver="latest", swmr=True
+                )  # SWMR reader
+                self.currentHDF5Filename = self.pwd() + "/" + filename
+            elif modify is True:
                 self.file = h5py.File(self.pwd() + "/" + filename, "r+")  # read+write
                 self.currentHDF5Filename = self.pwd() + "/" + filename
             else:
                 self.file = h5py.File(self.pwd() + "/" + filename, "r")  # read only
                 self.currentHDF5Filename = self.pwd() + "/" + filename
 
+            if swmr is True and not self.file.attrs.get("SWMR Compatible", False):
+                self.file.close()
+                del self.file
+                self.currentHDF5Filename = None
+                raise IOError(
+                    "This dataset was not created for SWMR access.\r\n\t"
+                    + "Use createDataset(..., swmr=True) for datasets that\r\n\t"
+                    + "are read while they are being written."
+                )
+            self.swmr = swmr
+
             if modify is True:
                 self.readOnlyFlag = False
             else:
                 self.readOnlyFlag = True
 
-            for varType in list(self.varDict.keys()):  # copying varDict from file
-                varGroupAttributes = list(self.file[varType].attrs.keys())
-                varGrp = self.file[varType]
-                for item in varGroupAttributes:
-                    # hack for backward compatibility with N-d datasets
-                    if item == "shapes":
-                        tempList = varGrp.attrs[item]
-                        if type(tempList[0]) == str:
-                            tempList = self._convertElementsToLists(tempList)
-                            self.varDict[varType][str(item)] = tempList
-                        else:
-                            self.varDict[varType][str(item)] = varGrp.attrs[
-                                item
-                            ].tolist()
-                    else:
-                        self.varDict[varType][str(item)] = varGrp.attrs[item].tolist()
-
             self.dataCategory = self.file.attrs["Data Category"]
-            self.numIndepWrites = self.file.attrs["Number Of Rows Added"]
+            indexedDataset = None
+            if self.index is not None:
+                indexedDataset = self.index.getDataset(self.currentHDF5Filename)
+            if indexedDataset is not None:
+                self.varDict = indexedDataset[1]
+            else:
+                self.varDict = self._readVarDict(self.file)
+                if self.index is not None:
+                    self.index.setDataset(
+                        self.currentHDF5Filename, str(self.dataCategory), self.varDict
+                    )
+            self.storageProfile = dict(STORAGE_PROFILES[DEFAULT_STORAGE_PROFILE])
+            if "Storage Profile" in self.file.attrs:
+                self.storageProfile.update(
+                    ast.literal_eval(self.file.attrs["Storage Profile"])
+                )
+            self.pyramidLevels = []
+            if "Pyramid Levels" in self.file.attrs:
+                self.pyramidLevels = ast.literal_eval(self.file.attrs["Pyramid Levels"])
+            self._loadParameterCache()
+            self.numIndepWrites = self._getNumRowsInFile()
             self.numDepWrites = self.numIndepWrites
         else:
             self.currentHDF5Filename = None
@@ -521,6 +1080,24 @@ class dataChest(dateStamp):
                 + "the desired dataset."
             )
 
+    def _readVarDict(self, hdf5File):
+        varDict = {"independents": {}, "dependents": {}}
+        for varType in list(varDict.keys()):  # copying varDict from file
+            varGroupAttributes = list(hdf5File[varType].attrs.keys())
+            varGrp = hdf5File[varType]
+            for item in varGroupAttributes:
+                # hack for backward compatibility with N-d datasets
+                if item == "shapes":
+                    tempList = varGrp.attrs[item]
+                    if type(tempList[0]) == str:
+                        tempList = self._convertElementsToLists(tempList)
+                        varDict[varType][str(item)] = tempList
+                    else:
+                        varDict[varType][str(item)] = varGrp.attrs[item].tolist()
+                else:
+                    varDict[varType][str(item)] = varGrp.attrs[item].tolist()
+        return varDict
+
     def _getParamterTypeString(self, paramValue):
         paramTypeString = paramValue.__class__.__name__
         for ii in range(0, len(VALID_PARAMETER_TYPES)):
@@ -540,11 +1117,8 @@ class dataChest(dateStamp):
 
     def getParameterUnits(self, paramName):
         if self.currentHDF5Filename is not None:
-            if paramName in list(self.file["parameters"].attrs.keys()):
-                return None
-            elif paramName in list(self.file["parameters"].keys()):
-                paramGrp = self.file["parameters"][paramName]
-                paramUnits = str(paramGrp.attrs["units"])
+            if paramName in self.parameterCache:
+                paramUnits = self.parameterCache[paramName][2]
                 if paramUnits == "":
                     return None
                 else:
@@ -568,11 +1142,23 @@ class dataChest(dateStamp):
                 + "modify = True."
             )
         elif self.currentHDF5Filename is not None:
-            if paramName in list(self.file["parameters"].keys()):
+            if paramName in self.parameterCache:
                 if type(paramUnits) == str:
-                    paramGrp = self.file["parameters"][paramName]
-                    paramGrp.attrs["units"] = paramUnits
+                    paramValue, paramType = self.parameterCache[paramName][:2]
+                    if paramName in self.file["parameters"].keys():
+                        paramGrp = self.file["parameters"][paramName]
+                        paramGrp.attrs["units"] = paramUnits
+                    else:
+                        self._writeParameterInfo([(paramName, paramType, paramUnits)])
+                    self.parameterCache[paramName] = (paramValue, paramType, paramUnits)
                     self.file.flush()
+                    if self.index is not None:
+                        self.index.setParameter(
+                            self.currentHDF5Filename,
+                            paramName,
+                            paramType,
+                            paramUnits,
+                        )
                 else:
                     raise IOError(
                         "Parameter units must be of type string."
@@ -589,6 +1175,20 @@ class dataChest(dateStamp):
             )
 
     def addParameter(self, paramName, paramValue, paramUnits="", overwrite=False):
+        self.addParameters({paramName: paramValue}, {paramName: paramUnits}, overwrite)
+
+    def addParameters(self, paramDict, unitsDict=None, overwrite=False):
+        """Adds every parameter in paramDict, with units from unitsDict.
+
+        The values are written as attributes of the parameters group and
+        their types and units as rows of one compound dataset, so adding
+        many parameters at once takes a handful of HDF5 operations instead
+        of a group per parameter. Types HDF5 cannot store (tuple, dict) are
+        pickled. Nothing is written if any parameter is invalid.
+
+        This is parameter format 2 (see PARAMETER_FORMAT_ATTR), which
+        dataChest versions before it read without types and units.
+        """
         if self.readOnlyFlag == True:
             raise Warning(
                 "You cannot add parameters to this file as it was\r\n\t"
@@ -598,42 +1198,49 @@ class dataChest(dateStamp):
                 + "modify = True."
             )
         elif self.currentHDF5Filename is not None:
-            if self._isParameterValid(paramName, paramValue, paramUnits, overwrite):
-                if paramName not in list(self.file["parameters"].keys()):
-                    self.file["parameters"].create_group(paramName)
-
+            if unitsDict is None:
+                unitsDict = {}
+            for paramName, paramValue in paramDict.items():
+                paramUnits = unitsDict.get(paramName, "")
+                if not self._isParameterValid(
+                    paramName, paramValue, paramUnits, overwrite
+                ):
+                    raise self.exception
+            paramGrp = self.file["parameters"]
+            infoRows = []
+            for paramName, paramValue in paramDict.items():
+                paramUnits = unitsDict.get(paramName, "")
                 paramTypeStr = self._getParamterTypeString(paramValue)
-                if paramTypeStr in ["long", "tuple", "dict"]:
-                    paramValue = pickle.dumps(paramValue, protocol=0)
-                paramGrp = self.file["parameters"][paramName]
-                paramGrp.attrs["value"] = paramValue
-                paramGrp.attrs["dtype"] = paramTypeStr
-                paramGrp.attrs["units"] = paramUnits
-
-                self.file.flush()
-            else:
-                raise self.exception
+                if paramName in paramGrp.keys():  # stored as a group before
+                    del paramGrp[paramName]
+                if paramTypeStr in PICKLED_PARAMETER_TYPES:
+                    paramGrp.attrs[paramName] = np.bytes_(
+                        pickle.dumps(paramValue, protocol=0)
+                    )
+                else:
+                    paramGrp.attrs[paramName] = paramValue
+                self.parameterCache[paramName] = (
+                    self._typeCastParameter(paramValue, paramTypeStr),
+                    paramTypeStr,
+                    paramUnits,
+                )
+                infoRows.append((paramName, paramTypeStr, paramUnits))
+            self._writeParameterInfo(infoRows)
+            if PARAMETER_FORMAT_ATTR not in self.file.attrs:  # file of old format
+                self.file.attrs[PARAMETER_FORMAT_ATTR] = PARAMETER_FORMAT_VERSION
+            self.file.flush()
+            if self.index is not None:
+                self.index.setParameters(self.currentHDF5Filename, infoRows)
         else:
             raise Warning(
                 "No file is currently selected. Create a file using\r\n\t"
-                + "createDataset() before using addParameter()."
+                + "createDataset() before using addParameters()."
             )
 
     def getParameter(self, paramName, bypassIOError=False):
         if self.currentHDF5Filename is not None:
-            if paramName in list(self.file["parameters"].attrs.keys()):
-                paramValue = self.file["parameters"].attrs[
-                    paramName
-                ]  # add in type preservation here
-                return paramValue
-            elif paramName in list(self.file["parameters"].keys()):
-                paramGrp = self.file["parameters"][paramName]
-                paramValue = paramGrp.attrs["value"]
-                paramType = str(paramGrp.attrs["dtype"])
-                if paramType in ["long", "tuple", "dict"]:
-                    paramValue = pickle.loads(paramValue)
-                paramUnits = str(paramGrp.attrs["units"])
-                paramValue = self._typeCastParameter(paramValue, str(paramType))
+            if paramName in self.parameterCache:
+                paramValue, paramType, paramUnits = self.parameterCache[paramName]
                 if paramUnits == "":
                     return paramValue
                 else:
@@ -650,6 +1257,20 @@ class dataChest(dateStamp):
                 + "or with createDataset()."
             )
 
+    def getParameters(self):
+        """Returns {paramName: getParameter(paramName)} for all parameters."""
+        if self.currentHDF5Filename is not None:
+            return {
+                paramName: self.getParameter(paramName)
+                for paramName in self.parameterCache
+            }
+        else:
+            raise Warning(
+                "No file is currently selected. First select a file\r\n\t"
+                + "using either openDataset() to open an existing set\r\n\t"
+                + "or with createDataset()."
+            )
+
     def getDataCategory(self):
         if self.currentHDF5Filename is not None:
             return self.file.attrs["Data Category"]
@@ -662,13 +1283,7 @@ class dataChest(dateStamp):
 
     def getParameterList(self):
         if self.currentHDF5Filename is not None:
-            # backwards compatibility
-            paramList1 = list(self.file["parameters"].attrs.keys())
-            paramList1 = [str(x) for x in paramList1]  # convert from unicode
-            # new style parameters
-            paramList2 = list(self.file["parameters"].keys())
-            paramList2 = [str(x) for x in paramList2]
-            return paramList1 + paramList2
+            return list(self.parameterCache.keys())
         else:
             raise Warning(
                 "No file is currently selected. Please select a file\r\n\t"
@@ -676,11 +1291,99 @@ class dataChest(dateStamp):
                 + "with createDataset()."
             )
 
+    def _clearParameterCache(self):
+        # {paramName: (value, dtype, units)} of the current dataset
+        self.parameterCache = {}
+        # {paramName: row} of the parameterInfo dataset
+        self.parameterInfoRows = {}
+
+    def _loadParameterCache(self):
+        self._clearParameterCache()
+        parameters, self.parameterInfoRows = self._readParameters(self.file)
+        for paramName, (paramValue, paramType, paramUnits) in parameters.items():
+            if paramType in PICKLED_PARAMETER_TYPES:
+                if isinstance(paramValue, str):  # h5py 3 reads them as str
+                    paramValue = paramValue.encode("utf-8")
+                paramValue = pickle.loads(paramValue)
+            if paramType != "":  # untyped parameters of old files are kept as is
+                paramValue = self._typeCastParameter(paramValue, paramType)
+            self.parameterCache[paramName] = (paramValue, paramType, paramUnits)
+
+    def _readParameters(self, hdf5File):
+        """Reads the raw parameters of a file.
+
+        Returns {paramName: (value, dtype, units)} and {paramName: row} of
+        the parameterInfo dataset. Parameters are read from attributes of
+        the parameters group (typed by parameterInfo, or untyped in old
+        files) and from the group per parameter older versions wrote.
+        Files of a newer parameter format raise an IOError.
+        """
+        paramFormat = hdf5File.attrs.get(PARAMETER_FORMAT_ATTR, 1)
+        if paramFormat > PARAMETER_FORMAT_VERSION:
+            raise IOError(
+                "The parameters of this file are stored in format "
+                + str(paramFormat)
+                + ",\r\n\tbut this version of dataChest only reads formats up to "
+                + str(PARAMETER_FORMAT_VERSION)
+                + "."
+            )
+        paramGrp = hdf5File["parameters"]
+        infoRows = {}
+        paramInfo = {}
+        if PARAMETER_INFO_DATASET in hdf5File:
+            info = hdf5File[PARAMETER_INFO_DATASET][...]
+            for row in range(0, len(info)):
+                paramName = self._varNameToStr(info[row]["name"])
+                infoRows[paramName] = row
+                paramInfo[paramName] = (
+                    self._varNameToStr(info[row]["dtype"]),
+                    self._varNameToStr(info[row]["units"]),
+                )
+        parameters = {}
+        for paramName, paramValue in paramGrp.attrs.items():
+            paramType, paramUnits = paramInfo.get(str(paramName), ("", ""))
+            parameters[str(paramName)] = (paramValue, paramType, paramUnits)
+        for paramName in paramGrp.keys():
+            grp = paramGrp[paramName]
+            parameters[str(paramName)] = (
+                grp.attrs["value"],
+                str(grp.attrs["dtype"]),
+                str(grp.attrs["units"]),
+            )
+        return parameters, infoRows
+
+    def _writeParameterInfo(self, infoRows):
+        """Writes (name, dtype, units) rows, appending new names at once."""
+        if PARAMETER_INFO_DATASET not in self.file:
+            self.file.create_dataset(
+                PARAMETER_INFO_DATASET,
+                (0,),
+                dtype=PARAMETER_INFO_DTYPE,
+                maxshape=(None,),
+                chunks=(PARAMETER_INFO_CHUNK_ROWS,),
+            )
+        dset = self.file[PARAMETER_INFO_DATASET]
+        newRows = []
+        for infoRow in infoRows:
+            if infoRow[0] in self.parameterInfoRows:
+                dset[self.parameterInfoRows[infoRow[0]]] = infoRow
+            else:
+                newRows.append(infoRow)
+        if len(newRows) > 0:
+            numRows = dset.shape[0]
+            dset.resize((numRows + len(newRows),))
+            dset[numRows:] = np.array(newRows, dtype=PARAMETER_INFO_DTYPE)
+            for row in range(0, len(newRows)):
+                self.parameterInfoRows[newRows[row][0]] = numRows + row
+
     def _initDataset(self, varDict, filename):
         self.numIndepWrites = 0
         self.numDepWrites = 0
 
-        self.file = h5py.File(self.pwd() + "/" + filename, "w")  # Try catch this
+        if self.swmr:
+            self.file = h5py.File(self.pwd() + "/" + filename, "w", libver="latest")
+        else:
+            self.file = h5py.File(self.pwd() + "/" + filename, "w")  # Try catch this
         self.currentHDF5Filename = self.pwd() + "/" + filename
         self.readOnlyFlag = False  # gives user read and write access
 
@@ -688,9 +1391,15 @@ class dataChest(dateStamp):
         self.file.create_group("independents")
         self.file.create_group("dependents")
         self.file.create_group("parameters")
+        self._clearParameterCache()
 
         self.file.attrs["Data Category"] = self.dataCategory
         self.file.attrs["Number Of Rows Added"] = 0
+        self.file.attrs["Storage Profile"] = str(self.storageProfile)
+        self.file.attrs["Pyramid Levels"] = str(self.pyramidLevels)
+        self.file.attrs[PARAMETER_FORMAT_ATTR] = PARAMETER_FORMAT_VERSION
+        if self.swmr:
+            self.file.attrs["SWMR Compatible"] = True
 
         # varTypes in ['independents', 'dependents']
         # varAttrs in ['shapes','units','names','types']
@@ -719,6 +1428,8 @@ class dataChest(dateStamp):
                     # TypeError: No conversion path for dtype: dtype('<U9')
 
             self._initDatasetGroup(varGrp, varDict[varTypes])
+        if len(self.pyramidLevels) > 0:
+            self._initPyramid()
         self.file.flush()
 
     def setVariableUnits(self, varName, varUnits):
@@ -745,6 +1456,10 @@ class dataChest(dateStamp):
                         self.file[varTypes][varName].attrs["units"] = str(
                             varUnits, "utf-8"
                         )
+                        if self.index is not None:
+                            self.index.setDataset(
+                                self.currentHDF5Filename, self.dataCategory, varDict
+                            )
                         return
         raise IOError("Variable name " + str(varName) + " not found.")
 
@@ -775,6 +1490,8 @@ class dataChest(dateStamp):
 
     def _initDatasetGroup(self, group, varDict):
         for ii in range(0, len(varDict["names"])):
+            # SWMR readers count rows from the dataset length, so SWMR
+            # datasets start out empty instead of with one placeholder row
             # creates a datatype, chunksize, maxshape, fillvalue for each var
             varType = varDict["types"][ii]
             if varType == "string":
@@ -782,10 +1499,11 @@ class dataChest(dateStamp):
                 dShape = tuple(self._flatShape(varDict["shapes"][ii]))
                 dset = group.create_dataset(
                     varDict["names"][ii],
-                    dShape,
+                    (0,) if self.swmr else dShape,
                     dtype=dataType,
-                    chunks=dShape,
+                    chunks=self._chunkShape(dShape, np.dtype(dataType)),
                     maxshape=(None,),
+                    **self._filterOptions()
                 )
             else:
                 if varType == "utc_datetime":
@@ -794,17 +1512,14 @@ class dataChest(dateStamp):
                     dataType = varDict["types"][ii]
                 fillVal = None
                 dShape = tuple(self._flatShape(varDict["shapes"][ii]))
-                if dShape == (1,):
-                    chunkShape = (10000,)
-                else:
-                    chunkShape = dShape
                 dset = group.create_dataset(
                     varDict["names"][ii],
-                    dShape,
+                    (0,) if self.swmr else dShape,
                     dtype=dataType,
-                    chunks=chunkShape,
+                    chunks=self._chunkShape(dShape, np.dtype(dataType)),
                     maxshape=(None,),
                     fillvalue=fillVal,
+                    **self._filterOptions()
                 )
 
             # stores name, shape, type, and units as attributes for this dset
@@ -823,6 +1538,72 @@ class dataChest(dateStamp):
                         + str(type(varDict[keys][ii]))
                     )
 
+    def _chunkShape(self, dShape, dataType):
+        chunkRows = self.storageProfile["chunkRows"]
+        if chunkRows is None:
+            if dShape == (1,):
+                return (10000,)
+            else:
+                return dShape
+        maxRows = max(1, MAX_CHUNK_BYTES // (dShape[0] * dataType.itemsize))
+        return (dShape[0] * min(chunkRows, maxRows),)
+
+    def _filterOptions(self):
+        options = {}
+        if self.storageProfile["compression"] is not None:
+            options["compression"] = self.storageProfile["compression"]
+            if self.storageProfile["compressionLevel"] is not None:
+                options["compression_opts"] = self.storageProfile["compressionLevel"]
+        if self.storageProfile["shuffle"]:
+            options["shuffle"] = True
+        if self.storageProfile["fletcher32"]:
+            options["fletcher32"] = True
+        return options
+
+    def _resolveStorageProfile(self, storageProfile):
+        if isinstance(storageProfile, str):
+            if storageProfile not in STORAGE_PROFILES:
+                self.exception = ValueError(
+                    "Unknown storage profile: "
+                    + storageProfile
+                    + "\r\n\t"
+                    + "Valid profiles="
+                    + str(sorted(STORAGE_PROFILES.keys()))
+                )
+                return None
+            return dict(STORAGE_PROFILES[storageProfile])
+        elif isinstance(storageProfile, dict):
+            profile = dict(STORAGE_PROFILES[DEFAULT_STORAGE_PROFILE])
+            for key in storageProfile:
+                if key not in profile:
+                    self.exception = ValueError(
+                        "Unknown storage profile key: "
+                        + str(key)
+                        + "\r\n\t"
+                        + "Valid keys="
+                        + str(sorted(profile.keys()))
+                    )
+                    return None
+            profile.update(storageProfile)
+            if profile["compression"] not in VALID_COMPRESSION_FILTERS:
+                self.exception = ValueError(
+                    "Invalid compression filter provided.\r\n\t"
+                    + "Valid filters="
+                    + str(VALID_COMPRESSION_FILTERS)
+                )
+                return None
+            elif profile["chunkRows"] is not None and (
+                not isinstance(profile["chunkRows"], int) or profile["chunkRows"] <= 0
+            ):
+                self.exception = ValueError("chunkRows must be a positive integer.")
+                return None
+            return profile
+        else:
+            self.exception = TypeError(
+                "Storage profiles should be a profile name or a dict."
+            )
+            return None
+
     def _generateUniqueFilename(self, datasetName, dateStamp):
         uniquenessFlag = False
         uniqueName = ""
@@ -1021,7 +1802,7 @@ class dataChest(dateStamp):
         os.utime(self.currentHDF5Filename, None)
         if numWrites == 0:
             data = np.reshape(data, (chunkSize,))
-            if dset.shape[0] == 1 and len(dset.shape) == 1:  # arbitrary type 1 hack
+            if dset.shape[0] != chunkSize:  # arbitrary type 1 hack, empty SWMR sets
                 dset.resize((chunkSize,))
             dset[:chunkSize] = data
         else:
@@ -1083,6 +1864,134 @@ class dataChest(dateStamp):
             return False
         return True
 
+    def _dataBlockColumns(self, data):
+        """Validates a block of rows column by column.
+
+        Returns a list with one array of shape (numRows,) + varShape per
+        variable, or None (with self.exception set) if the block is invalid.
+        """
+        if not isinstance(data, (list, np.ndarray)):
+            self.exception = TypeError("The dataset provided was not of type list.")
+            return None
+        elif len(data) == 0:
+            self.exception = ValueError("Vacuous datasets are invalid.")
+            return None
+        names = (
+            self.varDict["independents"]["names"] + self.varDict["dependents"]["names"]
+        )
+        shapes = (
+            self.varDict["independents"]["shapes"]
+            + self.varDict["dependents"]["shapes"]
+        )
+        types = (
+            self.varDict["independents"]["types"] + self.varDict["dependents"]["types"]
+        )
+        numVars = len(names)
+        numRows = len(data)
+        if isinstance(data, np.ndarray) and data.dtype != object and data.ndim >= 2:
+            if data.shape[1] != numVars:
+                self.exception = ValueError(
+                    "Incorrect number of data columns provided."
+                )
+                return None
+            columns = np.swapaxes(data, 0, 1)
+        else:
+            try:
+                rowLengths = set(map(len, data))
+            except TypeError:
+                self.exception = TypeError(
+                    "Data entered should be of the form: \r\n\t"
+                    + "[[indep1_0, indep2_0, dep1_0, dep2_0], ... \r\n\t"
+                    + "[indep1_n, indep2_n, dep1_n, dep2_n]]"
+                )
+                return None
+            if rowLengths != {numVars}:
+                self.exception = ValueError(
+                    "Incorrect number of data columns provided."
+                )
+                return None
+            columns = list(zip(*data))
+        validColumns = []
+        for ii in range(0, numVars):
+            if shapes[ii] == [1]:
+                expectedShape = (numRows,)
+            else:
+                expectedShape = (numRows,) + tuple(shapes[ii])
+            if types[ii] == "string":
+                column = np.asarray(columns[ii], dtype=object)
+            else:
+                column = np.asarray(columns[ii])
+            if column.shape != expectedShape:
+                self.exception = ValueError(
+                    "Data shapes do not match for variable "
+                    + str(names[ii])
+                    + ".\r\n\t"
+                    + "Expected shape: "
+                    + str(expectedShape[1:])
+                    + ".\r\n\t"
+                    + "Shape received: "
+                    + str(column.shape[1:])
+                )
+                return None
+            elif types[ii] == "string":
+                if not all(isinstance(x, str) for x in column.flat):
+                    self.exception = TypeError("Expecting string data.")
+                    return None
+            elif types[ii] == "utc_datetime":
+                if column.dtype.name != "float64":
+                    self.exception = TypeError("utc_datetime data should be a float64.")
+                    return None
+            elif column.dtype.name != types[ii]:
+                self.exception = TypeError(
+                    "Expected all entries of "
+                    + str(names[ii])
+                    + " to be of type:\r\n\t"
+                    + types[ii]
+                    + "\r\n\t"
+                    + "Instead received data of type:\r\n\t"
+                    + column.dtype.name
+                )
+                return None
+            validColumns.append(column)
+        if self.dataCategory == "1D Scan":
+            if not self._isBlockFormat1DScan(validColumns):
+                return None
+        elif self.dataCategory == "2D Scan":
+            if not self._isBlockFormat2DScan(validColumns):
+                return None
+        return validColumns
+
+    def _isBlockFormat1DScan(self, columns):
+        """Checks the columns of a 1D Scan block as _isDataFormat1DScan does rows."""
+        if columns[0].shape[1:] != (2,):
+            self.exception = ValueError(
+                "For 1D Scan Data, the first\r\n\t"
+                + "entry should be an array of\r\n\t"
+                + "the form [t_start, t_stop]\r\n\t"
+            )
+            return False
+        for column in columns[1:]:
+            if column.ndim != 2:
+                self.exception = ValueError(
+                    "Column entry has incorrect size\r\n\t"
+                    + "or shape.\r\n\t"
+                    + "Expecting a 1D array per row."
+                )
+                return False
+        return True
+
+    def _isBlockFormat2DScan(self, columns):
+        """Checks the columns of a 2D Scan block as _isDataFormat2DScan does rows."""
+        indepShapes = (columns[0].shape[1:], columns[1].shape[1:])
+        if indepShapes not in [((), (2,)), ((2,), ())]:
+            self.exception = ValueError("Invalid data shape for 2D Scan.")
+            return False
+        for column in columns[2:]:
+            if column.ndim != 2:
+                self.exception = ValueError("Column shape mismatch.")
+                return False
+        return True
+
     def _isRowValid(self, dataList):
         numIndeps = len(self.varDict["independents"]["names"])
         numDeps = len(self.varDict["dependents"]["names"])
@@ -1248,17 +2157,8 @@ class dataChest(dateStamp):
                 return False
             elif type(paramUnits) != str and type(paramUnits) != np.string_:
                 self.exception = ValueError("Parameter units must be type str.")
-            elif overwrite is False and paramName in list(
-                self.file["parameters"].attrs.keys()
-            ):
-                self.exception = RuntimeError(
-                    "Parameter name already exists. \r\n\t"
-                    + "Parameter values cannot be overwritten."
-                )
                 return False
-            elif overwrite is False and paramName in list(
-                self.file["parameters"].keys()
-            ):
+            elif overwrite is False and paramName in self.parameterCache:
                 self.exception = RuntimeError(
                     "Parameter name already exists. \r\n\t"
                     + "Parameter values cannot be overwritten."
@@ -1639,7 +2539,7 @@ class dataChest(dateStamp):
         for ii in range(0, len(allShapes)):
             if ii == 0 and allShapes[ii] != [2]:
                 return False
-            elif len(allShapes[ii]) != 1 or allShapes[ii] < 2:
+            elif len(allShapes[ii]) != 1 or allShapes[ii][0] < 2:
                 return False
             elif ii > 1 and allShapes[ii] != lastShape:
                 return False
@@ -1656,7 +2556,7 @@ class dataChest(dateStamp):
             return False
         else:
             for ii in range(0, len(depShapes)):
-                if len(depShapes[ii]) != 1 or depShapes[ii] < 2:
+                if len(depShapes[ii]) != 1 or depShapes[ii][0] < 2:
                     return False
                 elif ii > 0 and depShapes[ii] != lastShape:
                     return False
@@ -1664,6 +2564,43 @@ class dataChest(dateStamp):
         return True
 
 
+class dataCursor(object):
+    """Tail reader for the dataset currently open in a dataChest.
+
+    The cursor remembers the index of the last row it returned, so each call
+    to getNewData reads only the rows appended since the previous call,
+    reusing the open file and the dataChest's varDict.
+    """
+
+    def __init__(self, chest, variablesList=None, startIndex=0):
+        self.chest = chest
+        self.filename = chest.currentHDF5Filename
+        self.variablesList = variablesList
+        self.lastRow = startIndex
+
+    def getNumNewRows(self):
+        self._checkDataset()
+        return max(0, self.chest.getNumRows() - self.lastRow)
+
+    def getNewData(self, structured=False):
+        """Returns the rows appended since the last call, one array per variable."""
+        self._checkDataset()
+        numRows = self.chest.getNumRows()
+        startIndex = min(self.lastRow, numRows)
+        data = self.chest.getDataColumns(
+            startIndex, numRows, self.variablesList, structured
+        )
+        self.lastRow = numRows
+        return data
+
+    def _checkDataset(self):
+        if self.chest.currentHDF5Filename != self.filename:
+            raise Warning(
+                "The dataset this cursor was created for is no longer open.\r\n\t"
+                + "Create a new cursor with getCursor()."
+            )
+
+
 # automatically close file when new one is created or object is killed
 # make sure that files are always closed and we dont run into file already open conflicts
 ##TODO:
@@ -0,0 +1,315 @@
+"""
+Per-user SQLite index of a dataChest DATA_ROOT tree.
+
+The index caches directory listings, per-dataset metadata (date stamp,
+dataset name, data category, variable definitions) and parameter names and
+units so that navigating large (network mounted) data trees does not need
+an os.listdir for every path component and an attribute walk for every
+opened file.
+
+Every cached listing is stored with the modification time of its directory
+and every dataset with the inode, modification time and size of its file. A
+listing whose directory has changed, or a dataset whose file has been
+replaced or modified, is treated as missing and read again from the file
+system, so the index repairs itself when files are added or changed by other
+programs. dataChest.rebuildIndex() rebuilds it from the HDF5 files from
+scratch.
+
+dataChest uses the index by default (useIndex=True). It is a cache on the
+local disk of each user, in ~/.dataChestIndex, with one file per DATA_ROOT
+and schema version, and never in DATA_ROOT itself: DATA_ROOT is often a
+shared network drive, where SQLite locking is not reliable.
+
+If the index cannot be opened or written (e.g. it is locked or corrupt) it
+disables itself for this process, without touching the file, and dataChest
+falls back to the file system. Deleting the file starts a new index.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+
+INDEX_DIRECTORY = os.path.join(os.path.expanduser("~"), ".dataChestIndex")
+INDEX_SCHEMA_VERSION = 2
+# index files are named after the DATA_ROOT they index and the schema
+# version, so that different dataChest versions keep separate indexes
+INDEX_FILENAME = "index_{root}.v{version}.sqlite"
+# listings of directories and datasets of files modified more recently than
+# this are not cached, as a second change within the file system's mtime
+# resolution would go unnoticed
+RACY_MTIME_SECONDS = 2.0
+DATESTAMP_RE = re.compile(r"^([a-z]{3}[0-9]{4}[a-z]{3})_(?:[0-9]+_)?(.*)\.hdf5$")
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)",
+    "CREATE TABLE IF NOT EXISTS directories (" "path TEXT PRIMARY KEY, mtime REAL)",
+    "CREATE TABLE IF NOT EXISTS entries ("
+    "directory TEXT, name TEXT, isFile INTEGER, PRIMARY KEY (directory, name))",
+    "CREATE TABLE IF NOT EXISTS datasets ("
+    "path TEXT PRIMARY KEY, directory TEXT, dateStamp TEXT, "
+    "datasetName TEXT, category TEXT, varDict TEXT, "
+    "inode INTEGER, mtime REAL, size INTEGER)",
+    "CREATE TABLE IF NOT EXISTS parameters ("
+    "path TEXT, name TEXT, dtype TEXT, units TEXT, PRIMARY KEY (path, name))",
+]
+
+
+class dataChestIndex(object):
+    def __init__(self, root):
+        self.root = root.replace("\\", "/")
+        rootHash = hashlib.sha1(self.root.encode("utf-8")).hexdigest()[:16]
+        self.filename = os.path.join(
+            INDEX_DIRECTORY,
+            INDEX_FILENAME.format(root=rootHash, version=INDEX_SCHEMA_VERSION),
+        )
+        self.connection = None
+        try:
+            if not os.path.isdir(INDEX_DIRECTORY):
+                os.makedirs(INDEX_DIRECTORY)
+            self._connect()
+        except (sqlite3.Error, OSError):
+            # locked, unreadable or corrupt, run without the index
+            self._close()
+
+    def isEnabled(self):
+        return self.connection is not None
+
+    def _connect(self):
+        self.connection = sqlite3.connect(
+            self.filename, timeout=5.0, isolation_level=None
+        )
+        for statement in SCHEMA:
+            self.connection.execute(statement)
+        row = self.connection.execute(
+            "SELECT value FROM info WHERE key = 'version'"
+        ).fetchone()
+        if row is None:
+            self.connection.execute(
+                "INSERT INTO info VALUES ('version', ?)", (str(INDEX_SCHEMA_VERSION),)
+            )
+        elif int(row[0]) != INDEX_SCHEMA_VERSION:
+            self._close()
+
+    def _close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def _execute(self, statement, args=()):
+        """Runs one statement, disabling the index if SQLite fails."""
+        if self.connection is None:
+            return None
+        try:
+            return self.connection.execute(statement, args)
+        except sqlite3.Error:
+            self._close()
+            return None
+
+    def _executemany(self, statement, rows):
+        """Runs one statement per row in a single transaction."""
+        if self.connection is None:
+            return
+        try:
+            self.connection.execute("BEGIN")
+            self.connection.executemany(statement, rows)
+            self.connection.execute("COMMIT")
+        except sqlite3.Error:
+            self._close()
+
+    def _relative(self, path):
+        path = path.replace("\\", "/")
+        if path == self.root:
+            return ""
+        return path[len(self.root) + 1 :]
+
+    def clear(self, path=None):
+        """Removes everything indexed in the tree under path (default: all)."""
+        relPath = "" if path is None else self._relative(path)
+        for table, column in [
+            ("directories", "path"),
+            ("entries", "directory"),
+            ("datasets", "path"),
+            ("parameters", "path"),
+        ]:
+            if relPath == "":
+                self._execute("DELETE FROM " + table)
+            else:
+                self._execute(
+                    "DELETE FROM "
+                    + table
+                    + " WHERE {0} = ? OR substr({0}, 1, ?) = ?".format(column),
+                    (relPath, len(relPath) + 1, relPath + "/"),
+                )
+
+    def directoryMtime(self, path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def _isRacy(self, mtime):
+        return mtime is None or time.time() - mtime < RACY_MTIME_SECONDS
+
+    def getListing(self, path):
+        """Returns ([files, folders], mtime) for a directory.
+
+        The listing is None if the directory is not indexed or has changed
+        since it was; mtime is the directory's current modification time.
+        """
+        mtime = self.directoryMtime(path)
+        relPath = self._relative(path)
+        cursor = self._execute(
+            "SELECT mtime FROM directories WHERE path = ?", (relPath,)
+        )
+        row = cursor.fetchone() if cursor is not None else None
+        if row is None or mtime is None or row[0] != mtime:
+            return None, mtime
+        cursor = self._execute(
+            "SELECT name, isFile FROM entries WHERE directory = ?", (relPath,)
+        )
+        if cursor is None:
+            return None, mtime
+        filesList = []
+        foldersList = []
+        for name, isFile in cursor.fetchall():
+            if isFile:
+                filesList.append(name)
+            else:
+                foldersList.append(name)
+        return [sorted(filesList), sorted(foldersList)], mtime
+
+    def setListing(self, path, mtime, filesList, foldersList):
+        """Stores a listing of path read while it had modification time mtime."""
+        if self.connection is None or self._isRacy(mtime):
+            return
+        relPath = self._relative(path)
+        self._execute("DELETE FROM entries WHERE directory = ?", (relPath,))
+        rows = [(relPath, name, 1) for name in filesList]
+        rows = rows + [(relPath, name, 0) for name in foldersList]
+        self._executemany("INSERT INTO entries VALUES (?, ?, ?)", rows)
+        self._execute(
+            "INSERT OR REPLACE INTO directories VALUES (?, ?)", (relPath, mtime)
+        )
+
+    def addEntry(self, path, name, isFile, previousMtime):
+        """Adds a file or folder created in path to its cached listing.
+
+        previousMtime is the directory's modification time before the entry
+        was created. If the cached listing was not current at that point it
+        is dropped instead, so the next listing reads the directory again.
+        """
+        relPath = self._relative(path)
+        cursor = self._execute(
+            "SELECT mtime FROM directories WHERE path = ?", (relPath,)
+        )
+        row = cursor.fetchone() if cursor is not None else None
+        if row is None:
+            return
+        mtime = self.directoryMtime(path)
+        if row[0] != previousMtime or "/" in name or self._isRacy(mtime):
+            self._execute("DELETE FROM directories WHERE path = ?", (relPath,))
+            return
+        self._execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+            (relPath, name, int(isFile)),
+        )
+        self._execute(
+            "INSERT OR REPLACE INTO directories VALUES (?, ?)", (relPath, mtime)
+        )
+
+    def _fileStat(self, filePath):
+        """Returns (inode, mtime, size) of a file, or None."""
+        try:
+            stat = os.stat(filePath)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime, stat.st_size
+
+    def getDataset(self, filePath):
+        """Returns (category, varDict) for an indexed dataset, or None."""
+        cursor = self._execute(
+            "SELECT category, varDict, inode, mtime, size FROM datasets "
+            "WHERE path = ?",
+            (self._relative(filePath),),
+        )
+        row = cursor.fetchone() if cursor is not None else None
+        if row is None or tuple(row[2:]) != self._fileStat(filePath):
+            return None
+        return row[0], json.loads(row[1])
+
+    def setDataset(self, filePath, category, varDict):
+        """Indexes a dataset with its category and variable definitions."""
+        fileStat = self._fileStat(filePath)
+        if fileStat is None or self._isRacy(fileStat[1]):
+            # still found by findDatasets, but read from the file when opened
+            fileStat = (None, None, None)
+        try:
+            varDict = json.dumps(varDict)
+        except TypeError:
+            return
+        relPath = self._relative(filePath)
+        directory, filename = relPath.rpartition("/")[::2]
+        match = DATESTAMP_RE.match(filename)
+        if match is not None:
+            dateStamp, datasetName = match.group(1), match.group(2)
+        else:
+            dateStamp, datasetName = "", filename
+        self._execute(
+            "INSERT OR REPLACE INTO datasets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (relPath, directory, dateStamp, datasetName, category, varDict) + fileStat,
+        )
+
+    def setParameter(self, filePath, paramName, paramType, paramUnits):
+        self._execute(
+            "INSERT OR REPLACE INTO parameters VALUES (?, ?, ?, ?)",
+            (self._relative(filePath), paramName, paramType, paramUnits),
+        )
+
+    def setParameters(self, filePath, parameters):
+        """Indexes a list of (name, dtype, units) parameters of a dataset."""
+        relPath = self._relative(filePath)
+        rows = [(relPath, name, dtype, units) for name, dtype, units in parameters]
+        self._executemany("INSERT OR REPLACE INTO parameters VALUES (?, ?, ?, ?)", rows)
+
+    def getParameters(self, filePath):
+        """Returns {name: (dtype, units)} of the indexed parameters of a dataset."""
+        cursor = self._execute(
+            "SELECT name, dtype, units FROM parameters WHERE path = ?",
+            (self._relative(filePath),),
+        )
+        if cursor is None:
+            return {}
+        return {name: (dtype, units) for name, dtype, units in cursor.fetchall()}
+
+    def removeParameters(self, filePath):
+        self._execute(
+            "DELETE FROM parameters WHERE path = ?", (self._relative(filePath),)
+        )
+
+    def findDatasets(self, datasetName=None, dateStamp=None, directory=None):
+        """Returns the DATA_ROOT relative paths of matching indexed datasets."""
+        conditions = []
+        args = []
+        for column, value in [
+            ("datasetName", datasetName),
+            ("dateStamp", dateStamp),
+            ("directory", directory),
+        ]:
+            if value is not None:
+                conditions.append(column + " = ?")
+                args.append(value)
+        statement = "SELECT path FROM datasets"
+        if len(conditions) > 0:
+            statement = statement + " WHERE " + " AND ".join(conditions)
+        cursor = self._execute(statement + " ORDER BY path", tuple(args))
+        if cursor is None:
+            return []
+        return [row[0] for row in cursor.fetchall()]
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
@@ -574,57 +574,33 @@ class Main(QtGui.QWidget):
         return fig
 
     def makeGrid(self, x, xGridRes, dX, y, yGridRes, dY, sweepType, z):
-        totalNumPts = len(x)
-
+        # Pads the points of an incomplete sweep with the grid positions
+        # still to be measured (z = NaN there) and reshapes x, y and z into
+        # (xGridRes, yGridRes) grids.
         if sweepType == "Y":
             # Y sweep type ==> fix x, sweep y, then go to x+dx and
             # sweep y again...
-            divNmod = divmod(len(x), yGridRes)
-            numFullYslices = divNmod[0]
-            numPartiallyComplete = divNmod[1]
+            numFullYslices, numPartiallyComplete = divmod(len(x), yGridRes)
+            numComplete = yGridRes * numFullYslices
             if numFullYslices < xGridRes:
-                npxRemainder = np.array([])
-                npyRemainder = np.array([])
-                # What kind of beast is the line below?
-                nanArray = np.zeros(
-                    shape=(
-                        yGridRes * xGridRes
-                        - yGridRes * numFullYslices
-                        - numPartiallyComplete,
-                    )
+                remainingSlices = np.arange(numFullYslices, xGridRes)
+                npxRemainder = np.repeat(dX * remainingSlices + x[0], yGridRes)
+                npyRemainder = np.tile(
+                    np.linspace(y[0], y[0] + (yGridRes - 1) * dY, num=yGridRes),
+                    len(remainingSlices),
                 )
-                nanArray[:] = np.NAN
-                # Is this pseudo-23 dimensional space definition?
-                npzRemainder = np.concatenate(
-                    [
-                        z[
-                            yGridRes * numFullYslices : yGridRes * numFullYslices
-                            + numPartiallyComplete
-                        ],
-                        nanArray,
-                    ]
-                )
-                for ii in range(numFullYslices, xGridRes):
-                    npxRemainder = np.concatenate(
-                        [
-                            npxRemainder,
-                            np.linspace(dX * ii + x[0], dX * ii + x[0], num=yGridRes),
-                        ]
-                    )
-                    npyRemainder = np.concatenate(
-                        [
-                            npyRemainder,
-                            np.linspace(y[0], y[0] + (yGridRes - 1) * dY, num=yGridRes),
-                        ]
-                    )
+                npzRemainder = np.full(yGridRes * len(remainingSlices), np.nan)
+                npzRemainder[:numPartiallyComplete] = z[
+                    numComplete : numComplete + numPartiallyComplete
+                ]
             else:
                 npxRemainder = np.array([])
                 npyRemainder = np.array([])
                 npzRemainder = np.array([])
 
-            npx = np.concatenate([x[0 : yGridRes * numFullYslices], npxRemainder])
-            npy = np.concatenate([y[0 : yGridRes * numFullYslices], npyRemainder])
-            npz = np.concatenate([z[0 : yGridRes * numFullYslices], npzRemainder])
+            npx = np.concatenate([x[0:numComplete], npxRemainder])
+            npy = np.concatenate([y[0:numComplete], npyRemainder])
+            npz = np.concatenate([z[0:numComplete], npzRemainder])
 
             npx = npx.reshape(xGridRes, yGridRes).T
             npy = npy.reshape(xGridRes, yGridRes).T
@@ -632,49 +608,26 @@ class Main(QtGui.QWidget):
         elif sweepType == "X":
             # X sweep type ==> fix y, sweep x, then go to x+dy and
             # sweep y again...
-            divNmod = divmod(len(x), xGridRes)
-            numFullXslices = divNmod[0]
-            numPartiallyComplete = divNmod[1]
+            numFullXslices, numPartiallyComplete = divmod(len(x), xGridRes)
+            numComplete = xGridRes * numFullXslices
             if numFullXslices < yGridRes:
-                npxRemainder = np.array([])
-                npyRemainder = np.array([])
-                nanArray = np.zeros(
-                    shape=(
-                        yGridRes * xGridRes
-                        - xGridRes * numFullXslices
-                        - numPartiallyComplete,
-                    )
+                remainingSlices = np.arange(numFullXslices, yGridRes)
+                npyRemainder = np.repeat(dY * remainingSlices + y[0], xGridRes)
+                npxRemainder = np.tile(
+                    np.linspace(x[0], x[0] + (xGridRes - 1) * dX, num=xGridRes),
+                    len(remainingSlices),
                 )
-                nanArray[:] = np.NAN
-                npzRemainder = np.concatenate(
-                    [
-                        z[
-                            xGridRes * numFullXslices : xGridRes * numFullXslices
-                            + numPartiallyComplete
-                        ],
-                        nanArray,
-                    ]
-                )
-                for ii in range(numFullXslices, yGridRes):
-                    npyRemainder = np.concatenate(
-                        [
-                            npyRemainder,
-                            np.linspace(dY * ii + y[0], dY * ii + y[0], num=xGridRes),
-                        ]
-                    )
-                    npxRemainder = np.concatenate(
-                        [
-                            npxRemainder,
-                            np.linspace(x[0], x[0] + (xGridRes - 1) * dX, num=xGridRes),
-                        ]
-                    )
+                npzRemainder = np.full(xGridRes * len(remainingSlices), np.nan)
+                npzRemainder[:numPartiallyComplete] = z[
+                    numComplete : numComplete + numPartiallyComplete
+                ]
             else:
                 npxRemainder = np.array([])
                 npyRemainder = np.array([])
                 npzRemainder = np.array([])
-            npx = np.concatenate([x[0 : xGridRes * numFullXslices], npxRemainder])
-            npy = np.concatenate([y[0 : xGridRes * numFullXslices], npyRemainder])
-            npz = np.concatenate([z[0 : xGridRes * numFullXslices], npzRemainder])
+            npx = np.concatenate([x[0:numComplete], npxRemainder])
+            npy = np.concatenate([y[0:numComplete], npyRemainder])
+            npz = np.concatenate([z[0:numComplete], npzRemainder])
 
             npx = npx.reshape(xGridRes, yGridRes)
             npy = npy.reshape(xGridRes, yGridRes)
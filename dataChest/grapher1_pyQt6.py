@@ -25,12 +25,36 @@ HEX_COLOR_MAP = {'white': '#FFFFFF', 'silver': '#FFFFFF', 'gray': '#808080',
                  'purple':'#800080'}
 
 ACCEPTABLE_DATA_CATEGORIES = ["Arbitrary Type 1", "Arbitrary Type 2", "1D Scan", "2D Scan"]
+# categories whose plots grow with every row added, the others only plot
+# their first row
+GROWING_DATA_CATEGORIES = ["Arbitrary Type 1", "2D Scan"]
 
 STYLE_DEFAULTS = {
     'font-size': '35pt',
     'font-color': 'black'}
 
 
+class ColumnBuffer(object):
+    """A 2D array that grows by columns.  The columns are kept at the start of
+    a buffer that doubles in size when full, so appending copies only the
+    new columns.  data is a view of the columns appended so far."""
+    def __init__(self, data):
+        self.buffer = np.array(data)
+        self.length = self.buffer.shape[1]
+        self.data = self.buffer[:, :self.length]
+
+    def append(self, newData):
+        end = self.length + newData.shape[1]
+        dtype = np.result_type(self.buffer, newData)
+        if end > self.buffer.shape[1] or dtype != self.buffer.dtype:
+            grown = np.empty((self.buffer.shape[0], max(end, 2*self.buffer.shape[1])), dtype=dtype)
+            grown[:, :self.length] = self.data
+            self.buffer = grown
+        self.buffer[:, self.length:end] = newData
+        self.length = end
+        self.data = self.buffer[:, :self.length]
+
+
 class TimeAxisItem(pg.AxisItem):
     def __init__(self, *args, **kwargs):
         #  super().__init__(*args, **kwargs)
@@ -206,6 +230,13 @@ class Grapher(QtWidgets.QWidget): # python 2to3: QtGui.QWidget >> QtWidgets.QWid
         self.datasetName = None
         self.depVarsList = []
         self.selectedData = None
+        self.datasetCategory = None
+        self.scanType = None
+        self.cursor = None
+        self.curves = []
+        self.gridData = None
+        self.selectedBuffer = None
+        self.curveBuffer = None
 
         self.plotType = None
         self.selectedDepVars = []
@@ -225,16 +256,19 @@ class Grapher(QtWidgets.QWidget): # python 2to3: QtGui.QWidget >> QtWidgets.QWid
         """This is not implemented yet, but will eventually allow plugins to be
         defined to alter the data."""
         # self.unalteredData = self.data
-        pluginList =  [str(self.pluginTypesList.item(i).text())
-                            for i in range(self.pluginTypesList.count())
-                            if self.pluginTypesList.item(i).checkState() == QtCore.Qt.CheckState.Checked]
-        for plugin in pluginList:
-            plugin = import_module('Plugins.'+plugin[:-3])
+        for plugin in self.getCheckedPlugins():
             # print(self.selectedData, self.selectedData)
             self.selectedData = plugin.run(self.selectedData)
             # print(self.selectedData, self.selectedData)
         self.updatePlotTypeSelector()
 
+    def getCheckedPlugins(self):
+        """Plugin modules that are checked, in list order."""
+        pluginList =  [str(self.pluginTypesList.item(i).text())
+                            for i in range(self.pluginTypesList.count())
+                            if self.pluginTypesList.item(i).checkState() == QtCore.Qt.CheckState.Checked]
+        return [import_module('Plugins.'+plugin[:-3]) for plugin in pluginList]
+
     def pluginClicked(self, item):
         pass
         # if item.checkState() == QtCore.Qt.CheckState.Checked:
@@ -305,11 +339,61 @@ class Grapher(QtWidgets.QWidget): # python 2to3: QtGui.QWidget >> QtWidgets.QWid
             modDate = os.stat(self.filePathStr).st_mtime
             if self.lastModDate != modDate:
                 self.lastModDate = modDate
-                self.prepareData()
+                if not self.appendNewData():
+                    self.prepareData()
+
+    def appendNewData(self):
+        """Read only the rows added to the dataset since it was last read and
+        add them to the current plot in place.  Returns False if the plot has
+        to be rebuilt with prepareData instead, i.e. when something other than
+        rows changed or a checked plugin is not row local.
+
+        A plugin module that sets ROW_LOCAL = True declares that its run
+        transforms each point (column of the data) on its own, so it is run
+        on the new points only.  Plugins without it are assumed to need all
+        the data."""
+        if self.cursor is None or self.cursor.lastRow == 0:
+            return False
+        plugins = self.getCheckedPlugins()
+        if not all(getattr(plugin, 'ROW_LOCAL', False) for plugin in plugins):
+            return False
+        d = self.d
+        d.cd(self.filePathArray[:-1])
+        d.openDataset(self.filePathArray[-1])
+        d.cd("")
+        if self.cursor.getNumNewRows() == 0:
+            return False
+        columns = self.cursor.getNewData()
+        if self.datasetCategory not in GROWING_DATA_CATEGORIES:
+            return True
+        if self.datasetCategory == "2D Scan":
+            newData = self.expandScanData(columns, self.scanType)
+            newData = newData.reshape(newData.shape[0], -1)
+        else:
+            newData = np.array([columns[name] for name in self.getVarNames()])
+        for plugin in plugins:
+            newData = plugin.run(newData)
+        if self.selectedBuffer is None or self.selectedBuffer.data is not self.selectedData:
+            self.selectedBuffer = ColumnBuffer(self.selectedData)
+        self.selectedBuffer.append(newData)
+        self.selectedData = self.selectedBuffer.data
+
+        if len(self.selectedDepVars) > 0:
+            if len(self.indepVarsList) == 1 and len(self.curves) > 0:
+                x_data_modified, yVals = self.getCurveData(newData)[:2]
+                self.curveBuffer.append(np.vstack([x_data_modified[0], yVals]))
+                for i in range(len(self.curves)):
+                    self.curves[i].setData(x=self.curveBuffer.data[0],
+                                           y=self.curveBuffer.data[i+1])
+            elif len(self.indepVarsList) == 2 and self.gridData is not None:
+                self.extendIndepData(newData)
+                self.updateImage()
+        return True
 
     def prepareData(self):
         stime = time()
         d = self.d
+        self.lastModDate = os.stat(self.filePathStr).st_mtime
         d.cd(self.filePathArray[:-1])
         d.openDataset(self.filePathArray[-1])
         datasetVariables = d.getVariables()
@@ -318,6 +402,11 @@ class Grapher(QtWidgets.QWidget): # python 2to3: QtGui.QWidget >> QtWidgets.QWid
         self.indepVarsList = datasetVariables[0]
         self.depVarsList = datasetVariables[1]
         datasetCategory = d.getDataCategory()
+        self.datasetCategory = datasetCategory
+        self.cursor = None
+        self.curves = []
+        self.gridData = None
+        self.selectedBuffer = None
         d.cd("")
 
         if datasetCategory not in ACCEPTABLE_DATA_CATEGORIES:
@@ -326,29 +415,27 @@ class Grapher(QtWidgets.QWidget): # python 2to3: QtGui.QWidget >> QtWidgets.QWid
 
         if datasetCategory == "Arbitrary Type 1":
             data = [d.getData().T]
+            numRowsRead = data[0].shape[1]
         elif datasetCategory == "Arbitrary Type 2":
             data = d.getData()
+            numRowsRead = len(data)
         # extract scan part of data so it is a complete, normal data set
         elif datasetCategory == "1D Scan" or datasetCategory == "2D Scan":
-            l = self.depVarsList[0][1][0] # len of first dim in shape of first dep var
             scanType = d.getParameter("Scan Type", bypassIOError=True)
-            data = np.array(d.getData()) #test
-            for j in range(len(data)):
-                row = data[j]
-                for i in range(len(self.indepVarsList)):
-                    if self.indepVarsList[i][1] == [1]:
-                        data[j][i] = [row[i]] * l
-                    elif self.indepVarsList[i][1] == [2]:
-                        start, stop = row[i]
-                        if scanType is None:
-                            print("Scan Type Not Found.  Assuming Linear.")
-                            data[j][i] = np.linspace(start, stop, num = l)
-                        elif scanType == "Linear":
-                            data[j][i] = np.linspace(start, stop, num = l)
-                        elif scanType == "Logarithmic":
-                            data[j][i] = np.logspace(np.log10(start), np.log10(stop), num = l)
-            if datasetCategory == "2D Scan": #not working don't know why
-               data = [np.concatenate(data, axis=1)]
+            self.scanType = scanType
+            if datasetCategory == "1D Scan":
+                # only the first scan is plotted
+                columns = d.getDataColumns(0, 1)
+            else:
+                columns = d.getDataColumns()
+            data = self.expandScanData(columns, scanType)
+            if datasetCategory == "1D Scan":
+                numRowsRead = d.getNumRows()
+            else:
+                numRowsRead = data.shape[1]
+            # each column is one point, scans placed one after another
+            data = [data.reshape(data.shape[0], -1)]
+        self.cursor = d.getCursor(startIndex=numRowsRead)
 
         data = np.array(data[0])
 
@@ -497,25 +584,84 @@ class Grapher(QtWidgets.QWidget): # python 2to3: QtGui.QWidget >> QtWidgets.QWid
             elif len(self.indepVarsList) == 2:
                 self.plot2D()
 
+    def getVarNames(self):
+        """Names of the indep and dep vars in the order of the data rows."""
+        return [var[0].decode('UTF-8') if isinstance(var[0], bytes) else var[0]
+                for var in self.indepVarsList + self.depVarsList]
+
+    def expandScanData(self, columns, scanType):
+        """
+        Expand the data of a 1D or 2D Scan into a (numVars, numRows, l) array,
+        where l is the scan length of the first dep var. Indep vars with
+        shape [1] are repeated along the scan and those with shape [2]
+        ([start, stop]) are replaced by the scanned values, all rows at once.
+        """
+        l = self.depVarsList[0][1][0] # len of first dim in shape of first dep var
+        if scanType is None:
+            print("Scan Type Not Found.  Assuming Linear.")
+        names = self.getVarNames()
+        numRows = len(columns[names[0]])
+        data = np.empty((len(names), numRows, l))
+        for i in range(len(names)):
+            column = np.asarray(columns[names[i]], dtype=float)
+            if i < len(self.indepVarsList) and self.indepVarsList[i][1] == [2]:
+                start, stop = column[:, 0], column[:, 1]
+                if scanType == "Logarithmic":
+                    data[i] = np.logspace(np.log10(start), np.log10(stop), num=l, axis=1)
+                else:
+                    data[i] = np.linspace(start, stop, num=l, axis=1)
+            else:
+                data[i] = column.reshape(numRows, -1)
+        return data
+
     def extractIndepData(self, data):
         """
         Take the data and turn it into two arrays:
           indepData is a list of dep vars ranges (ranges are sorted by value)
           depData is the associated vector of values associated with the dep vars
         This is done by first skimming off the indep vars, sorting them, and then
-        going through the rows of data and setting the value of each spot in the
-        vector.  The data must be in the form where each column is a point in the
-        dataset (Type 2 data).  The first row of each dimension is the indep vals.
+        looking up the position of every point in them, which gives the spot in
+        the vector to set for each point.  The data must be in the form where
+        each column is a point in the dataset (Type 2 data).  The first row of
+        each dimension is the indep vals.
         """
-        indepData = [np.unique(np.array(data[i])) for i in range(len(self.indepVarsList))]
+        numIndeps = len(self.indepVarsList)
+        indepData = []
+        indepIndicies = []
+        for i in range(numIndeps):
+            values, indicies = np.unique(np.array(data[i]), return_inverse=True)
+            indepData.append(values)
+            indepIndicies.append(indicies.ravel())
         indepShape = [len(v) for v in indepData]
+        indepIndicies = tuple(indepIndicies)
         depData = [np.full(indepShape, np.nan) for _ in range(len(self.depVarsList))]
-        for row in data.T:    # go though each row and fill data
-            indepVals = row[:len(indepData)]
-            indepIndicies = tuple([np.where(indepData[i]==indepVals[i])[0][0] for i in range(len(indepVals))])
-            for i in range(len(depData)):
-                depData[i][indepIndicies] = row[i+len(self.indepVarsList)]
+        for i in range(len(depData)):
+            depData[i][indepIndicies] = data[i+numIndeps]
         return indepData, depData
+
+    def extendIndepData(self, newData):
+        """
+        Add the points in newData (in the same form as for extractIndepData)
+        to self.gridData.  Grids only get copied when a new indep value
+        appears, the existing values are then moved to their new positions.
+        """
+        indepData, depData = self.gridData
+        numIndeps = len(self.indepVarsList)
+        oldIndicies = []
+        for i in range(numIndeps):
+            values = np.union1d(indepData[i], newData[i])
+            oldIndicies.append(np.searchsorted(values, indepData[i]))
+            indepData[i] = values
+        indepShape = tuple([len(v) for v in indepData])
+        if indepShape != depData[0].shape:
+            for i in range(len(depData)):
+                grownData = np.full(indepShape, np.nan)
+                grownData[np.ix_(*oldIndicies)] = depData[i]
+                depData[i] = grownData
+        indepIndicies = tuple([np.searchsorted(indepData[i], newData[i])
+                               for i in range(numIndeps)])
+        for i in range(len(depData)):
+            depData[i][indepIndicies] = newData[i+numIndeps]
     
     def unit_conversion(self, data=None, unit=None):
         """
@@ -545,17 +691,26 @@ class Grapher(QtWidgets.QWidget): # python 2to3: QtGui.QWidget >> QtWidgets.QWid
                 return unit[1::]
         
     
-    def plot1D(self):
-        stime=time()
-        if self.cb is not None:
-            self.cb.hide()
+    def getCurveData(self, data=None):
+        """Returns the unit converted x data, the y data of the selected dep
+        vars and their common unit for a 1D plot of data (default: all the
+        selected data)."""
+        if data is None:
+            data = self.selectedData
         varNames = [var[0].decode('UTF-8') if isinstance(var[0],np.bytes_) else var[0] for var in self.depVarsList]        # python 2to3: decode numpy.bytes_ strings
         varUnits = [var[3].decode('UTF-8') if isinstance(var[3],np.bytes_) else var[3] for var in self.depVarsList]        # python 2to3: decode numpy.bytes_ strings
         indicies = [varNames.index((var if isinstance(var,str) else var.decode('UTF-8')))+1 for var in self.selectedDepVars]
         commonUnit = varUnits[indicies[0]-1]
-        yVals = self.selectedData[indicies,:]
+        yVals = data[indicies,:]
         x_unit = self.indepVarsList[0][3].decode('UTF-8') if isinstance(self.indepVarsList[0][3], np.bytes_) else self.indepVarsList[0][3]
-        x_data_modified = self.unit_conversion(data=self.selectedData[0], unit=x_unit)
+        x_data_modified = self.unit_conversion(data=data[0], unit=x_unit)
+        return x_data_modified, yVals, commonUnit
+
+    def plot1D(self):
+        stime=time()
+        if self.cb is not None:
+            self.cb.hide()
+        x_data_modified, yVals, commonUnit = self.getCurveData()
         pOptions = {
                 "X Scale": "Linear",
                 "X Label": self.indepVarsList[0][0].decode('UTF-8') if isinstance(self.indepVarsList[0][0], np.bytes_) else self.indepVarsList[0][0],   # python 2to3: decode numpy.bytes_ strings
@@ -587,10 +742,13 @@ class Grapher(QtWidgets.QWidget): # python 2to3: QtGui.QWidget >> QtWidgets.QWid
         font.setPointSize(25)
         self.p.getAxis('bottom').setStyle(tickTextOffset=5, tickFont=font)
         self.p.getAxis('left').setStyle(tickTextOffset=5, tickFont=font)
+        self.curves = []
+        # the curves' data, which new points are appended to
+        self.curveBuffer = ColumnBuffer(np.vstack([x_data_modified[0], yVals]))
         for i in range(len(self.selectedDepVars)):
-            self.p.plot( x=x_data_modified[0], y=yVals[i],
+            self.curves.append(self.p.plot( x=x_data_modified[0], y=yVals[i],
                      name = self.selectedDepVars[i],
-                     pen=(i,len(self.selectedDepVars)))
+                     pen=(i,len(self.selectedDepVars))))
         
         self.proxy = pg.SignalProxy(self.p.scene().sigMouseMoved, rateLimit=60, slot=self.mouseMoved)
 
@@ -598,14 +756,11 @@ class Grapher(QtWidgets.QWidget): # python 2to3: QtGui.QWidget >> QtWidgets.QWid
 
     def plot2D(self):
         stime = time()
-        (xVals_raw, yVals_raw), depGrids = self.extractIndepData(self.selectedData)
+        self.gridData = self.extractIndepData(self.selectedData)
         x_unit_dataChest = self.indepVarsList[0][3].decode('UTF-8') if isinstance(self.indepVarsList[0][3], np.bytes_) else self.indepVarsList[0][3]
         y_unit_dataChest = self.indepVarsList[1][3].decode('UTF-8') if isinstance(self.indepVarsList[1][3], np.bytes_) else self.indepVarsList[1][3]
-        (xVals, x_unit) = self.unit_conversion(xVals_raw, x_unit_dataChest)
-        (yVals, y_unit) = self.unit_conversion(yVals_raw, y_unit_dataChest)
-
-        varNames = [var[0].decode('UTF-8') if isinstance(var[0],np.bytes_) else var[0] for var in self.depVarsList]     # python 2to3: decode numpy.bytes_ strings
-        index = varNames.index(self.selectedDepVars[0].decode('UTF-8') if isinstance(self.selectedDepVars[0], np.bytes_) else self.selectedDepVars[0])     # python 2to3: decode numpy.bytes_ strings
+        x_unit = self.unit_conversion(unit=x_unit_dataChest)
+        y_unit = self.unit_conversion(unit=y_unit_dataChest)
 
         self.graphicsLayout.clear()
         axis = {}
@@ -623,9 +778,32 @@ class Grapher(QtWidgets.QWidget): # python 2to3: QtGui.QWidget >> QtWidgets.QWid
         font.setPointSize(25)
         self.p.getAxis('bottom').setStyle(tickTextOffset=5, tickFont=font)
         self.p.getAxis('left').setStyle(tickTextOffset=1, tickFont=font)
-        img = pg.ImageItem()
+        self.img = pg.ImageItem()
+        self.p.addItem(self.img)
+        self.updateImage()
+        self.proxy = pg.SignalProxy(self.p.scene().sigMouseMoved, rateLimit=60, slot=self.mouseMoved)
+
+        axis = self.p.getAxis('left')
+        axis.tickFont = self.font
+        axis.setWidth(100)
+        axis = self.p.getAxis('bottom').tickFont = self.font
+
+        self.p.autoRange()
+
+    def updateImage(self):
+        """Draw the grid of the selected dep var from self.gridData into the
+        image of the 2D plot and redo its colorbar."""
+        (xVals_raw, yVals_raw), depGrids = self.gridData
+        x_unit_dataChest = self.indepVarsList[0][3].decode('UTF-8') if isinstance(self.indepVarsList[0][3], np.bytes_) else self.indepVarsList[0][3]
+        y_unit_dataChest = self.indepVarsList[1][3].decode('UTF-8') if isinstance(self.indepVarsList[1][3], np.bytes_) else self.indepVarsList[1][3]
+        (xVals, x_unit) = self.unit_conversion(xVals_raw, x_unit_dataChest)
+        (yVals, y_unit) = self.unit_conversion(yVals_raw, y_unit_dataChest)
+
+        varNames = [var[0].decode('UTF-8') if isinstance(var[0],np.bytes_) else var[0] for var in self.depVarsList]     # python 2to3: decode numpy.bytes_ strings
+        index = varNames.index(self.selectedDepVars[0].decode('UTF-8') if isinstance(self.selectedDepVars[0], np.bytes_) else self.selectedDepVars[0])     # python 2to3: decode numpy.bytes_ strings
+
+        img = self.img
         img.setImage(depGrids[index])
-        self.p.addItem(img)
         pixelX = (xVals[-1]-xVals[0])/len(xVals)
         pixelY = (yVals[-1]-yVals[0])/len(yVals)
         tr=QtGui.QTransform()
@@ -636,7 +814,6 @@ class Grapher(QtWidgets.QWidget): # python 2to3: QtGui.QWidget >> QtWidgets.QWid
         self.xValPass = xVals
         self.yValPass = yVals
         self.zValPass = depGrids[index]
-        self.proxy = pg.SignalProxy(self.p.scene().sigMouseMoved, rateLimit=60, slot=self.mouseMoved)
 
         # bipolar colormap
         pos = np.array([0., 0.125, 0.375, 0.667, 0.933, 1.])
@@ -655,6 +832,8 @@ class Grapher(QtWidgets.QWidget): # python 2to3: QtGui.QWidget >> QtWidgets.QWid
 
         if self.cb is not None:
             self.cb.hide()
+            if self.cb.scene() is not None:
+                self.cb.scene().removeItem(self.cb)
 
         self.cb = ColorBar(cmap, 10, 200, min, max, label=self.selectedDepVars[0], tick_labels = tick_labels)
         tr=QtGui.QTransform()
@@ -666,13 +845,6 @@ class Grapher(QtWidgets.QWidget): # python 2to3: QtGui.QWidget >> QtWidgets.QWid
 
         self.p.scene().addItem(self.cb)
 
-        axis = self.p.getAxis('left')
-        axis.tickFont = self.font
-        axis.setWidth(100)
-        axis = self.p.getAxis('bottom').tickFont = self.font
-
-        self.p.autoRange()
-
     def clearLayout(self, layout):
         # Clear the plotType options layout and all widgets therein.
         for i in reversed(list(range(layout.count()))):
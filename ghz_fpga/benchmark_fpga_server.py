@@ -0,0 +1,131 @@
+# Measures the throughput of the GHz FPGA server, in sequences per second,
+# with emulated boards (see fpgalib/emulator.py) instead of hardware. The
+# server detects the boards and runs its Run Sequence setting unmodified, so
+# this catches throughput regressions in the server itself.
+#
+# One board group with MAX_DACS build 8 DACs and a build 7 ADC is emulated.
+# For each configuration, NUM_POINTS sequences with new SRAM data are run
+# with IN_FLIGHT of them in flight at a time, as a pipelining client would,
+# against the first n DACs and the ADC, which returns demodulated data of
+# one channel. Paging off uses SRAM too long for one page. Also reported
+# is the median time of each pipeline stage (see the Pipeline Timing
+# setting).
+#
+# Usage:
+#     python benchmark_fpga_server.py [latency_ms] [runTimeScale]
+#
+# latency_ms is the emulated direct ethernet request latency (default 0.2),
+# runTimeScale the fraction of the sequence duration the emulated boards
+# take to run (default 0, i.e. the server is the bottleneck).
+
+import sys
+import time
+import numpy as np
+from twisted.internet import defer, task
+from twisted.internet.defer import inlineCallbacks, returnValue
+
+import ghz_fpga_server
+import fpgalib.dac as dac
+from fpgalib import emulator
+
+GROUP = "Benchmark"
+MAX_DACS = 4
+ADC_BOARD = 100
+STATS = [300, 3000, 30000]
+NUM_DACS = [1, 2, 4]
+# SRAM words per DAC, to have paging on or off
+SRAM_WORDS = {True: 2000, False: 12000}
+NUM_POINTS = 40
+IN_FLIGHT = 2
+
+
+def memorySequence(sramWords):
+    mem = dac.MemorySequence()
+    mem.noOp().sramStartAddress(0).sramEndAddress(sramWords - 1)
+    mem.startTimer().runSram().delayCycles(100).stopTimer().branchToStart()
+    return list(mem)
+
+
+def configure(server, c, numDacs, paging):
+    dacs = ["{} DAC {}".format(GROUP, i) for i in range(1, numDacs + 1)]
+    adcName = "{} ADC {}".format(GROUP, ADC_BOARD)
+    for name in dacs:
+        server.select_device(c, name)
+        server.dac_memory(c, memorySequence(SRAM_WORDS[paging]))
+    server.select_device(c, adcName)
+    server.adc_run_mode(c, "demodulate")
+    server.start_delay(c, 0)
+    server.adc_trigger_table(c, [(1, 100, 50, 1)])
+    server.adc_mixer_table(c, 0, np.zeros((512, 2), dtype=int))
+    server.sequence_boards(c, dacs + [adcName])
+    server.sequence_timing_order(c, [adcName + "::0"])
+    return dacs
+
+
+@inlineCallbacks
+def benchmark(server, c, numDacs, paging, stats):
+    dacs = configure(server, c, numDacs, paging)
+    (boardGroup,) = list(server.boardGroups.values())
+    for times in boardGroup.stageTimes.values():
+        times.clear()
+    inFlight = []
+    start = time.time()
+    for point in range(NUM_POINTS):
+        # new SRAM data for every point, as in a sweep
+        for name in dacs:
+            server.select_device(c, name)
+            server.dac_sram(c, np.full(SRAM_WORDS[paging], point, dtype="<u4"))
+        inFlight.append(server.run_sequence(c, stats, True))
+        if len(inFlight) >= IN_FLIGHT:
+            yield inFlight.pop(0)
+    yield defer.gatherResults(inFlight)
+    rate = NUM_POINTS / (time.time() - start)
+    medians = [
+        np.median(boardGroup.stageTimes[stage].times()) * 1e3
+        for stage in ghz_fpga_server.PIPELINE_STAGES
+    ]
+    returnValue((rate, medians))
+
+
+@inlineCallbacks
+def main(reactor, latency=0.2, runTimeScale=0.0):
+    boards = [("DAC", i, 8, 0) for i in range(1, MAX_DACS + 1)]
+    boards.append(("ADC", ADC_BOARD, 7, 0))
+    cxn = emulator.emulatedConnection(
+        [(GROUP, 1, boards)], latency=latency * 1e-3, runTimeScale=runTimeScale
+    )
+    server = ghz_fpga_server.FPGAServer()
+    emulator.useConnection(server, cxn)
+    yield server.initServer()
+    c = server.newContext(1)
+    server.initContext(c)
+
+    print(
+        "%-7s %6s %6s %10s   %s"
+        % (
+            "paging",
+            "boards",
+            "stats",
+            "seq/s",
+            " ".join("%8s" % s for s in ghz_fpga_server.PIPELINE_STAGES)
+            + "  (median [ms])",
+        )
+    )
+    for paging in [True, False]:
+        for numDacs in NUM_DACS:
+            for stats in STATS:
+                rate, medians = yield benchmark(server, c, numDacs, paging, stats)
+                print(
+                    "%-7s %6d %6d %10.1f   %s"
+                    % (
+                        "on" if paging else "off",
+                        numDacs + 1,
+                        stats,
+                        rate,
+                        " ".join("%8.2f" % m for m in medians),
+                    )
+                )
+
+
+if __name__ == "__main__":
+    task.react(main, [float(x) for x in sys.argv[1:]])
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import copy
 import logging
 import numpy as np
 
@@ -146,7 +147,7 @@ class ADC(fpga.FPGA):
     @staticmethod
     def readback2BuildNumber(resp):
         """Get build number from register readback"""
-        a = np.fromstring(resp, dtype="<u1")
+        a = np.frombuffer(resp, dtype="<u1")
         return a[0]
 
 
@@ -251,8 +252,8 @@ class ADC_Branch1(ADC):
     def extractAverage(packets):
         """Extract Average waveform from a list of packets (byte strings)."""
 
-        data = "".join(packets)
-        Is, Qs = np.fromstring(data, dtype="<i2").reshape(-1, 2).astype(int).T
+        data = b"".join(packets)
+        Is, Qs = np.frombuffer(data, dtype="<i2").reshape(-1, 2).astype(int).T
         return (Is, Qs)
 
 
@@ -371,6 +372,9 @@ class ADC_Build1(ADC_Branch1):
 
     def buildRunner(self, reps, info):
         """Get a runner for this board"""
+        # The runner reads the settings after the run, when the context may
+        # already hold the settings of the next run in a pipeline or batch.
+        info = copy.deepcopy(info)
         runMode = info["runMode"]
         startDelay = info["startDelay"]
         filter = (info["filterFunc"], info["filterStretchLen"], info["filterStretchAt"])
@@ -520,7 +524,7 @@ class ADC_Build1(ADC_Branch1):
             executionCounter - int: Number of executions since last start
         """
         raise RuntimeError("Check this function for correctness")
-        a = np.fromstring(resp, dtype="<u1")
+        a = np.frombuffer(resp, dtype="<u1")
         raise RuntimeError("check parity of pll latch bits")
         return {
             "build": a[0],
@@ -530,16 +534,13 @@ class ADC_Build1(ADC_Branch1):
     @staticmethod
     def extractDemod(packets, nDemod):
         """Extract Demodulation data from a list of packets (byte strings)."""
-        # stick all data strings in packets together, chopping out last 4 bytes
-        # from each string
-        data = "".join(data[:44] for data in packets)
-        # Convert string of bytes into numpy array of 16bit integers. <i2 means
-        # little endian 2 byte
-        vals = np.fromstring(data, dtype="<i2")
+        # View all packets at once as records, chopping out the last 4 bytes
+        # of each packet
+        records = ADC_Build1._demodRecords(packets)
         # Is,Qs are numpy arrays with the following format
         # [I0,I1,...,I_numChannels,    I0,I1,...,I_numChannels]
         #           1st data run                2nd data run
-        Is, Qs = vals.reshape(-1, 2).astype(int).T
+        Is, Qs = records["iq"].reshape(-1, 2).astype(int).T
         # Parse the IQ data into the following format
         # [(Is ch0, Qs ch0), (Is ch1, Qs ch1),...,(Is chnDemod, Qs chnDemod)]
         data = (Is, Qs)
@@ -547,21 +548,45 @@ class ADC_Build1(ADC_Branch1):
         # data = [(Is[i::nDemod], Qs[i::nDemod]) for i in xrange(nDemod)]
         # data_saved = data
         # compute overall max and min for I and Q
-        def getRange(pkt):
-            Irng, Qrng = [ord(i) for i in pkt[46:48]]
-            twosComp = lambda i: int(i if i < 0x8 else i - 0x10)
-            Imax = twosComp((Irng >> 4) & 0xF)  # << 12
-            Imin = twosComp((Irng >> 0) & 0xF)  # << 12
-            Qmax = twosComp((Qrng >> 4) & 0xF)  # << 12
-            Qmin = twosComp((Qrng >> 0) & 0xF)  # << 12
-            return Imax, Imin, Qmax, Qmin
-
-        ranges = np.array([getRange(pkt) for pkt in packets]).T
-        Imax = int(max(ranges[0]))
-        Imin = int(min(ranges[1]))
-        Qmax = int(max(ranges[2]))
-        Qmin = int(min(ranges[3]))
-        return (data, (Imax, Imin, Qmax, Qmin))
+        Imax, Imin, Qmax, Qmin = ADC_Build1.getRange(records["range"])
+        return (
+            data,
+            (int(Imax.max()), int(Imin.min()), int(Qmax.max()), int(Qmin.min())),
+        )
+
+    @staticmethod
+    def getRange(ranges):
+        """Decode the I and Q range bytes of demodulation packets.
+
+        ranges is an (n, 2) array of the I and Q range bytes of n packets.
+        Returns arrays (Imax, Imin, Qmax, Qmin) with one entry per packet.
+        """
+        ranges = np.asarray(ranges, dtype=int)
+        nibbles = np.stack([(ranges >> 4) & 0xF, ranges & 0xF], axis=-1)
+        # four bit twos complement
+        nibbles = np.where(nibbles < 0x8, nibbles, nibbles - 0x10)  # << 12
+        return nibbles[:, 0, 0], nibbles[:, 0, 1], nibbles[:, 1, 0], nibbles[:, 1, 1]
+
+    @staticmethod
+    def _demodRecords(packets):
+        """View demodulation packets as an array of records.
+
+        Each record has the fields iq (the 11 pairs of 16-bit I and Q values)
+        and range (the I and Q range bytes).
+        """
+        data = b"".join(packets)
+        pktLen = len(packets[0]) if len(packets) else 48
+        if len(data) != pktLen * len(packets):
+            raise RuntimeError("demodulation packets differ in length")
+        dtype = np.dtype(
+            {
+                "names": ["iq", "range"],
+                "formats": [("<i2", (22,)), ("u1", (2,))],
+                "offsets": [0, 46],
+                "itemsize": pktLen,
+            }
+        )
+        return np.frombuffer(data, dtype=dtype)
 
 
 fpga.REGISTRY[("ADC", 1)] = ADC_Build1
@@ -591,7 +616,7 @@ class ADC_Build2(ADC_Build1):
             executionCounter - int: Number of executions since last start
         """
         # raise RuntimeError("Check this function for correctness")
-        a = np.fromstring(resp, dtype="<u1")
+        a = np.frombuffer(resp, dtype="<u1")
         # raise RuntimeError("check parity of pll latch bits")
         return {
             "build": a[0],
@@ -632,7 +657,66 @@ class ADC_Build6(ADC_Build2):
 fpga.REGISTRY[("ADC", 6)] = ADC_Build6
 
 
+class DemodReduction(object):
+    """Running per-trigger statistics of demodulated IQ data.
+
+    Blocks of data indexed (channel, stat, trigger, I/Q) are added with add().
+    Only the number of stats, the mean and the summed squared deviation from
+    the mean of each (channel, trigger, I/Q) are kept, and blocks are combined
+    with the pairwise update of Chan et al., so the full data never needs to
+    be held in memory.
+
+    thresholds is a dict {channel: (threshold, angle)}. For these channels a
+    stat counts as above threshold when I*cos(angle) + Q*sin(angle) is larger
+    than threshold.
+    """
+
+    def __init__(self, nChannels, nTriggers, thresholds=None):
+        self.thresholds = thresholds or {}
+        self.n = 0
+        self.mean = np.zeros((nChannels, nTriggers, 2))
+        self.m2 = np.zeros((nChannels, nTriggers, 2))
+        self.counts = np.full((nChannels, nTriggers), -1, dtype=int)
+        for channel in self.thresholds:
+            if channel < nChannels:
+                self.counts[channel] = 0
+
+    def add(self, data):
+        """Add a block of data indexed (channel, stat, trigger, I/Q)."""
+        nBlock = data.shape[1]
+        if nBlock == 0:
+            return
+        blockMean = data.mean(axis=1)
+        blockM2 = ((data - blockMean[:, None]) ** 2).sum(axis=1)
+        n = self.n + nBlock
+        delta = blockMean - self.mean
+        self.mean += delta * (float(nBlock) / n)
+        self.m2 += blockM2 + delta**2 * (float(self.n) * nBlock / n)
+        self.n = n
+        if self.thresholds:
+            states = ADC_Build7.demodStates(data, self.thresholds)
+            for channel in self.thresholds:
+                if channel < data.shape[0]:
+                    self.counts[channel] += states[channel].sum(axis=0)
+
+    def variance(self):
+        """Population variance (as numpy.var) of each (channel, trigger, I/Q)."""
+        if self.n == 0:
+            return np.zeros_like(self.m2)
+        return self.m2 / self.n
+
+    def channel(self, channel):
+        """Returns (mean, variance, counts) of one demodulator channel.
+
+        counts is -1 for every trigger if the channel has no threshold.
+        """
+        return self.mean[channel], self.variance()[channel], self.counts[channel]
+
+
 class AdcRunner_Build7(AdcRunner_Build2):
+    # Number of stats extracted and added to a reduction at a time
+    REDUCTION_CHUNK_STATS = 1024
+
     def __init__(self, dev, reps, runMode, startDelay, channels, info):
         self.dev = dev
         self.reps = reps
@@ -705,8 +789,60 @@ class AdcRunner_Build7(AdcRunner_Build2):
             return self.dev.extractAverage(packets)
         elif self.runMode == "demodulate":
             return self.dev.extractDemod(
-                packets, self.info["triggerTable"], self.info.get("mode", "iq")
+                packets,
+                self.info["triggerTable"],
+                self.info.get("mode", "iq"),
+                self.dev.thresholdsFor(self.info),
+            )
+
+    def reduce(self, packets):
+        """Extract demodulation data into a DemodReduction.
+
+        The packets are extracted REDUCTION_CHUNK_STATS stats at a time and
+        added to the running statistics, so that the full data array for all
+        stats is never built.
+        """
+        reduction = self.makeReduction()
+        for start in range(0, len(packets), self.reductionChunkPackets()):
+            self.addToReduction(
+                reduction, packets[start : start + self.reductionChunkPackets()]
+            )
+        return reduction
+
+    def makeReduction(self):
+        """An empty DemodReduction for the data of this run."""
+        if self.runMode != "demodulate" or self.info.get("mode", "iq") != "iq":
+            raise RuntimeError(
+                "Reduction of ADC '%s' needs demodulate mode with IQ readout"
+                % (self.dev.devName,)
             )
+        triggerTable = self.info["triggerTable"]
+        rchan = triggerTable[0][3]
+        nTriggers = sum(trig[0] for trig in triggerTable)
+        return DemodReduction(rchan, nTriggers, self.dev.thresholdsFor(self.info))
+
+    def reductionChunkPackets(self):
+        """Number of packets holding REDUCTION_CHUNK_STATS stats."""
+        return self.nPackets // self.reps * self.REDUCTION_CHUNK_STATS
+
+    def reductionReadPackets(self):
+        """Packets reading the data in chunks of reductionChunkPackets.
+
+        The chunks can be added to a reduction as they arrive, so that not
+        even the packets of all stats are held in memory at once.
+        """
+        chunk = self.reductionChunkPackets()
+        return [
+            self.dev.read(min(chunk, self.nPackets - start))
+            for start in range(0, self.nPackets, chunk)
+        ]
+
+    def addToReduction(self, reduction, packets):
+        """Extract demodulation packets of whole stats into a reduction."""
+        data, pktCounters, readbackCounters = self.dev.extractDemod(
+            packets, self.info["triggerTable"], "iq"
+        )
+        reduction.add(data)
 
 
 class ADC_Branch2(ADC):
@@ -874,8 +1010,8 @@ class ADC_Branch2(ADC):
     def extractAverage(packets):
         """Extract Average waveform from a list of packets (byte strings)."""
 
-        data = "".join(packets)
-        Is, Qs = np.fromstring(data, dtype="<i2").reshape(-1, 2).astype(int).T
+        data = b"".join(packets)
+        Is, Qs = np.frombuffer(data, dtype="<i2").reshape(-1, 2).astype(int).T
         return (Is, Qs)
 
 
@@ -898,6 +1034,9 @@ class ADC_Build7(ADC_Branch2):
     def buildRunner(self, reps, info):
         """Get a runner for this board"""
         logging.info("building runner with setting keys: {}".format(list(info.keys())))
+        # The runner reads the settings after the run, when the context may
+        # already hold the settings of the next run in a pipeline or batch.
+        info = copy.deepcopy(info)
         runMode = info["runMode"]
         startDelay = info["startDelay"]
         channels = dict((i, info[i]) for i in range(self.DEMOD_CHANNELS) if i in info)
@@ -1078,7 +1217,9 @@ class ADC_Build7(ADC_Branch2):
             # server parse the packets out and return data. packets is a list
             # of 48-byte strings
             packets = [data for src, dst, eth, data in ans.read]
-            returnValue(self.extractDemod(packets, triggerTable, mode))
+            returnValue(
+                self.extractDemod(packets, triggerTable, mode, self.thresholdsFor(info))
+            )
 
         return self.testMode(func)
 
@@ -1110,7 +1251,7 @@ class ADC_Build7(ADC_Branch2):
         ...
         d(46)	spare[7..0]		set to 0
         """
-        a = np.fromstring(resp, dtype="<u1")
+        a = np.frombuffer(resp, dtype="<u1")
         return {
             "build": a[0],
             "noPllLatch": bool(a[1] & 1),
@@ -1121,12 +1262,20 @@ class ADC_Build7(ADC_Branch2):
         }
 
     @classmethod
-    def extractDemod(cls, packets, triggerTable, mode):
+    def extractDemod(cls, packets, triggerTable, mode, thresholds=None):
         """
         Extract Demodulation data from a list of packets (byte strings).
 
         Returns a tuple of (demodData, packet counters, readback counters)
 
+        mode is either "iq" or "bits". In "bits" mode each IQ point is
+        thresholded on its channel's (threshold, angle) from thresholds, a
+        dict {channel: (threshold, angle)}, see demodStates. demodData is then
+        a 3-index array of uint32 words indexed (channel, stat, word), and bit
+        k of word w is the state of trigger event 32*w + k. The thresholding
+        is done here, on the IQ packets; the firmware's own bit readout
+        (rchan=0, sign of I only) is not used.
+
         demodData is a 3-index numpy array with the following indices:
             0: channel
             1: stat
@@ -1181,8 +1330,6 @@ class ADC_Build7(ADC_Branch2):
         d(47)	spare [7..0]
 
         """
-        # stick all data strings in packets together, chopping out last 4 bytes
-        # from each string
         rchans = [trig[3] for trig in triggerTable]
         nTrigger = [trig[0] for trig in triggerTable]
 
@@ -1197,84 +1344,105 @@ class ADC_Build7(ADC_Branch2):
             rchan = rchans[0]
 
         totalTriggers = np.sum(nTrigger)
-        # pkt_per_stat = int(np.ceil((totalTriggers * rchan * 2.0)/cls.DEMOD_CHANNELS_PER_PACKET))
         pkt_per_stat = int(
             np.ceil((totalTriggers * rchan) / float(cls.DEMOD_CHANNELS_PER_PACKET))
         )
-        # print 'totalTriggers: %s, rchan: %s, DEMOD_CHANNELS_PER_PACKET: %s' % (totalTriggers, rchan, cls.DEMOD_CHANNELS_PER_PACKET)
         reps = len(packets) // pkt_per_stat
         if len(packets) % pkt_per_stat:
             raise RuntimeError(
                 "wrong number of packets: %d not a multiple of pkt_per_stat: %d"
                 % (len(packets), pkt_per_stat)
             )
-
-        # Puke all over the console output.
-        # print "extract demod packets.  Total triggers: %d, rchan: %d" % (totalTriggers, rchan)
-        # for p in packets:
-        #    print "len: %d" % (len(p),)
-        #    print labrad.support.hexdump(p)
-        # print "total packets: %s, packets_per_stat: %s, reps: %s" % (len(packets), pkt_per_stat, reps)
-
-        stat_pkt_list = [
-            packets[idx * pkt_per_stat : pkt_per_stat * (idx + 1)]
-            for idx in range(reps)
-        ]
-        # print "len of stat_pkt_list: %d, len stat_packet 0: %d" % (len(stat_pkt_list),len(stat_pkt_list[0]))
-        all_data = []
-        for stat_packet in stat_pkt_list:
-            data = np.fromstring(
-                "".join(data[:44] for data in stat_packet), dtype="<u1"
+        if mode not in ["iq", "bits"]:
+            raise RuntimeError(
+                "Operation mode %s not implemented / available" % (mode,)
             )
-            pktCounters = [ord(pkt[46]) for pkt in stat_packet]
-            readbackCounters = [ord(pkt[44]) + ord(pkt[45]) << 8 for pkt in stat_packet]
-            # print "packet counters: %s, readback counters: %s" % (pktCounters, readbackCounters)
-            if mode == "iq":
-                # Convert to 16-bit int array and chop garbage from last packet
-                vals = np.fromstring(data, dtype="<i2")[: 2 * rchan * totalTriggers]
-                # Slowest varying index: time step, next slowest index : demodulator, fastest index: I vs Q
-                #  Transpose first two indices to make demodulator first index
-                # Iq0[t=0], Qq0[t=0], Iq1[t=0], Qq1[t=0], Iq0[t=1], Qq0[t=1], Iq1[t=1], Qq1[t=1]
-                #
-                #     goes to:
-                # data[qubit][time_step][(I=0 | Q=1)]
-                # print "flat values: ", vals
-                reshapedData = vals.reshape(totalTriggers, rchan, 2).astype(int)
-                # print "reshaped data: ", reshapedData
-                transposedData = reshapedData.transpose((1, 0, 2))
-                # print "transposed data: ", transposedData
-                all_data.append(transposedData)
-            else:
-                """
-                In bit readout mode, use rchan[7..0]=0.  Readout is only the sign bit of channels 0 to 7; one byte readout is designed for compactness to minimize number of Ethernet packets.  The bit is 0 if real quadrature of the channel is positive.  Bit is flipped with XOR mask bitflip[7..0] defined in register write.  Order of bits in output byte is [ch7..ch0].
-
-                l(0)	length[15..8]		set to 0
-                l(1)	length[7..0]		set to 48
-
-                d(0)	bits1[7..0]		1st bitstring
-                d(1)	bits2[7..0]		2nd bitstring
-                ...
-                d(43)	bits44[7..0]		44th bitstring
-
-                d(44)	countrb[7..0]		Running count of triggers since last start
-                d(45)	countrb[15..8]		   1st readback has countrb=1
-                d(46)	countpack[7..0]	Packet counter for retriggering, reset when countrb incr
-                d(47)	spare [7..0]
-                """
-                raise RuntimeError(
-                    "Operation mode %s not implemented / available" % (mode,)
-                )
-        # print "all data length: %d, element 0 size: %s" % (len(all_data), all_data[0].shape)
-        # This makes stat the first index, giving us: data[stat][qubit][time_step][(I=0 | Q=1)]
-        all_data = np.array(all_data)
-        # data[stat][qubit][time_step][(I=0 | Q=1)] --> data[qubit][stat][time_step][(I=0 | Q=1)]
-        all_data = all_data.transpose([1, 0, 2, 3])
-        # print "all_data shape: ", all_data.shape
+
+        # Decode all packets at once: a record dtype with the packet length as
+        # its itemsize skips the counter bytes at the end of each packet.
+        records = cls._demodRecords(packets)
+        # Chop garbage from the last packet of each stat. The data of a stat
+        # runs over time step, then demodulator, then I vs Q:
+        # Iq0[t=0], Qq0[t=0], Iq1[t=0], Qq1[t=0], Iq0[t=1], Qq0[t=1], ...
+        vals = records["iq"].reshape(reps, -1)[:, : 2 * rchan * totalTriggers]
+        # data[stat][time_step][qubit][(I=0 | Q=1)]
+        all_data = vals.reshape(reps, totalTriggers, rchan, 2).astype(int)
+        # --> data[qubit][stat][time_step][(I=0 | Q=1)]
+        all_data = all_data.transpose([2, 0, 1, 3])
+        if mode == "bits":
+            all_data = cls.packStates(cls.demodStates(all_data, thresholds or {}))
+        # Only returning the packet counters of the last stat.  FIXME if you
+        # care about these
+        lastStat = records[len(records) - pkt_per_stat :]
+        pktCounters = lastStat["countpack"].tolist()
+        readbackCounters = lastStat["countrb"].tolist()
         return (
             all_data,
             pktCounters,
             readbackCounters,
-        )  # Only returning the packet counters of the last stat.  FIXME if you care about these
+        )
+
+    @staticmethod
+    def demodStates(data, thresholds):
+        """Threshold demodulated IQ data.
+
+        data is indexed (channel, stat, trigger event, I/Q). Returns a bool
+        array indexed (channel, stat, trigger event), True where
+        I*cos(angle) + Q*sin(angle) > threshold for the channel's
+        (threshold, angle) in thresholds. Channels without a threshold use
+        (0, 0), i.e. the sign of I.
+        """
+        nChannels = data.shape[0]
+        threshold = np.zeros((nChannels, 1, 1))
+        angle = np.zeros((nChannels, 1, 1))
+        for channel, (t, a) in thresholds.items():
+            if channel < nChannels:
+                threshold[channel] = t
+                angle[channel] = a
+        projected = data[..., 0] * np.cos(angle) + data[..., 1] * np.sin(angle)
+        return projected > threshold
+
+    @staticmethod
+    def packStates(states):
+        """Pack a bool array along its last axis into uint32 words.
+
+        Bit k of word w is element 32*w + k, unused bits of the last word are
+        0.
+        """
+        nWords = -(-states.shape[-1] // 32)
+        padding = [(0, 0)] * (states.ndim - 1) + [(0, 32 * nWords - states.shape[-1])]
+        packed = np.packbits(np.pad(states, padding), axis=-1, bitorder="little")
+        return np.ascontiguousarray(packed).view("<u4").astype(np.uint32)
+
+    @classmethod
+    def thresholdsFor(cls, info):
+        """Returns {channel: (threshold, angle)} set in a board's info dict."""
+        return dict(
+            (i, info[i]["threshold"])
+            for i in range(cls.DEMOD_CHANNELS)
+            if i in info and "threshold" in info[i]
+        )
+
+    @classmethod
+    def _demodRecords(cls, packets):
+        """View demodulation packets as an array of records.
+
+        Each record has the fields iq (the 11 pairs of 16-bit I and Q values),
+        countrb (readback counter) and countpack (packet counter).
+        """
+        data = b"".join(packets)
+        pktLen = len(packets[0]) if len(packets) else cls.DEMOD_PACKET_LEN + 2
+        if len(data) != pktLen * len(packets):
+            raise RuntimeError("demodulation packets differ in length")
+        dtype = np.dtype(
+            {
+                "names": ["iq", "countrb", "countpack"],
+                "formats": [("<i2", (2 * cls.DEMOD_CHANNELS_PER_PACKET,)), "<u2", "u1"],
+                "offsets": [0, 44, 46],
+                "itemsize": pktLen,
+            }
+        )
+        return np.frombuffer(data, dtype=dtype)
 
 
 fpga.REGISTRY[("ADC", 7)] = ADC_Build7
@@ -20,12 +20,13 @@ not in the registry dict.
 
 """
 
+import hashlib
 import logging
 import numpy as np
 from twisted.internet.defer import inlineCallbacks, returnValue
 from labrad import types as T
 
-from fpgalib.util import littleEndian
+from fpgalib.util import littleEndian, LRUCache
 import fpgalib.fpga as fpga
 import fpgalib.jump_table as jump_table
 
@@ -94,6 +95,8 @@ class InvalidBoardVersion(Exception):
 
 # Time for master to delay before SRAM to ensure synchronization
 MASTER_SRAM_DELAY_US = 2
+# Load part of the jump table, which is loaded apart from the SRAM
+JUMP_TABLE = "jump table"
 
 
 class DAC(fpga.FPGA):
@@ -231,34 +234,50 @@ class DAC(fpga.FPGA):
                If less than a full derp is written, the rest of the derp is
                populated with zeros.
         """
-        assert 0 <= derp < cls.SRAM_WRITE_DERPS, "SRAM derp out of range: %d" % derp
         assert (
             0 < len(data) <= cls.SRAM_WRITE_PKT_LEN
         ), "Tried to write %d words to SRAM derp" % len(data)
-        data = np.asarray(data)
-        # Packet length is data length plus two bytes for write address (derp)
-        pkt = np.zeros(1026, dtype="<u1")
-        # DAC firmware assumes SRAM write address lowest 8 bits = 0, so here
-        # we're only setting the middle and high byte. This is good, because
-        # it means that each time we increment derp by 1, we increment our
-        # SRAM write address by 256, ie. one derp.
-        pkt[0] = (derp >> 0) & 0xFF
-        pkt[1] = (derp >> 8) & 0xFF
-        # Each sram word is four bytes long
-        # Our data as coming from makeSram is a np array of 4 byte integers
-        # with low bytes first. Because of this you would think that
-        # (data>>24)&0xFF is the least significant bytes. However, python
-        # thinks for you, and it turns out that data>>24 is the most
-        # significant byte. Go figure. The DAC expects the data with
-        # least significant byte first in each word.
-        # Note that if len(data)<SRAM_WRITE_PKT_LEN, ie. smaller than a full
-        # derp, we only take as much data as actually exists.
-
-        pkt[2 : 2 + len(data) * 4 : 4] = (data >> 0) & 0xFF  # Least sig. byte
-        pkt[3 : 3 + len(data) * 4 : 4] = (data >> 8) & 0xFF
-        pkt[4 : 4 + len(data) * 4 : 4] = (data >> 16) & 0xFF
-        pkt[5 : 5 + len(data) * 4 : 4] = (data >> 24) & 0xFF  # Most sig. byte
-        return pkt
+        return cls.pktsWriteSram(data, derp)[0]
+
+    @classmethod
+    def pktsWriteSram(cls, data, startDerp=0):
+        """DAC packets to write SRAM data, one derp per packet
+
+        All packets are laid out in one buffer: a 2d uint8 array with one row
+        per derp. Each row is a packet, whose rows can be written to the
+        direct ethernet server as they are.
+
+        data - ndarray of SRAM words in <u4 format, or the equivalent byte
+               string. The last derp is padded with zeros.
+        startDerp - int: derp of the first word, ie address in SRAM
+        """
+        if isinstance(data, bytes):
+            data = np.frombuffer(data, dtype="<u4")
+        else:
+            data = np.asarray(data).astype("<u4", copy=False)
+        nDerps = -(-len(data) // cls.SRAM_WRITE_PKT_LEN)
+        assert (
+            0 <= startDerp and startDerp + nDerps <= cls.SRAM_WRITE_DERPS
+        ), "SRAM derps out of range: %d to %d" % (startDerp, startDerp + nDerps)
+        # Each packet is two bytes of write address (derp) followed by the
+        # SRAM words. DAC firmware assumes SRAM write address lowest 8 bits =
+        # 0, so the address is the derp: incrementing it by 1 increments the
+        # SRAM write address by 256, ie. one derp. The DAC expects both the
+        # address and the words with least significant byte first.
+        pktDtype = np.dtype(
+            [("derp", "<u2"), ("words", "<u4", (cls.SRAM_WRITE_PKT_LEN,))]
+        )
+        pkts = np.zeros(nDerps, dtype=pktDtype)
+        pkts["derp"] = np.arange(startDerp, startDerp + nDerps)
+        words = pkts["words"]
+        nFull = len(data) // cls.SRAM_WRITE_PKT_LEN
+        words[:nFull] = data[: nFull * cls.SRAM_WRITE_PKT_LEN].reshape(
+            nFull, cls.SRAM_WRITE_PKT_LEN
+        )
+        if nFull < nDerps:
+            rest = data[nFull * cls.SRAM_WRITE_PKT_LEN :]
+            words[nFull, : len(rest)] = rest
+        return pkts.view("<u1").reshape(nDerps, pktDtype.itemsize)
 
     @classmethod
     def pktWriteMem(cls, page, data):
@@ -275,7 +294,7 @@ class DAC(fpga.FPGA):
     @staticmethod
     def readback2BuildNumber(resp):
         """Get build number from register readback"""
-        a = np.fromstring(resp, dtype="<u1")
+        a = np.frombuffer(resp, dtype="<u1")
         return a[51]
 
     def parseBoardParameters(self, parametersFromRegistry):
@@ -427,6 +446,28 @@ class DacRunner_Build7(DacRunner):
             self.seqTime = fpga.TIMEOUT_FACTOR * (self.memTime * self.reps) + 1
         return self.dev.load(self.mem, self.sram, page)
 
+    def contentHash(self):
+        """Hash of the memory and SRAM data written by the load packet.
+
+        Call after loadPacket, which adds the master delay to the memory
+        sequence of the master board.
+        """
+        h = hashlib.sha1()
+        h.update(np.asarray(self.mem, dtype="<u4").tobytes())
+        h.update(self.sram or b"")
+        return h.hexdigest()
+
+    def loadParts(self, page, isMaster):
+        """Create the load packet in parts that can be loaded separately.
+
+        Returns a list of (part, packet, contentHash). part is None for the
+        SRAM and memory of the page, or names a separate memory of the board
+        like JUMP_TABLE. Used instead of loadPacket and contentHash to skip
+        the parts already on the board.
+        """
+        p = self.loadPacket(page, isMaster)
+        return [(None, p, self.contentHash())]
+
     def setupPacket(self):
         """Create non-pipelined setup packet.  For DAC, does nothing."""
         return None
@@ -458,10 +499,28 @@ class DacRunner_Build7(DacRunner):
         keep = any(s.startswith(self.dev.devName) for s in timingOrder)
         return self.dev.read(self.nPackets) if keep else self.dev.discard(self.nPackets)
 
-    def extract(self, packets):
-        """Extract timing data coming back from a readPacket."""
-        data = "".join(data[3:63] for data in packets)
-        return np.fromstring(data, dtype="<u2").astype("u4")
+    @staticmethod
+    def extract(packets):
+        """Extract timing data coming back from a readPacket.
+
+        Each packet holds DAC.TIMING_PACKET_LEN 16-bit timer values after a
+        3 byte header. All packets are joined once and viewed as records,
+        rather than slicing and joining each packet's payload.
+        """
+        data = b"".join(packets)
+        pktLen = len(packets[0]) if len(packets) else 3 + 2 * DAC.TIMING_PACKET_LEN
+        if len(data) != pktLen * len(packets):
+            raise RuntimeError("timing packets differ in length")
+        dtype = np.dtype(
+            {
+                "names": ["timers"],
+                "formats": [("<u2", (DAC.TIMING_PACKET_LEN,))],
+                "offsets": [3],
+                "itemsize": pktLen,
+            }
+        )
+        timers = np.frombuffer(data, dtype=dtype)["timers"]
+        return timers.astype("u4").reshape(-1)
 
 
 class DAC_Build7(DAC):
@@ -604,21 +663,10 @@ class DAC_Build7(DAC):
         each of which is 14+14+4=32 bits = 4 bytes long. Therefore the
         actual length of corresponding byte strings have a *4 multiplier.
         """
-        bytesPerDerp = cls.SRAM_WRITE_PKT_LEN * 4
         # Set starting write derp to the beginning of the chosen SRAM page
-        writeDerp = page * cls.SRAM_PAGE_LEN / cls.SRAM_WRITE_PKT_LEN
-        while len(data) > 0:
-            # Chop off enough data for one write packet. This is
-            # SRAM_WRITE_PKT_LEN words, which is 4x more bytes.
-            # WARNING! string reassignment. Maybe use a pointer instead
-            # Note that slicing a np array as myArray[:N], if N is larger
-            # than the length of myArray, returns the entirety of myArray
-            # and does NOT wrap around to the beginning
-            chunk, data = data[:bytesPerDerp], data[bytesPerDerp:]
-            chunk = np.fromstring(chunk, dtype="<u4")
-            dacPkt = cls.pktWriteSram(writeDerp, chunk)
-            p.write(dacPkt.tostring())
-            writeDerp += 1
+        writeDerp = page * cls.SRAM_PAGE_LEN // cls.SRAM_WRITE_PKT_LEN
+        for dacPkt in cls.pktsWriteSram(data, writeDerp):
+            p.write(dacPkt.tobytes())
 
     @classmethod
     def makeMemory(cls, data, p, page=0):
@@ -1021,7 +1069,7 @@ class DAC_Build7(DAC):
     @staticmethod
     def processReadback(resp):
         """Interpret byte string returned by register readback"""
-        a = np.fromstring(resp, dtype="<u1")
+        a = np.frombuffer(resp, dtype="<u1")
         return {
             "build": a[51],
             "serDAC": a[56],
@@ -1131,10 +1179,38 @@ class DacRunner_Build15(DacRunner_Build7):
             to the start delay.
         :return: packet for the direct ethernet server
         """
+        self.setMaster(isMaster)
+        return self.dev.load(self.jump_table, self.sram)
+
+    def loadParts(self, page, isMaster):
+        """Create separate load packets for the jump table and the SRAM.
+
+        Sweeps over jump table counters or entries then only load the 528
+        byte jump table packet, not the SRAM.
+        """
+        self.setMaster(isMaster)
+        return [
+            (JUMP_TABLE, self.dev.loadJumpTable(self.jump_table), self.jumpTableHash()),
+            (None, self.dev.loadSram(self.sram), self.sramHash()),
+        ]
+
+    def setMaster(self, isMaster):
         if isMaster:
             # TODO: how can we add a delay to the JT?
             self.start_delay += MASTER_SRAM_DELAY_US
-        return self.dev.load(self.jump_table, self.sram)
+
+    def contentHash(self):
+        """Hash of the jump table and SRAM data written by the load packet."""
+        h = hashlib.sha1()
+        h.update(self.jump_table.toString())
+        h.update(self.sram or b"")
+        return h.hexdigest()
+
+    def jumpTableHash(self):
+        return hashlib.sha1(self.jump_table.toString()).hexdigest()
+
+    def sramHash(self):
+        return hashlib.sha1(self.sram or b"").hexdigest()
 
     def runPacket(self, page, slave, delay, sync):
         """Create run packet.
@@ -1242,6 +1318,9 @@ class DAC_Build15(DAC_Build8):
     JT_IDLE_MIN = 0 - JT_IDLE_OFFSET
     JT_IDLE_MAX = 2**IDLE_BITS - 1 - JT_IDLE_OFFSET
     JT_MIN_FROM_ADDR_SPACING = 2
+    # Number of jump tables kept by make_jump_table
+    JT_CACHE_SIZE = 256
+    _jump_tables = LRUCache(JT_CACHE_SIZE)
     JT_MIN_FROM_ADDR = JT_MIN_FROM_ADDR_SPACING - JT_FROM_ADDR_OFFSET
     JT_MIN_END_ADDR = JT_MIN_FROM_ADDR_SPACING - JT_END_ADDR_OFFSET
     JT_MIN_TO_ADDR = 0
@@ -1502,6 +1581,18 @@ class DAC_Build15(DAC_Build8):
         self.makeSRAM(sram, p)
         return p
 
+    def loadJumpTable(self, jt):
+        """Get a packet that loads only the jump table, not the SRAM."""
+        p = self.makePacket()
+        p.write(jt.toString())
+        return p
+
+    def loadSram(self, sram):
+        """Get a packet that loads only the SRAM, not the jump table."""
+        p = self.makePacket()
+        self.makeSRAM(sram, p)
+        return p
+
     @classmethod
     def make_jump_table_entry(cls, name, arg):
         """Make a single jump table entry.
@@ -1562,12 +1653,29 @@ class DAC_Build15(DAC_Build8):
     def make_jump_table(cls, jt_entries, counters=None, start_address_ns=0):
         """Make a jump table out of the given entries and counters.
 
+        Jump tables are memoized by their entries, counters and start
+        address, so runs with the same table share one (and its serialized
+        bytes). The returned table must not be modified.
+
         :param list[jump_table.JumpEntry] jt_entries: JT entries
         :param list[int] counters: counter values, or None for all 0s
         :param int start_address_ns: SRAM start address, in ns
         :return: jump table object
         :rtype: jump_table.JumpTable
         """
+        key = (
+            cls,
+            tuple(entry.key() for entry in jt_entries),
+            None if counters is None else tuple(int(c) for c in counters),
+            start_address_ns,
+        )
+        return cls._jump_tables.get(
+            key,
+            lambda: cls._make_jump_table(jt_entries, counters, start_address_ns),
+        )
+
+    @classmethod
+    def _make_jump_table(cls, jt_entries, counters, start_address_ns):
         for i, a in enumerate(jt_entries):
             for j, b in enumerate(jt_entries[i + 1 :]):
                 if abs(a.from_addr - b.from_addr) < cls.JT_MIN_FROM_ADDR_SPACING:
@@ -1578,7 +1686,7 @@ class DAC_Build15(DAC_Build8):
                     )
         return jump_table.JumpTable(
             start_addr=cls.convert_to_address(start_address_ns),
-            jumps=jt_entries,
+            jumps=list(jt_entries),
             counters=counters,
         )
 
@@ -0,0 +1,816 @@
+"""
+Software emulation of GHz DAC and ADC boards behind a direct ethernet server.
+
+DirectEthernetEmulator stands in for the direct ethernet server at the level
+of its settings (connect, listen, write, collect, read, triggers, ...). The
+packets written to a board MAC are handled by an emulated board, which
+answers register readbacks, stores memory, SRAM, jump table and trigger
+table writes, and streams DAC timing packets or ADC average and
+demodulation packets when it runs. Boards run in daisy chain order: slaves
+and ADCs in daisy chain mode are armed by their run packet and start when a
+master DAC on the same adapter starts.
+
+EmulatedConnection bundles the emulated direct ethernet server with an
+in-memory registry holding the board group configuration, so that an
+FPGAServer using it as its client detects and runs the emulated boards
+with its own, unmodified code:
+
+    server = ghz_fpga_server.FPGAServer()
+    useConnection(server, emulatedConnection([("Emulated", 1, [("DAC", 1, 8, 0)])]))
+    yield server.initServer()
+
+Latency is simulated with two parameters of the emulated direct ethernet
+server. Each request is handled latency seconds after it was sent, and a
+board sends its data runTimeScale times the sequence duration after it
+starts, so that runTimeScale=1 runs sequences in real time and 0 returns
+the data at once. With both at 0 requests are handled synchronously, which
+together with a twisted.internet.task.Clock makes the emulation
+deterministic in tests.
+"""
+
+import collections
+import itertools
+
+import numpy as np
+from twisted.internet import defer, task
+from twisted.internet.defer import inlineCallbacks, returnValue
+from labrad import types as T
+from labrad.server import Signal
+from labrad.units import Value
+
+import fpgalib.adc as adc
+import fpgalib.dac as dac
+import fpgalib.fpga as fpga
+import fpgalib.jump_table as jump_table
+
+DIRECT_ETHERNET_NAME = "Emulated Direct Ethernet"
+DIRECT_ETHERNET_ID = 100
+REGISTRY_NAME = "Registry"
+REGISTRY_ID = 2
+# Default timeout of a direct ethernet context, in seconds
+DEFAULT_TIMEOUT = 1.0
+# Length of a DAC memory write packet: page byte and 256 3-byte commands
+DAC_MEM_PKT_LEN = 769
+# Emulated demodulator output: I is +-DEMOD_SIGNAL, depending on a random
+# qubit state, plus gaussian noise of DEMOD_NOISE on I and Q
+DEMOD_SIGNAL = 1000
+DEMOD_NOISE = 200
+# Duration of one average mode or build 1 demodulation rep, in seconds
+ADC_REP_TIME = 16e-6
+# Duration of one jump table rep, as estimated by DacRunner_Build15
+JUMP_TABLE_REP_TIME = 100e-6
+
+
+class EmulatedServer(object):
+    """Base class of the emulated LabRAD servers.
+
+    Settings are methods taking the context state dict, a dict that is
+    created for each context on first use, followed by the setting
+    arguments. The names of the settings are listed in SETTINGS.
+
+    The records of a request are handled in order, and requests in the same
+    context one after the other. An error in a record fails the request and
+    the remaining records are not handled, as with real LabRAD servers.
+    """
+
+    SETTINGS = []
+
+    def __init__(self, ID, name, clock=None, latency=0.0):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.ID = ID
+        self.name = name
+        self.clock = clock
+        self.latency = latency
+        self.contexts = {}
+
+    def contextFor(self, context):
+        """Get the state dict of a context, creating it if necessary."""
+        if context not in self.contexts:
+            c = {"ID": context, "lock": defer.DeferredLock()}
+            self.initContext(c)
+            self.contexts[context] = c
+        return self.contexts[context]
+
+    def initContext(self, c):
+        pass
+
+    def expireContext(self, context):
+        self.contexts.pop(context, None)
+
+    def later(self, delay, func, *args):
+        """Call func after delay seconds, or now if delay is 0."""
+        if delay > 0:
+            return task.deferLater(self.clock, delay, func, *args)
+        return defer.maybeDeferred(func, *args)
+
+    def request(self, records, context):
+        """Handle a request, a list of (setting, args) records.
+
+        Returns a deferred list of the results of the records.
+        """
+        c = self.contextFor(context)
+        arrival = self.later(self.latency, lambda: None)
+        return c["lock"].run(self._handleRequest, c, records, arrival)
+
+    @inlineCallbacks
+    def _handleRequest(self, c, records, arrival):
+        yield arrival
+        results = []
+        for name, args in records:
+            result = yield defer.maybeDeferred(getattr(self, name), c, *args)
+            results.append(result)
+        returnValue(results)
+
+
+class EmulatedAdapter(object):
+    """An ethernet adapter of the emulated direct ethernet server."""
+
+    def __init__(self, server, port, name):
+        self.server = server
+        self.port = port
+        self.name = name
+        self.mac = "00:00:00:00:00:{:02X}".format(port)
+        self.boards = collections.OrderedDict()  # MAC -> board
+
+    def addBoard(self, board):
+        board.adapter = self
+        self.boards[board.mac] = board
+        return board
+
+    def daisyStart(self):
+        """Start all boards waiting for the daisy chain start."""
+        for board in list(self.boards.values()):
+            board.daisyStart()
+
+    def transmit(self, src, packets, delay=0.0):
+        """Send packets (byte strings) from a board to the adapter."""
+        if len(packets):
+            self.server.later(delay, self.server.deliver, self, src, packets)
+
+
+class DirectEthernetEmulator(EmulatedServer):
+    """Emulated direct ethernet server with emulated boards."""
+
+    SETTINGS = [
+        "adapters",
+        "connect",
+        "listen",
+        "timeout",
+        "destination_mac",
+        "require_source_mac",
+        "require_length",
+        "write",
+        "collect",
+        "read",
+        "discard",
+        "clear",
+        "send_trigger",
+        "wait_for_trigger",
+    ]
+
+    def __init__(
+        self,
+        name=DIRECT_ETHERNET_NAME,
+        ID=DIRECT_ETHERNET_ID,
+        clock=None,
+        latency=0.0,
+        runTimeScale=0.0,
+    ):
+        EmulatedServer.__init__(self, ID, name, clock, latency)
+        self.runTimeScale = runTimeScale
+        self.adapterList = collections.OrderedDict()  # port -> adapter
+
+    def addAdapter(self, port, name=None):
+        if name is None:
+            name = "Emulated Adapter {}".format(port)
+        self.adapterList[port] = EmulatedAdapter(self, port, name)
+        return self.adapterList[port]
+
+    def addBoard(self, port, board):
+        """Add an emulated board to the adapter of a port."""
+        if port not in self.adapterList:
+            self.addAdapter(port)
+        board.runTimeScale = self.runTimeScale
+        return self.adapterList[port].addBoard(board)
+
+    def initContext(self, c):
+        c["adapter"] = None
+        c["listening"] = False
+        c["destination"] = None
+        c["source"] = None
+        c["length"] = None
+        c["timeout"] = DEFAULT_TIMEOUT
+        c["buffer"] = []
+        c["waiting"] = None  # (number of packets, deferred, timeout call)
+        c["triggers"] = 0
+        c["triggerWait"] = None  # (number of triggers, deferred)
+
+    # Packets from the boards
+
+    def deliver(self, adapter, src, packets):
+        """Buffer packets from a board in the contexts listening for them."""
+        for c in list(self.contexts.values()):
+            if c["adapter"] is not adapter or not c["listening"]:
+                continue
+            if c["source"] is not None and c["source"] != src:
+                continue
+            accepted = [
+                (src, adapter.mac, len(data), data)
+                for data in packets
+                if c["length"] is None or len(data) == c["length"]
+            ]
+            c["buffer"].extend(accepted)
+            self._checkWaiting(c)
+
+    def _checkWaiting(self, c):
+        if c["waiting"] is not None and len(c["buffer"]) >= c["waiting"][0]:
+            n, d, timeoutCall = c["waiting"]
+            c["waiting"] = None
+            if timeoutCall is not None:
+                timeoutCall.cancel()
+            d.callback(None)
+
+    def _waitForPackets(self, c, n):
+        """Wait until n packets are buffered, failing after the timeout."""
+        if len(c["buffer"]) >= n:
+            return defer.succeed(None)
+        d = defer.Deferred()
+
+        def timedOut():
+            c["waiting"] = None
+            d.errback(
+                T.Error(
+                    "Timeout: {} of {} packets received".format(len(c["buffer"]), n)
+                )
+            )
+
+        c["waiting"] = (n, d, self.clock.callLater(c["timeout"], timedOut))
+        return d
+
+    def _adapter(self, c):
+        if c["adapter"] is None:
+            raise T.Error("Not connected to an adapter")
+        return c["adapter"]
+
+    # Settings
+
+    def adapters(self, c):
+        return [(port, a.name) for port, a in self.adapterList.items()]
+
+    def connect(self, c, port):
+        if port not in self.adapterList:
+            raise T.Error("Unknown adapter: {}".format(port))
+        c["adapter"] = self.adapterList[port]
+
+    def listen(self, c):
+        self._adapter(c)
+        c["listening"] = True
+
+    def timeout(self, c, timeout):
+        c["timeout"] = timeout["s"] if isinstance(timeout, Value) else timeout
+
+    def destination_mac(self, c, mac):
+        c["destination"] = mac
+
+    def require_source_mac(self, c, mac):
+        c["source"] = mac
+
+    def require_length(self, c, length):
+        c["length"] = length
+
+    def write(self, c, data):
+        board = self._adapter(c).boards.get(c["destination"])
+        if board is not None:
+            board.receive(bytes(data))
+
+    @inlineCallbacks
+    def collect(self, c, n=1):
+        yield self._waitForPackets(c, n)
+
+    @inlineCallbacks
+    def read(self, c, n=1):
+        yield self._waitForPackets(c, n)
+        packets, c["buffer"] = c["buffer"][:n], c["buffer"][n:]
+        returnValue(packets)
+
+    @inlineCallbacks
+    def discard(self, c, n=1):
+        yield self._waitForPackets(c, n)
+        del c["buffer"][:n]
+
+    def clear(self, c):
+        c["buffer"] = []
+
+    def send_trigger(self, c, context):
+        target = self.contextFor(context)
+        target["triggers"] += 1
+        if target["triggerWait"] is not None:
+            n, d = target["triggerWait"]
+            if target["triggers"] >= n:
+                target["triggerWait"] = None
+                target["triggers"] -= n
+                d.callback(None)
+
+    @inlineCallbacks
+    def wait_for_trigger(self, c, n):
+        """Wait for n triggers, returning the time waited."""
+        start = self.clock.seconds()
+        if c["triggers"] >= n:
+            c["triggers"] -= n
+        else:
+            d = defer.Deferred()
+            c["triggerWait"] = (n, d)
+            yield d
+        returnValue(Value(self.clock.seconds() - start, "s"))
+
+
+class EmulatedRegistry(EmulatedServer):
+    """In-memory LabRAD registry, with the cd and get settings only."""
+
+    SETTINGS = ["cd", "get"]
+
+    def __init__(self, ID=REGISTRY_ID, name=REGISTRY_NAME, clock=None):
+        EmulatedServer.__init__(self, ID, name, clock)
+        self.dirs = {("",): {}}  # path -> {key: value}
+
+    def initContext(self, c):
+        c["path"] = ("",)
+
+    def set(self, path, key, value):
+        """Set a key in the directory path, a list like ['', 'Servers']."""
+        self.dirs.setdefault(tuple(path), {})[key] = value
+
+    def cd(self, c, path, create=False):
+        if isinstance(path, str):
+            path = [path]
+        newPath = list(c["path"])
+        for d in path:
+            if d == "":
+                newPath = [""]
+            elif d == "..":
+                newPath = newPath[:-1] or [""]
+            else:
+                newPath.append(d)
+        newPath = tuple(newPath)
+        if newPath not in self.dirs:
+            if not create:
+                raise T.Error("Directory {} not found".format(list(newPath)))
+            self.dirs[newPath] = {}
+        c["path"] = newPath
+        return list(newPath)
+
+    def get(self, c, key, set=False, default=None):
+        keys = self.dirs[c["path"]]
+        if key not in keys:
+            if not set:
+                raise T.Error("Key {} not found".format(key))
+            keys[key] = default
+        return keys[key]
+
+
+class EmulatedPacket(object):
+    """Packet to an emulated server, used like a LabRAD packet wrapper."""
+
+    def __init__(self, server, context):
+        self._server = server
+        self._context = context
+        self._packet = []  # (setting, args, key)
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name not in self._server.SETTINGS:
+            raise AttributeError(name)
+
+        def addRecord(*args, **kw):
+            self._packet.append((name, args, kw.get("key")))
+            return self
+
+        return addRecord
+
+    def __setitem__(self, key, value):
+        """Replace the arguments of the records with the given key."""
+        for i, (name, args, recKey) in enumerate(self._packet):
+            if recKey == key:
+                self._packet[i] = (name, (value,), recKey)
+
+    def send(self, context=None):
+        if context is None:
+            context = self._context
+        records = [(name, args) for name, args, key in self._packet]
+        d = self._server.request(records, context)
+        keys = [key or name for name, args, key in self._packet]
+        d.addCallback(lambda results: EmulatedResponse(keys, results))
+        return d
+
+
+class EmulatedResponse(object):
+    """Response to an EmulatedPacket, used like a LabRAD packet response.
+
+    Results are accessed by setting name, or by key for keyed records, as
+    an item or an attribute. The results of a setting called more than once
+    are collected into a list.
+    """
+
+    def __init__(self, keys, results):
+        collected = collections.OrderedDict()
+        for key, result in zip(keys, results):
+            collected.setdefault(key, []).append(result)
+        self.settings = {}
+        for key, l in collected.items():
+            self.settings[key] = l[0] if len(l) == 1 else l
+            setattr(self, key, self.settings[key])
+
+    def __getitem__(self, key):
+        return self.settings[key]
+
+
+class EmulatedServerWrapper(object):
+    """Client side of an emulated server, like a LabRAD server wrapper.
+
+    Settings can be called directly, in which case they are sent in a
+    packet of their own.
+    """
+
+    def __init__(self, server, cxn):
+        self._server = server
+        self._cxn = cxn
+        self._labrad_name = server.name
+        self.name = server.name
+        self.ID = server.ID
+        self._defaultContext = self.context()
+
+    def context(self):
+        return self._cxn.context()
+
+    def packet(self, context=None):
+        if context is None:
+            context = self._defaultContext
+        return EmulatedPacket(self._server, context)
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name not in self._server.SETTINGS:
+            raise AttributeError(name)
+
+        def call(*args, **kw):
+            p = self.packet(context=kw.get("context"))
+            getattr(p, name)(*args)
+            d = p.send()
+            d.addCallback(lambda ans: ans[name])
+            return d
+
+        return call
+
+
+class EmulatedManager(object):
+    def __init__(self, cxn):
+        self.cxn = cxn
+
+    def servers(self):
+        return defer.succeed([(s.ID, s.name) for s in list(self.cxn.servers.values())])
+
+    def expire_context(self, ID, context=None):
+        for s in list(self.cxn.servers.values()):
+            if s.ID == ID:
+                s._server.expireContext(context)
+        return defer.succeed(None)
+
+
+class EmulatedConnection(object):
+    """A LabRAD client connection to emulated servers.
+
+    Provides the parts of a connection used by the FPGA server: servers by
+    name, the registry and the manager's servers and expire_context.
+    """
+
+    ID = 1
+
+    def __init__(self, clock=None):
+        self.contexts = itertools.count(1)
+        self.servers = collections.OrderedDict()  # name -> server wrapper
+        self.manager = EmulatedManager(self)
+        self.registry = self.addServer(EmulatedRegistry(clock=clock))
+
+    def addServer(self, server):
+        self.servers[server.name] = EmulatedServerWrapper(server, self)
+        return self.servers[server.name]
+
+    def context(self):
+        return (self.ID, next(self.contexts))
+
+    def refresh(self):
+        return defer.succeed(None)
+
+    def __getitem__(self, name):
+        return self.servers[name]
+
+
+class BoardEmulator(object):
+    """Base class of the emulated boards.
+
+    The FPGA device class of the emulated build is looked up in the
+    fpga.REGISTRY, and its constants and MAC address scheme are used.
+    """
+
+    BOARD_TYPE = None
+
+    def __init__(self, board, build, seed=None):
+        self.deviceClass = fpga.REGISTRY[(self.BOARD_TYPE, build)]
+        self.board = board
+        self.build = build
+        self.mac = self.deviceClass.macFor(board)
+        self.adapter = None
+        self.runTimeScale = 0.0
+        self.armed = None  # function that runs the board on daisy chain start
+        self.executionCount = 0
+        self.packetsReceived = 0
+        self.rng = np.random.RandomState(board if seed is None else seed)
+
+    def receive(self, data):
+        """Handle a packet (byte string) written to the board."""
+        raise NotImplementedError()
+
+    def daisyStart(self):
+        if self.armed is not None:
+            run, self.armed = self.armed, None
+            run()
+
+    def emit(self, packets, runTime=0.0):
+        """Send packets to the adapter when a run of runTime seconds ends."""
+        self.adapter.transmit(self.mac, packets, runTime * self.runTimeScale)
+
+    @staticmethod
+    def splitPackets(buf, pktLen):
+        """Split a byte buffer into packets of pktLen bytes."""
+        return [buf[i : i + pktLen] for i in range(0, len(buf), pktLen)]
+
+
+class DacEmulator(BoardEmulator):
+    """Emulated GHz DAC board.
+
+    Memory boards (builds 7 to 12) stream one timing result for every timer
+    stop in the memory sequence when run with timing readback. Jump table
+    boards (build 13 and later) do not send data when they run.
+    """
+
+    BOARD_TYPE = "DAC"
+    MASTER = "master"
+    SLAVE = "slave"
+    TIMING_PKT_DTYPE = np.dtype(
+        [
+            ("header", "u1", (3,)),
+            ("timers", "<u2", (dac.DAC.TIMING_PACKET_LEN,)),
+            ("spare", "u1", (7,)),
+        ]
+    )
+
+    def __init__(self, board, build, seed=None):
+        BoardEmulator.__init__(self, board, build, seed)
+        dev = self.deviceClass
+        self.sram = np.zeros(dev.SRAM_LEN, dtype="<u4")
+        self.memory = [[] for _ in range(2)]  # memory sequence of each page
+        self.jumpTable = None
+        self.timers = np.zeros(0, dtype="<u2")  # timing results of last run
+
+    def receive(self, data):
+        self.packetsReceived += 1
+        dev = self.deviceClass
+        a = np.frombuffer(data, dtype="<u1")
+        if len(a) == dev.REG_PACKET_LEN:
+            self.register(a)
+        elif len(a) == 2 + 4 * dev.SRAM_WRITE_PKT_LEN:
+            derp = int(a[0]) + (int(a[1]) << 8)
+            start = derp * dev.SRAM_WRITE_PKT_LEN
+            self.sram[start : start + dev.SRAM_WRITE_PKT_LEN] = a[2:].view("<u4")
+        elif len(a) == DAC_MEM_PKT_LEN and not dev.HAS_JUMP_TABLE:
+            b = a[1:].reshape(-1, 3).astype(int)
+            cmds = b[:, 0] + (b[:, 1] << 8) + (b[:, 2] << 16)
+            # The sequence ends with the branch back to start
+            ends = np.nonzero(cmds == 0xF00000)[0]
+            if len(ends):
+                cmds = cmds[: ends[0] + 1]
+            self.memory[a[0] & 1] = cmds.tolist()
+        elif dev.HAS_JUMP_TABLE and len(a) == jump_table.JumpTable.PACKET_LEN:
+            self.jumpTable = data
+
+    def register(self, regs):
+        """Handle a register packet."""
+        reps = int(regs[13]) + (int(regs[14]) << 8)
+        if self.deviceClass.HAS_JUMP_TABLE:
+            # 0 = idle, 1 = master, 3 = slave
+            start = {1: self.MASTER, 3: self.SLAVE}.get(regs[0])
+            page = 0
+        else:
+            # Run memory in page regs[0] >> 7, as master (regs[43] = 0) or
+            # slave (1)
+            start = None
+            if regs[0] & 0x7F == 1:
+                start = {0: self.MASTER, 1: self.SLAVE}.get(regs[43])
+            page = regs[0] >> 7
+        if start is not None and reps:
+            stream = regs[1] == 3
+
+            def run():
+                self.run(page, reps, stream)
+
+            if start == self.SLAVE:
+                self.armed = run
+            else:
+                self.adapter.daisyStart()
+                run()
+        if regs[1] in [1, 2]:
+            self.emit([self.readback()])
+
+    def run(self, page, reps, stream):
+        """Run the sequence in a memory page, or the jump table, reps times."""
+        self.executionCount += reps
+        if self.deviceClass.HAS_JUMP_TABLE:
+            self.emit([], JUMP_TABLE_REP_TIME * reps)
+            return
+        mem = self.memory[page]
+        runTime = dac.MemorySequence.sequenceTime_sec(mem) * reps
+        packets = []
+        if stream and len(mem):
+            nTimers = dac.MemorySequence.timerCount(mem)
+            nPackets = reps * nTimers // dac.DAC.TIMING_PACKET_LEN
+            pkts = np.zeros(nPackets, dtype=self.TIMING_PKT_DTYPE)
+            pkts["timers"] = self.rng.randint(0, 2**16, size=pkts["timers"].shape)
+            self.timers = pkts["timers"].ravel()
+            packets = self.splitPackets(pkts.tobytes(), pkts.itemsize)
+        self.emit(packets, runTime)
+
+    def readback(self):
+        """Register readback packet."""
+        a = np.zeros(self.deviceClass.READBACK_LEN, dtype="<u1")
+        a[51] = self.build
+        a[52] = self.executionCount & 0xFF
+        a[53] = (self.executionCount >> 8) & 0xFF
+        return a.tobytes()
+
+
+class AdcEmulator(BoardEmulator):
+    """Emulated GHz ADC board.
+
+    Build 7 boards send the demodulator output of the triggers in their
+    trigger table, in packets of 11 IQ pairs. Build 1 boards send one
+    packet of 11 IQ pairs per rep. In average mode both send
+    AVERAGE_PACKETS packets of AVERAGE_PACKET_LEN bytes.
+
+    The IQ points of the last demodulation run are kept in demodData,
+    indexed (stat, trigger, channel, I/Q).
+    """
+
+    BOARD_TYPE = "ADC"
+    DEMOD_PKT_DTYPE = np.dtype(
+        [
+            ("iq", "<i2", (2 * adc.ADC_Build7.DEMOD_CHANNELS_PER_PACKET,)),
+            ("countrb", "<u2"),
+            ("countpack", "u1"),
+            ("spare", "u1"),
+        ]
+    )
+
+    def __init__(self, board, build, seed=None):
+        BoardEmulator.__init__(self, board, build, seed)
+        self.triggerTable = []  # (count, delay, length, rchan)
+        self.demodData = None
+
+    def receive(self, data):
+        self.packetsReceived += 1
+        dev = self.deviceClass
+        a = np.frombuffer(data, dtype="<u1")
+        if len(a) == dev.REG_PACKET_LEN:
+            self.register(a)
+        elif issubclass(dev, adc.ADC_Branch2) and len(a) == dev.SRAM_RETRIGGER_PKT_LEN:
+            # Page 0 is the trigger table, pages 1 to 12 the mixer tables.
+            if a[0] == 0 and a[1] == 0:
+                self.triggerTable = self.decodeTriggerTable(a[2:])
+
+    @staticmethod
+    def decodeTriggerTable(sram):
+        """Decode the retrigger table, see ADC_Branch2.makeTriggerTable."""
+        table = []
+        for entry in sram.reshape(-1, 8):
+            if not entry.any():
+                break
+            count = int(entry[0]) + (int(entry[1]) << 8) + 1
+            delay = int(entry[2]) + (int(entry[3]) << 8) + 4
+            table.append((count, delay, int(entry[4]) + 1, int(entry[5])))
+        return table
+
+    def register(self, regs):
+        """Handle a register packet."""
+        dev = self.deviceClass
+        mode = regs[0]
+        reps = int(regs[7]) + (int(regs[8]) << 8)
+        if mode == dev.RUN_MODE_REGISTER_READBACK:
+            self.emit([self.readback()])
+        elif mode == dev.RUN_MODE_AVERAGE_AUTO:
+            self.runAverage()
+        elif mode == dev.RUN_MODE_AVERAGE_DAISY:
+            self.armed = self.runAverage
+        elif mode == dev.RUN_MODE_DEMOD_AUTO:
+            self.runDemod(reps)
+        elif mode == dev.RUN_MODE_DEMOD_DAISY:
+            self.armed = lambda: self.runDemod(reps)
+
+    def runAverage(self):
+        dev = self.deviceClass
+        self.executionCount += 1
+        data = self.rng.randint(
+            -512, 512, size=dev.AVERAGE_PACKETS * dev.AVERAGE_PACKET_LEN // 2
+        )
+        self.emit(
+            self.splitPackets(data.astype("<i2").tobytes(), dev.AVERAGE_PACKET_LEN),
+            ADC_REP_TIME,
+        )
+
+    def runDemod(self, reps):
+        dev = self.deviceClass
+        self.executionCount += reps
+        if issubclass(dev, adc.ADC_Branch2):
+            nTriggers = sum(count for count, delay, rlen, rchan in self.triggerTable)
+            rchan = self.triggerTable[0][3] if self.triggerTable else 0
+            statTime = 4e-9 * sum(
+                count * (delay + rlen)
+                for count, delay, rlen, rchan in self.triggerTable
+            )
+        else:
+            # one packet per rep, with all demodulators
+            nTriggers, rchan = 1, dev.DEMOD_CHANNELS_PER_PACKET
+            statTime = ADC_REP_TIME
+        self.demodData = self.demodPoints(reps, nTriggers, rchan)
+        # The points of a stat run over trigger, channel and I/Q, and fill up
+        # the packets of the stat, 11 IQ pairs per packet.
+        pktPerStat = -(-nTriggers * rchan // dev.DEMOD_CHANNELS_PER_PACKET)
+        pkts = np.zeros(reps * pktPerStat, dtype=self.DEMOD_PKT_DTYPE)
+        iq = pkts["iq"].reshape(reps, -1)
+        iq[:, : 2 * nTriggers * rchan] = self.demodData.reshape(reps, -1)
+        counts = np.arange(1, len(pkts) + 1)
+        pkts["countrb"] = counts & 0xFFFF
+        pkts["countpack"] = counts & 0xFF
+        self.emit(self.splitPackets(pkts.tobytes(), pkts.itemsize), statTime * reps)
+
+    def demodPoints(self, reps, nTriggers, rchan):
+        """Random IQ points, indexed (stat, trigger, channel, I/Q)."""
+        shape = (reps, nTriggers, rchan)
+        states = self.rng.randint(0, 2, size=shape)
+        data = self.rng.normal(0, DEMOD_NOISE, size=shape + (2,))
+        data[..., 0] += DEMOD_SIGNAL * (2 * states - 1)
+        return np.round(data).astype("<i2")
+
+    def readback(self):
+        """Register readback packet."""
+        a = np.zeros(self.deviceClass.READBACK_LEN, dtype="<u1")
+        a[0] = self.build
+        a[2] = self.executionCount & 0xFF
+        a[3] = (self.executionCount >> 8) & 0xFF
+        a[4] = self.packetsReceived & 0xFF
+        return a.tobytes()
+
+
+BOARD_EMULATORS = {"DAC": DacEmulator, "ADC": AdcEmulator}
+
+
+def emulatedConnection(boardGroups, latency=0.0, runTimeScale=0.0, clock=None):
+    """Make a connection to an emulated direct ethernet server and registry.
+
+    boardGroups is a list of (name, port, boards), with boards a list of
+    (board type, board number, build, delay) in daisy chain order, for
+    example ("DAC", 1, 8, 0). The boards are added to the adapter of the
+    port, and the board groups to the registry, as the FPGA server expects
+    them.
+    """
+    cxn = EmulatedConnection(clock)
+    de = DirectEthernetEmulator(clock=clock, latency=latency, runTimeScale=runTimeScale)
+    cxn.addServer(de)
+    serverDir = ["", "Servers", "GHz FPGAs"]
+    groupDefs = []
+    for name, port, boards in boardGroups:
+        de.addAdapter(port)
+        boardDelays = []
+        for boardType, board, build, delay in boards:
+            de.addBoard(port, BOARD_EMULATORS[boardType](board, build))
+            boardDelays.append(("{} {}".format(boardType, board), delay))
+            if boardType == "DAC":
+                cxn.registry._server.set(
+                    serverDir, "dac{}".format(board), [("fifoCounter", 3)]
+                )
+        groupDefs.append((name, de.name, port, boardDelays))
+    cxn.registry._server.set(serverDir, "boardGroups", groupDefs)
+    return cxn
+
+
+def useConnection(server, cxn):
+    """Make a LabRAD server use cxn as its client connection.
+
+    The server's signals, like its log, fire to no one, as they have no
+    listeners without a manager.
+    """
+    server._LabradServer__async_client = cxn
+    # used outside of the reactor thread, e.g. when driven by a Clock
+    server._LabradServer__thread_data.sync_client = cxn
+    server._cxn = cxn
+    for name in dir(type(server)):
+        signal = getattr(type(server), name)
+        if isinstance(signal, Signal):
+            signal.parent = server
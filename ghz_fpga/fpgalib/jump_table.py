@@ -2,13 +2,16 @@
 # Created: July 2013
 
 import numpy as np
-from fpgalib.util import littleEndian
+from fpgalib.util import littleEndian, LRUCache
 from fpgalib import fpga
 
 IDLE_NUM_BITS = 15
 IDLE_MIN_CYCLES = 0
 IDLE_MAX_CYCLES = (2**IDLE_NUM_BITS) - 1
 
+# Number of serialized jump tables to keep, see JumpTable.toString
+SERIALIZE_CACHE_SIZE = 256
+
 
 class JumpEntry(object):
     """A single entry in the jump table.
@@ -54,6 +57,10 @@ class JumpEntry(object):
         data[6:8] = self.operation.as_bytes()
         return data
 
+    def key(self):
+        """Get a hashable (from_addr, to_addr, op code) tuple for this entry."""
+        return (self.from_addr, self.to_addr, self.operation.code())
+
 
 # Operations (ie op codes)
 
@@ -66,6 +73,10 @@ class Operation(object):
     def __str__(self):
         raise NotImplementedError()
 
+    def code(self):
+        """Get the 16 bit op code of this operation, as an int."""
+        raise NotImplementedError()
+
     def as_bytes(self):
         """Get an array of bytes representing this operation.
 
@@ -75,7 +86,7 @@ class Operation(object):
         Returns:
             2 element ndarray with dtype 'u1' in little endian order.
         """
-        raise NotImplementedError()
+        return littleEndian(self.code(), 2)
 
 
 class IDLE(Operation):
@@ -93,8 +104,8 @@ class IDLE(Operation):
     def __str__(self):
         return "%s %d cycles" % (self.NAME, self.cycles)
 
-    def as_bytes(self):
-        """Get bytes for an IDLE.
+    def code(self):
+        """Get the op code for an IDLE.
 
         The op code is
             dddddddd ddddddd0
@@ -104,7 +115,7 @@ class IDLE(Operation):
             raise ValueError(
                 "IDLE num cycles must fit in {} bits".format(IDLE_NUM_BITS)
             )
-        return littleEndian(self.cycles << 1, 2)
+        return self.cycles << 1
 
 
 class CHECK(Operation):
@@ -131,8 +142,8 @@ class CHECK(Operation):
     def __str__(self):
         raise NotImplementedError()
 
-    def as_bytes(self):
-        """Get bytes for a CHECK
+    def code(self):
+        """Get the op code for a CHECK
 
         The op code is
             xxjjjjjj iiiin001
@@ -145,8 +156,7 @@ class CHECK(Operation):
         which_daisy_bit = self.which_daisy_bit << 4
         bit_state = int(self.bit_state) << 3
         op = 1
-        val = jump_idx + which_daisy_bit + bit_state + op
-        return littleEndian(val, 2)
+        return jump_idx + which_daisy_bit + bit_state + op
 
 
 class JUMP(Operation):
@@ -165,8 +175,8 @@ class JUMP(Operation):
     def __str__(self):
         return "\n".join([self.NAME, "Next jump index: %d" % self.jump_index])
 
-    def as_bytes(self):
-        """Get bytes for a JUMP
+    def code(self):
+        """Get the op code for a JUMP
 
         The op code is
             xxjjjjjj xxxx1101
@@ -174,8 +184,7 @@ class JUMP(Operation):
             jjjjjj is the jump index to set after the jump.
         """
         # binary 1101 = decimal 13
-        val = (self.jump_index << 8) + 13
-        return littleEndian(val, 2)
+        return (self.jump_index << 8) + 13
 
 
 class NOP(Operation):
@@ -186,12 +195,12 @@ class NOP(Operation):
     def __str__(self):
         return self.NAME
 
-    def as_bytes(self):
-        """Get bytes for a NOP.
+    def code(self):
+        """Get the op code for a NOP.
 
         The op code is xxxxxxxx xxxx0101
         """
-        return littleEndian(5, 2)
+        return 5
 
 
 class CYCLE(Operation):
@@ -219,8 +228,8 @@ class CYCLE(Operation):
             self.NAME, self.counter, self.jump_index
         )
 
-    def as_bytes(self):
-        """Get bytes for a CYCLE.
+    def code(self):
+        """Get the op code for a CYCLE.
 
         The op code is
             xxjjjjjj xxccx011
@@ -231,7 +240,7 @@ class CYCLE(Operation):
         jump_index = self.jump_index << 8
         counter = self.counter << 4
         op = 3
-        return littleEndian(jump_index + counter + op, 2)
+        return jump_index + counter + op
 
 
 class END(Operation):
@@ -240,13 +249,13 @@ class END(Operation):
     def __str__(self):
         return self.NAME
 
-    def as_bytes(self):
-        """Get bytes for an END.
+    def code(self):
+        """Get the op code for an END.
 
         The op code is
             xxxxxxxx xxxxx111
         """
-        return littleEndian(7, 2)
+        return 7
 
 
 class JumpTable(object):
@@ -271,6 +280,9 @@ class JumpTable(object):
     COUNTER_BITS = 32  # 32 bit register for counters
     COUNT_MAX = 2**COUNTER_BITS - 1
     NUM_COUNTERS = 4
+    MAX_JUMPS = (PACKET_LEN - 24) // 8
+
+    _serialized = LRUCache(SERIALIZE_CACHE_SIZE)
 
     def __init__(self, start_addr=None, jumps=None, counters=None):
         """
@@ -311,22 +323,53 @@ class JumpTable(object):
         )
         return "\n".join([counter, start_addr, jump])
 
+    def key(self):
+        """Get a hashable key of the counters, start address and entries.
+
+        Jump tables with equal keys serialize to the same bytes.
+        """
+        return (
+            tuple(int(c) for c in self.counters),
+            self.start_addr,
+            tuple(jump.key() for jump in self.jumps),
+        )
+
     def toString(self):
-        """Serialize jump table to a byte string for the FPGA"""
-        data = np.zeros(self.PACKET_LEN, dtype="<u1")
+        """Serialize jump table to a byte string for the FPGA.
+
+        Serialized tables are cached by key, so sweeps that build the same
+        table again reuse its bytes.
+        """
+        key = self.key()
+        return self._serialized.get(key, lambda: self.serialize(*key))
+
+    @classmethod
+    def serialize(cls, counters, start_addr, entries):
+        """Serialize a jump table given as returned by key()."""
+        if len(entries) > cls.MAX_JUMPS:
+            raise ValueError(
+                "Cannot have more than {} jump table entries.".format(cls.MAX_JUMPS)
+            )
+        data = np.zeros(cls.PACKET_LEN, dtype="<u1")
         # Set counter values. Each one is 4 bytes
-        for i, c in enumerate(self.counters):
-            data[i * 4 : (i + 1) * 4] = littleEndian(c, 4)
+        counters = np.array(counters, dtype=np.int64) & cls.COUNT_MAX
+        data[: 4 * len(counters)] = counters.astype("<u4").view("u1")
         # Set start address
-        data[16:19] = littleEndian(self.start_addr, 3)
-        data[19:22] = littleEndian(self.start_addr, 3)
+        data[16:19] = littleEndian(start_addr, 3)
+        data[19:22] = littleEndian(start_addr, 3)
         # Start op code
         data[22] = 5
         data[23] = 0
-        for i, jump in enumerate(self.jumps):
-            ofs = 24 + i * 8
-            data[ofs : ofs + 8] = jump.as_bytes()
-        return data.tostring()
+        # Each entry is a 3 byte from address, 3 byte to address and 2 byte
+        # op code, all little endian
+        entries = np.array(entries, dtype=np.int64).reshape(-1, 3)
+        table = data[24 : 24 + 8 * len(entries)].reshape(-1, 8)
+        for i, shift in enumerate([0, 8, 16]):
+            table[:, i] = (entries[:, 0] >> shift) & 0xFF
+            table[:, 3 + i] = (entries[:, 1] >> shift) & 0xFF
+        table[:, 6] = entries[:, 2] & 0xFF
+        table[:, 7] = (entries[:, 2] >> 8) & 0xFF
+        return data.tobytes()
 
     def pretty_string(self):
         s = ""
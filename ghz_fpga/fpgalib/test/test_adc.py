@@ -0,0 +1,189 @@
+"""Tests for decoding of ADC readback packets."""
+
+import struct
+
+import numpy as np
+import pytest
+
+import fpgalib.adc as adc
+
+
+def makeDemodPackets(data, rchan, countrb=1):
+    """Pack demod data[stat][trigger][channel][IQ] into Build7 packets."""
+    packets = []
+    for stat in data:
+        vals = list(np.asarray(stat).flatten())
+        nPackets = int(np.ceil(len(vals) / 22.0))
+        vals = vals + [0] * (22 * nPackets - len(vals))
+        for count in range(nPackets):
+            packets.append(
+                struct.pack("<22h", *vals[22 * count : 22 * (count + 1)])
+                + struct.pack("<HBB", countrb, count, 0)
+            )
+    return packets
+
+
+@pytest.mark.parametrize(
+    "triggerTable",
+    [
+        [(3, 0, 0, 2)],
+        [(5, 0, 0, 11)],
+        [(2, 0, 0, 4), (3, 0, 0, 4)],
+        [(1, 0, 0, 1)],
+    ],
+)
+def test_build7_extract_demod(triggerTable):
+    stats = 7
+    rchan = triggerTable[0][3]
+    totalTriggers = sum(trig[0] for trig in triggerTable)
+    data = np.random.randint(-(2**15), 2**15, size=(stats, totalTriggers, rchan, 2))
+    packets = makeDemodPackets(data, rchan, countrb=300)
+    demod, pktCounters, readbackCounters = adc.ADC_Build7.extractDemod(
+        packets, triggerTable, "iq"
+    )
+    assert demod.shape == (rchan, stats, totalTriggers, 2)
+    np.testing.assert_array_equal(demod, data.transpose(2, 0, 1, 3))
+    nPackets = len(packets) // stats
+    assert pktCounters == list(range(nPackets))
+    assert readbackCounters == [300] * nPackets
+
+
+@pytest.mark.parametrize("nTriggers", [1, 31, 32, 45])
+def test_build7_extract_demod_bits(nTriggers):
+    stats = 5
+    triggerTable = [(nTriggers, 0, 0, 3)]
+    data = np.random.randint(-(2**15), 2**15, size=(stats, nTriggers, 3, 2))
+    packets = makeDemodPackets(data, 3)
+    thresholds = {0: (1000.0, 0.0), 1: (-200.0, np.pi / 2)}
+    bits, pktCounters, readbackCounters = adc.ADC_Build7.extractDemod(
+        packets, triggerTable, "bits", thresholds
+    )
+    nWords = (nTriggers + 31) // 32
+    assert bits.shape == (3, stats, nWords)
+    assert bits.dtype == np.uint32
+    data = data.transpose(2, 0, 1, 3)
+    expected = [
+        data[0, :, :, 0] > 1000,
+        data[1, :, :, 1] > -200,
+        data[2, :, :, 0] > 0,
+    ]
+    for channel in range(3):
+        for stat in range(stats):
+            for trigger in range(nTriggers):
+                word = int(bits[channel, stat, trigger // 32])
+                state = (word >> (trigger % 32)) & 1
+                assert state == expected[channel][stat, trigger]
+    # unused bits are zero
+    if nTriggers % 32:
+        assert not (bits[..., -1] >> (nTriggers % 32)).any()
+
+
+def test_build7_extract_demod_rejects_bad_input():
+    packets = makeDemodPackets(np.zeros((2, 3, 4, 2), dtype=int), 4)
+    with pytest.raises(RuntimeError):
+        adc.ADC_Build7.extractDemod(packets, [(3, 0, 0, 4), (1, 0, 0, 2)], "iq")
+    with pytest.raises(RuntimeError):
+        adc.ADC_Build7.extractDemod(packets[:-1], [(3, 0, 0, 4)], "iq")
+    with pytest.raises(RuntimeError):
+        adc.ADC_Build7.extractDemod(packets, [(3, 0, 0, 4)], "bytes")
+
+
+def referenceBuild1Demod(packets):
+    """Per-packet decoding as done by the original ADC_Build1.extractDemod."""
+    vals = []
+    ranges = []
+    twosComp = lambda i: int(i if i < 0x8 else i - 0x10)
+    for pkt in packets:
+        vals.extend(struct.unpack("<22h", pkt[:44]))
+        Irng, Qrng = pkt[46], pkt[47]
+        ranges.append(
+            (
+                twosComp((Irng >> 4) & 0xF),
+                twosComp((Irng >> 0) & 0xF),
+                twosComp((Qrng >> 4) & 0xF),
+                twosComp((Qrng >> 0) & 0xF),
+            )
+        )
+    ranges = np.array(ranges).T
+    Is, Qs = np.array(vals).reshape(-1, 2).T
+    return (
+        (Is, Qs),
+        (max(ranges[0]), min(ranges[1]), max(ranges[2]), min(ranges[3])),
+    )
+
+
+@pytest.mark.parametrize("nPackets", [1, 3, 40])
+def test_build1_extract_demod(nPackets):
+    packets = [
+        np.random.randint(0, 256, size=48, dtype=np.uint8).tobytes()
+        for _ in range(nPackets)
+    ]
+    (Is, Qs), ranges = adc.ADC_Build1.extractDemod(packets, 11)
+    (refIs, refQs), refRanges = referenceBuild1Demod(packets)
+    np.testing.assert_array_equal(Is, refIs)
+    np.testing.assert_array_equal(Qs, refQs)
+    assert ranges == refRanges
+    assert all(type(r) is int for r in ranges)
+
+
+def test_build1_get_range():
+    ranges = np.array([[0x7F, 0x08], [0x80, 0xF1]], dtype=np.uint8)
+    Imax, Imin, Qmax, Qmin = adc.ADC_Build1.getRange(ranges)
+    np.testing.assert_array_equal(Imax, [7, -8])
+    np.testing.assert_array_equal(Imin, [-1, 0])
+    np.testing.assert_array_equal(Qmax, [0, -1])
+    np.testing.assert_array_equal(Qmin, [-8, 1])
+
+
+def test_build1_extract_average():
+    data = np.random.randint(-(2**15), 2**15, size=(3, 256, 2))
+    packets = [row.astype("<i2").tobytes() for row in data]
+    Is, Qs = adc.ADC_Build1.extractAverage(packets)
+    np.testing.assert_array_equal(Is, data[..., 0].flatten())
+    np.testing.assert_array_equal(Qs, data[..., 1].flatten())
+
+
+def test_demod_reduction():
+    data = np.random.randint(-(2**15), 2**15, size=(3, 50, 4, 2))
+    thresholds = {0: (100.0, 0.0), 2: (-50.0, np.pi / 3)}
+    reduction = adc.DemodReduction(3, 4, thresholds)
+    bounds = [0, 1, 17, 40, 40, 50]
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        reduction.add(data[:, start:stop])
+    assert reduction.n == 50
+    np.testing.assert_allclose(reduction.mean, data.mean(axis=1))
+    np.testing.assert_allclose(reduction.variance(), data.var(axis=1))
+    np.testing.assert_array_equal(
+        reduction.counts[0], (data[0, :, :, 0] > 100).sum(axis=0)
+    )
+    projected = data[2, :, :, 0] * np.cos(np.pi / 3) + data[2, :, :, 1] * np.sin(
+        np.pi / 3
+    )
+    np.testing.assert_array_equal(reduction.counts[2], (projected > -50).sum(axis=0))
+    mean, variance, counts = reduction.channel(1)
+    np.testing.assert_allclose(mean, data[1].mean(axis=0))
+    assert list(counts) == [-1] * 4
+
+
+def test_build7_runner_reduce():
+    dev = adc.ADC_Build7(1, "Test ADC 1")
+    triggerTable = [(3, 0, 0, 4)]
+    reps = 10
+    info = {
+        "runMode": "demodulate",
+        "startDelay": 0,
+        "triggerTable": triggerTable,
+        1: {"threshold": (0.0, 0.0)},
+    }
+    runner = dev.buildRunner(reps, info)
+    runner.REDUCTION_CHUNK_STATS = 3
+    data = np.random.randint(-(2**15), 2**15, size=(reps, 3, 4, 2))
+    packets = makeDemodPackets(data, 4)
+    assert len(packets) == runner.nPackets
+    reduction = runner.reduce(packets)
+    full = data.transpose(2, 0, 1, 3)
+    np.testing.assert_allclose(reduction.mean, full.mean(axis=1))
+    np.testing.assert_allclose(reduction.variance(), full.var(axis=1))
+    np.testing.assert_array_equal(
+        reduction.counts[1], (full[1, :, :, 0] > 0).sum(axis=0)
+    )
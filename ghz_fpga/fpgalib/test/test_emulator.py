@@ -0,0 +1,289 @@
+"""Run the FPGA server against emulated boards."""
+
+import numpy as np
+import pytest
+from twisted.internet import task
+
+import fpgalib.adc as adc
+import fpgalib.dac as dac
+import ghz_fpga_server
+from fpgalib import emulator
+from labrad import types as T
+
+GROUP = "Emulated"
+DACS = ["Emulated DAC 1", "Emulated DAC 2"]
+ADC = "Emulated ADC 3"
+
+
+def wait(d, clock, timeout=10.0):
+    """Advance the clock until the deferred d has fired, and get its result."""
+    results = []
+    d.addBoth(results.append)
+    for _ in range(int(timeout / 0.01)):
+        if results:
+            break
+        clock.advance(0.01)
+    assert results, "deferred did not fire"
+    if hasattr(results[0], "raiseException"):
+        results[0].raiseException()
+    return results[0]
+
+
+def makeServer(clock, latency=0.0):
+    boards = [("DAC", 1, 8, 0), ("DAC", 2, 8, 0), ("ADC", 3, 7, 0)]
+    cxn = emulator.emulatedConnection([(GROUP, 1, boards)], latency, clock=clock)
+    server = ghz_fpga_server.FPGAServer()
+    emulator.useConnection(server, cxn)
+    wait(server.initServer(), clock)
+    c = server.newContext(1)
+    server.initContext(c)
+    (de,) = [s._server for s in cxn.servers.values() if s.name != "Registry"]
+    return server, c, de.adapterList[1].boards
+
+
+def configure(server, c, triggerTable):
+    mem = dac.MemorySequence().noOp().sramStartAddress(0).sramEndAddress(99)
+    mem.startTimer().runSram().delayCycles(10).stopTimer().branchToStart()
+    for name in DACS:
+        server.select_device(c, name)
+        server.dac_memory(c, list(mem))
+        server.dac_sram(c, np.arange(100, dtype="<u4"))
+    server.select_device(c, ADC)
+    server.adc_run_mode(c, "demodulate")
+    server.start_delay(c, 0)
+    server.adc_trigger_table(c, triggerTable)
+    for channel in range(triggerTable[0][3]):
+        server.adc_mixer_table(c, channel, np.zeros((512, 2), dtype=int))
+    server.sequence_boards(c, DACS + [ADC])
+
+
+@pytest.mark.parametrize("latency", [0.0, 0.001])
+def test_emulated_run_sequence(latency):
+    clock = task.Clock()
+    server, c, boards = makeServer(clock, latency)
+    names = [server.devices[i].name for i in range(3)]
+    assert sorted(names) == sorted(DACS + [ADC])
+
+    configure(server, c, [(2, 100, 50, 3), (1, 100, 50, 3)])
+    server.sequence_timing_order(c, [ADC + "::2", ADC + "::0"])
+    for reps in [30, 60]:
+        ans = wait(server.run_sequence(c, reps, True), clock)
+        demodData = boards["00:01:CA:AA:01:03"].demodData
+        assert ans.shape == (2, reps, 3, 2)
+        assert np.array_equal(ans[0], demodData[:, :, 2, :])
+        assert np.array_equal(ans[1], demodData[:, :, 0, :])
+    # The DACs ran as master and slave, and the ADC on the daisy chain.
+    for board in boards.values():
+        assert board.executionCount == 90
+    timers = boards["00:01:CA:AA:00:01"].timers
+    assert len(timers) == 60
+
+    server.select_device(c, DACS[1])
+    assert wait(server.build_number(c), clock) == "8"
+    assert wait(server.execution_counter(c), clock) == 90
+
+
+def test_emulated_reduce():
+    clock = task.Clock()
+    server, c, boards = makeServer(clock)
+    configure(server, c, [(4, 100, 50, 2)])
+    server.select_device(c, ADC)
+    server.adc_demod_threshold(c, 1, 0.0)
+    server.sequence_timing_order(c, [ADC + "::0", ADC + "::1"])
+    means, variances, counts = wait(
+        server.run_sequence(c, 100, True, [], [], True), clock
+    )
+    demodData = boards["00:01:CA:AA:01:03"].demodData
+    assert np.allclose(means, demodData.mean(axis=0).transpose(1, 0, 2))
+    assert np.allclose(variances, demodData.var(axis=0).transpose(1, 0, 2))
+    assert np.array_equal(counts[0], [-1] * 4)
+    assert np.array_equal(counts[1], (demodData[:, :, 1, 0] > 0).sum(axis=0))
+
+
+def test_emulated_reduce_chunks(monkeypatch):
+    clock = task.Clock()
+    server, c, boards = makeServer(clock, 0.001)
+    configure(server, c, [(4, 100, 50, 2)])
+    server.select_device(c, ADC)
+    server.adc_demod_threshold(c, 1, 0.0)
+    server.sequence_timing_order(c, [ADC + "::0", ADC + "::1"])
+    # the data is read and reduced 7 stats at a time
+    monkeypatch.setattr(adc.AdcRunner_Build7, "REDUCTION_CHUNK_STATS", 7)
+    chunks = []
+    addToReduction = adc.AdcRunner_Build7.addToReduction
+
+    def record(runner, reduction, packets):
+        chunks.append(len(packets))
+        addToReduction(runner, reduction, packets)
+
+    monkeypatch.setattr(adc.AdcRunner_Build7, "addToReduction", record)
+    means, variances, counts = wait(
+        server.run_sequence(c, 100, True, [], [], True), clock
+    )
+    pktPerStat = len(chunks) and sum(chunks) // 100
+    assert chunks == [7 * pktPerStat] * 14 + [2 * pktPerStat]
+    demodData = boards["00:01:CA:AA:01:03"].demodData
+    assert np.allclose(means, demodData.mean(axis=0).transpose(1, 0, 2))
+    assert np.allclose(variances, demodData.var(axis=0).transpose(1, 0, 2))
+    assert np.array_equal(counts[1], (demodData[:, :, 1, 0] > 0).sum(axis=0))
+
+    # data that cannot be reduced is discarded, so the next run is not off
+    server.adc_run_mode(c, "average")
+    with pytest.raises(RuntimeError, match="needs demodulate mode"):
+        wait(server.run_sequence(c, 100, True, [], [], True), clock)
+    server.adc_run_mode(c, "demodulate")
+    ans = wait(server.run_sequence(c, 100, True), clock)
+    demodData = boards["00:01:CA:AA:01:03"].demodData
+    assert np.array_equal(ans[1], demodData[:, :, 1, :])
+
+
+def test_emulated_timeout():
+    clock = task.Clock()
+    server, c, boards = makeServer(clock)
+    dev = server.devices[0]
+    d = dev.makePacket().timeout(T.Value(1, "s")).read(1).send()
+    results = []
+    d.addBoth(results.append)
+    clock.advance(0.5)
+    assert results == []
+    clock.advance(0.5)
+    assert len(results) == 1
+    assert results[0].check(T.Error)
+
+
+def test_emulated_dac_timing():
+    clock = task.Clock()
+    server, c, boards = makeServer(clock)
+    configure(server, c, [(1, 100, 50, 1)])
+    server.sequence_timing_order(c, [DACS[1], DACS[0]])
+    ans = wait(server.run_sequence(c, 300, True), clock)
+    assert ans.shape == (2, 1, 300)
+    assert ans.dtype == np.uint32
+    assert np.array_equal(ans[0, 0], boards["00:01:CA:AA:00:02"].timers)
+    assert np.array_equal(ans[1, 0], boards["00:01:CA:AA:00:01"].timers)
+
+
+def test_dac_extract():
+    rng = np.random.RandomState(0)
+    packets = [rng.bytes(70) for _ in range(50)]
+    # timers are read from bytes 3 to 63 of each packet
+    expected = np.concatenate(
+        [np.frombuffer(p[3:63], dtype="<u2") for p in packets]
+    ).astype("u4")
+    timers = dac.DacRunner_Build8.extract(packets)
+    assert timers.dtype == expected.dtype
+    assert np.array_equal(timers, expected)
+    assert np.array_equal(
+        ghz_fpga_server.BoardGroup.extractTiming(None, packets), expected
+    )
+    assert len(dac.DacRunner_Build8.extract([])) == 0
+    with pytest.raises(RuntimeError):
+        dac.DacRunner_Build8.extract(packets + [b"\x00" * 69])
+
+
+def test_emulated_batch():
+    points = []
+    for point in range(7):
+        sram = np.full(100, point, dtype="<u4")
+        deltas = [("SRAM", name, sram) for name in DACS]
+        deltas.append(("ADC Demod Threshold", ADC, (1, 10.0 * point)))
+        points.append((deltas, [], ["point"]))
+
+    # each point runs with its own SRAM
+    clock = task.Clock()
+    server, c, boards = makeServer(clock)
+    configure(server, c, [(2, 100, 50, 2)])
+    server.sequence_timing_order(c, [ADC + "::1", ADC + "::0"])
+    board = boards["00:01:CA:AA:00:02"]
+    pageLen = board.deviceClass.SRAM_PAGE_LEN
+    ran = []
+    run = board.run
+    board.run = lambda page, reps, stream: (
+        ran.append(board.sram[page * pageLen]),
+        run(page, reps, stream),
+    )
+    batch = wait(server.run_sequence_batch(c, points, 30), clock)
+    assert ran == list(range(7))
+    assert batch.shape == (7, 2, 30, 2, 2)
+    assert server.selectedDevice(c).name == ADC
+    reduced = wait(server.run_sequence_batch(c, points, 30, True, True), clock)
+    assert [x.shape for x in reduced] == [(7, 2, 2, 2), (7, 2, 2, 2), (7, 2, 2)]
+
+    # and gets the same data as when run one by one
+    clock = task.Clock()
+    server, c, boards = makeServer(clock)
+    configure(server, c, [(2, 100, 50, 2)])
+    server.sequence_timing_order(c, [ADC + "::1", ADC + "::0"])
+    for i, (deltas, setupPkts, setupState) in enumerate(points):
+        server.applyDeltas(c, deltas)
+        ans = wait(server.run_sequence(c, 30, True, setupPkts, setupState), clock)
+        assert np.array_equal(ans, batch[i])
+    for i, (deltas, setupPkts, setupState) in enumerate(points):
+        server.applyDeltas(c, deltas)
+        ans = wait(server.run_sequence(c, 30, True, setupPkts, setupState, True), clock)
+        for x, y in zip(ans, reduced):
+            assert np.array_equal(x, y[i])
+
+    with pytest.raises(ValueError):
+        server.applyDeltas(c, [("Daisy Chain", DACS[0], DACS)])
+    for reduce in [False, True]:
+        with pytest.raises(ValueError, match="at least one point"):
+            wait(server.run_sequence_batch(c, [], 30, True, reduce), clock)
+
+
+def test_emulated_batch_adc_settings():
+    points = []
+    for point in range(8):
+        triggerTable = [(2, 100, 50 + point, 2)]
+        deltas = [
+            ("ADC Trigger Table", ADC, triggerTable),
+            ("ADC Demod Threshold", ADC, (1, -1000.0 + 300 * point)),
+        ]
+        points.append((deltas, [], []))
+
+    # each point is extracted with its own trigger table
+    extracted = []
+    extract = adc.AdcRunner_Build7.extract
+    reduce = adc.AdcRunner_Build7.reduce
+
+    def record(func):
+        def wrapped(runner, packets):
+            extracted.append(runner.info["triggerTable"][0][2])
+            return func(runner, packets)
+
+        return wrapped
+
+    clock = task.Clock()
+    server, c, boards = makeServer(clock, 0.001)
+    configure(server, c, [(2, 100, 50, 2)])
+    server.sequence_timing_order(c, [ADC + "::1", ADC + "::0"])
+    adc.AdcRunner_Build7.extract = record(extract)
+    adc.AdcRunner_Build7.reduce = record(reduce)
+    try:
+        batch = wait(server.run_sequence_batch(c, points, 30), clock)
+        assert extracted == [50 + point for point in range(8)]
+        reduced = wait(server.run_sequence_batch(c, points, 30, True, True), clock)
+    finally:
+        adc.AdcRunner_Build7.extract = extract
+        adc.AdcRunner_Build7.reduce = reduce
+
+    # and is reduced against its own thresholds, as when run one by one
+    clock = task.Clock()
+    server, c, boards = makeServer(clock, 0.001)
+    configure(server, c, [(2, 100, 50, 2)])
+    server.sequence_timing_order(c, [ADC + "::1", ADC + "::0"])
+    for i, (deltas, setupPkts, setupState) in enumerate(points):
+        server.applyDeltas(c, deltas)
+        ans = wait(server.run_sequence(c, 30, True, setupPkts, setupState), clock)
+        assert np.array_equal(ans, batch[i])
+    for i, (deltas, setupPkts, setupState) in enumerate(points):
+        server.applyDeltas(c, deltas)
+        ans = wait(server.run_sequence(c, 30, True, setupPkts, setupState, True), clock)
+        for x, y in zip(ans, reduced):
+            assert np.array_equal(x, y[i])
+    assert len(set(reduced[2][:, 0, 0])) > 1
+
+    # a point that changes the number of triggers fails the batch
+    points[5][0][0] = ("ADC Trigger Table", ADC, [(3, 100, 50, 2)])
+    with pytest.raises(ValueError, match="point 5"):
+        wait(server.run_sequence_batch(c, points, 30), clock)
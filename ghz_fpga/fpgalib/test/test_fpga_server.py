@@ -21,11 +21,14 @@ being sent to the boards.
 import mock
 import numpy as np
 import pytest
+from twisted.internet import defer
 
+import fpgalib.adc as adc
 import fpgalib.dac as dac
 import fpgalib.fpga as fpga
 import fpgalib.jump_table as jump_table
 import ghz_fpga_server
+from labrad import types as T
 from labrad.units import Value
 
 NUM_DACS = 3
@@ -75,12 +78,12 @@ class TestFPGAServer(object):
         dataIn = np.zeros(PERIOD)
         startAddr, endAddr = 0, len(dataIn)
         jt = self.dev.jt_run_sram(startAddr, endAddr, loop=True)
-        jt_packet = np.fromstring(jt.toString(), dtype="u1")
+        jt_packet = np.frombuffer(jt.toString(), dtype="u1")
         entry = jump_table.JumpEntry(
             PERIOD // 4 + _JUMP_TABLE_FROM_ADDR_OFFSET, 0, jump_table.JUMP(1)
         )
         matching_jt = jump_table.JumpTable(start_addr=0, jumps=[entry])
-        matching_jt_packet = np.fromstring(matching_jt.toString(), dtype="u1")
+        matching_jt_packet = np.frombuffer(matching_jt.toString(), dtype="u1")
         assert np.array_equal(matching_jt_packet, jt_packet)
 
     def test_basic_run(self):
@@ -95,7 +98,7 @@ class TestFPGAServer(object):
             ],
             counters=[0, 0, 0, 0],
         )
-        matching_packet = np.fromstring(matching_jt.toString(), dtype="u1")
+        matching_packet = np.frombuffer(matching_jt.toString(), dtype="u1")
 
         s, c = self.server, self.ctx
         # do this board
@@ -128,9 +131,27 @@ class TestFPGAServer(object):
         assert np.array_equal(load_writes[0], matching_packet)
         assert load_writes[1][0] == load_writes[1][1] == 0
         assert np.array_equal(
-            load_writes[1][2:], np.fromstring(sram_data.tostring(), dtype="u1")
+            load_writes[1][2:], np.frombuffer(sram_data.tobytes(), dtype="u1")
         )
 
+    def test_sram_packets(self):
+        sram_data = np.random.randint(0, 2**32, size=600, dtype=np.uint64)
+        sram_data = sram_data.astype("<u4")
+        pkts = dac.DAC_Build15.pktsWriteSram(sram_data.tobytes(), 10)
+        assert pkts.shape == (3, 1026)
+        for i, pkt in enumerate(pkts):
+            assert pkt[0] == 10 + i
+            assert pkt[1] == 0
+            words = sram_data[256 * i : 256 * (i + 1)]
+            assert pkt[2 : 2 + 4 * len(words)].tobytes() == words.tobytes()
+        # the last derp is padded with zeros
+        assert not pkts[2, 2 + 4 * 88 :].any()
+        pkt = dac.DAC_Build15.pktWriteSram(70, sram_data[:5])
+        assert pkt.shape == (1026,)
+        assert pkt[:2].tolist() == [70, 0]
+        assert pkt[2:22].tobytes() == sram_data[:5].tobytes()
+        assert not pkt[22:].any()
+
     def test_multiple_boards(self):
         loop_delay = Value(250, "us")
         start_delays = [(NUM_DACS - i) * 10 for i in range(NUM_DACS)]
@@ -150,7 +171,7 @@ class TestFPGAServer(object):
             ],
             counters=[0, 0, 0, 0],
         )
-        matching_jt_packet = np.fromstring(matching_jt.toString(), dtype="u1")
+        matching_jt_packet = np.frombuffer(matching_jt.toString(), dtype="u1")
         # set up the DACs
         s, c = self.server, self.ctx
         daisy_chain = []
@@ -190,14 +211,299 @@ class TestFPGAServer(object):
             # check SRAM packets
             assert len(load_writes) == 3
             if i == 0:
-                assert load_writes[1][2:].tostring() == sram_data_1[:256].tostring()
-                assert load_writes[2][2:].tostring() == sram_data_1[256:].tostring()
+                assert load_writes[1][2:].tobytes() == sram_data_1[:256].tobytes()
+                assert load_writes[2][2:].tobytes() == sram_data_1[256:].tobytes()
             else:
-                assert load_writes[1][2:].tostring() == sram_data_2[:256].tostring()
-                assert load_writes[2][2:].tostring() == sram_data_2[256:].tostring()
+                assert load_writes[1][2:].tobytes() == sram_data_2[:256].tobytes()
+                assert load_writes[2][2:].tobytes() == sram_data_2[256:].tobytes()
             # check JT
             assert np.array_equal(matching_jt_packet, load_writes[0])
 
+    def test_packet_cache(self):
+        s, c = self.server, self.ctx
+        daisy_chain = []
+        for i in range(1, NUM_DACS + 1):
+            s.select_device(c, i)
+            s.jump_table_clear(c)
+            s.jump_table_add_entry(c, "END", 256)
+            s.dac_sram(c, np.zeros(256, dtype="<u4"))
+            s.loop_delay(c, Value(50, "us"))
+            s.start_delay(c, 0)
+            daisy_chain.append("Test DAC {}".format(i))
+        de = mock.MagicMock()
+        group = ghz_fpga_server.BoardGroup(s, de, 1)
+        group.configure(
+            "Test", [("DAC {}".format(i), 0) for i in range(1, NUM_DACS + 1)]
+        )
+        devs = [s.getDevice(c, name) for name in daisy_chain]
+        for i, dev in enumerate(devs):
+            # normally set when connecting to the board
+            dev.devName = daisy_chain[i]
+            dev.MAC = dev.macFor(i + 1)
+
+        def make_packets(reps, page=0):
+            runners = [dev.buildRunner(reps, c.get(dev, {})) for dev in devs]
+            return group.makePackets(runners, page, reps, [])
+
+        with mock.patch.object(
+            dac.DAC_Build15, "loadJumpTable"
+        ) as load, mock.patch.object(dac.DAC_Build15, "loadSram"):
+            _, _, run_pkts, collect_pkts, read_pkts = make_packets(100)
+            num_de_packets = de.packet.call_count
+            num_dev_packets = [dev.server.packet.call_count for dev in devs]
+            # same configuration: everything but the load packets is reused
+            _, _, run_pkts_2, collect_pkts_2, read_pkts_2 = make_packets(100)
+            assert run_pkts_2 is run_pkts
+            assert all(a is b for a, b in zip(collect_pkts, collect_pkts_2))
+            assert all(a is b for a, b in zip(read_pkts, read_pkts_2))
+            assert de.packet.call_count == num_de_packets
+            assert [dev.server.packet.call_count for dev in devs] == num_dev_packets
+            # the load packets are still made for every sequence
+            assert load.call_count == 2 * NUM_DACS
+            # a different number of reps changes the run packets
+            make_packets(200)
+            assert de.packet.call_count == 2 * num_de_packets
+        # reconfiguring the board group empties the cache
+        group.configure(
+            "Test", [("DAC {}".format(i), 0) for i in range(1, NUM_DACS + 1)]
+        )
+        assert len(group.packetCache) == 0
+
+    def _make_board_group(self, daisy_chain):
+        s, c = self.server, self.ctx
+        group = ghz_fpga_server.BoardGroup(s, mock.MagicMock(), 1)
+        group.configure(
+            "Test", [("DAC {}".format(i), 0) for i in range(1, NUM_DACS + 1)]
+        )
+        devs = [s.getDevice(c, name) for name in daisy_chain]
+        for i, dev in enumerate(devs):
+            # normally set when connecting to the board
+            dev.devName = daisy_chain[i]
+            dev.MAC = dev.macFor(i + 1)
+            dev.boardGroup = group
+        return group, devs
+
+    def test_load_dedup(self):
+        s, c = self.server, self.ctx
+        all_pages = ghz_fpga_server.ALL_PAGES
+        daisy_chain = []
+        for i in range(1, NUM_DACS + 1):
+            s.select_device(c, i)
+            s.jump_table_clear(c)
+            s.jump_table_add_entry(c, "END", 256)
+            s.dac_sram(c, np.full(256, i, dtype="<u4"))
+            s.loop_delay(c, Value(50, "us"))
+            s.start_delay(c, 0)
+            daisy_chain.append("Test DAC {}".format(i))
+        group, devs = self._make_board_group(daisy_chain)
+
+        def unloaded_parts():
+            runners = [dev.buildRunner(100, c.get(dev, {})) for dev in devs]
+            load_pkts = group.makePackets(runners, 0, 100, [])[0]
+            unloaded = group.unloadedPackets(load_pkts)
+            group.markLoaded(unloaded)
+            return [key[0] for p, key in unloaded]
+
+        def unloaded_boards():
+            boards = [board for board, part in unloaded_parts()]
+            return sorted(set(boards), key=boards.index)
+
+        with mock.patch.object(dac.DAC_Build15, "loadJumpTable"), mock.patch.object(
+            dac.DAC_Build15, "loadSram"
+        ):
+            assert unloaded_boards() == daisy_chain
+            # nothing changed, nothing to load
+            assert unloaded_boards() == []
+            # new SRAM for one board
+            s.select_device(c, 2)
+            s.dac_sram(c, np.zeros(256, dtype="<u4"))
+            assert unloaded_parts() == [(daisy_chain[1], all_pages)]
+            # new jump table for another, without its SRAM
+            s.select_device(c, 3)
+            s.jump_table_clear(c)
+            s.jump_table_add_entry(c, "END", 512)
+            assert unloaded_parts() == [(daisy_chain[2], dac.JUMP_TABLE)]
+            assert unloaded_boards() == []
+            # as when only the counters change
+            s.jump_table_set_counters(c, [10])
+            assert unloaded_parts() == [(daisy_chain[2], dac.JUMP_TABLE)]
+            s.jump_table_set_counters(c, [10])
+            assert unloaded_parts() == []
+
+            # direct SRAM writes and board resets invalidate that board
+            s.select_device(c, 1)
+            s.dac_write_sram(c, [0, 1, 2])
+            assert unloaded_boards() == [daisy_chain[0]]
+            s.select_device(c, 2)
+            with mock.patch.object(dac.DAC_Build15, "resetPLL"):
+                s.pll_reset(c)
+            assert unloaded_boards() == [daisy_chain[1]]
+            # bringup does not get far on a mock board, but far enough
+            s.dac_bringup(c).addErrback(lambda failure: None)
+            assert unloaded_boards() == [daisy_chain[1]]
+
+            # timeouts invalidate all boards of the sequence
+            runners = [dev.buildRunner(100, c.get(dev, {})) for dev in devs[:2]]
+            group.recoverFromTimeout(runners, [(True, None), (False, None)])
+            assert unloaded_boards() == daisy_chain[:2]
+
+            # so does reconfiguring the board group
+            group.configure(
+                "Test", [("DAC {}".format(i), 0) for i in range(1, NUM_DACS + 1)]
+            )
+            assert unloaded_boards() == daisy_chain
+
+    def test_load_dedup_pages(self):
+        group, devs = self._make_board_group(["Test DAC 1"])
+        all_pages = ghz_fpga_server.ALL_PAGES
+        group.markLoaded([(None, (("Test DAC 1", 0), "a"))])
+        group.markLoaded([(None, (("Test DAC 1", 1), "b"))])
+        assert group.loadedContent == {("Test DAC 1", 0): "a", ("Test DAC 1", 1): "b"}
+        # long SRAM overwrites all pages
+        group.markLoaded([(None, (("Test DAC 1", all_pages), "c"))])
+        assert group.loadedContent == {("Test DAC 1", all_pages): "c"}
+        # and is partly overwritten by any page
+        group.markLoaded([(None, (("Test DAC 1", 1), "b"))])
+        assert group.loadedContent == {("Test DAC 1", 1): "b"}
+        # the jump table is not SRAM, so it is kept by SRAM loads
+        group.markLoaded([(None, (("Test DAC 1", dac.JUMP_TABLE), "d"))])
+        group.markLoaded([(None, (("Test DAC 1", all_pages), "c"))])
+        assert group.loadedContent == {
+            ("Test DAC 1", all_pages): "c",
+            ("Test DAC 1", dac.JUMP_TABLE): "d",
+        }
+        # load packets without a content key are always sent
+        assert group.unloadedPackets([(None, None)]) == [(None, None)]
+
+    def test_detect_boards(self):
+        de = mock.MagicMock()
+        group = ghz_fpga_server.BoardGroup(self.server, de, 1)
+        group.configure("Test", [("DAC 1", 0), ("DAC 2", 0), ("ADC 1", 0)])
+        dac_resp = np.zeros(dac.DAC.READBACK_LEN, dtype="u1")
+        dac_resp[51] = DAC_BUILD
+        adc_resp = np.zeros(adc.ADC.READBACK_LEN, dtype="u1")
+        adc_resp[0] = 7
+        responses = [
+            (dac.DAC.macFor(1), None, None, dac_resp.tobytes()),
+            (dac.DAC.macFor(2), None, None, dac_resp.tobytes()),
+            (adc.ADC.macFor(1), None, None, adc_resp.tobytes()),
+        ]
+        de.packet.return_value.send.return_value = {"responses": responses}
+        de.read.side_effect = T.Error("timeout")
+        found = []
+        with mock.patch.object(group, "devices", return_value=[]):
+            group.detectBoards().addCallback(found.extend)
+        assert sorted(name for name, args in found) == [
+            "Test ADC 1",
+            "Test DAC 1",
+            "Test DAC 2",
+        ]
+        # DAC and ADC detection each send the probes and read the expected
+        # responses with two packets, then try once to read responses of
+        # boards that are not configured.
+        assert de.packet.return_value.send.call_count == 4
+        assert de.read.call_count == 2
+        expected = [c[0][0] for c in de.packet.return_value.collect.call_args_list]
+        assert sorted(expected) == [1, 2]
+
+        # DAC 2 does not respond, so collecting the DAC responses times out
+        # after the full timeout, and the response of DAC 1 is read after it
+        clock = [0.0]
+
+        def send(context):
+            sends.append(context)
+            if len(sends) == 2:
+                clock[0] += 1.0
+                return defer.fail(T.Error("timeout"))
+            elif len(sends) == 4:
+                return defer.succeed({"responses": responses[2:]})
+            return defer.succeed(None)
+
+        sends = []
+        reads = [defer.succeed([responses[0]])]
+        de.packet.return_value.send.side_effect = send
+        de.read.side_effect = lambda n, context: (
+            reads.pop(0) if reads else defer.fail(T.Error("timeout"))
+        )
+        found = []
+        with mock.patch.object(group, "devices", return_value=[]):
+            with mock.patch.object(ghz_fpga_server.time, "time", lambda: clock[0]):
+                group.detectBoards().addCallback(found.extend)
+        assert sorted(name for name, args in found) == ["Test ADC 1", "Test DAC 1"]
+
+    def test_pipeline_timing(self):
+        group = ghz_fpga_server.BoardGroup(self.server, mock.MagicMock(), 1)
+        times = group.stageTimes["read"]
+        for dt in range(ghz_fpga_server.STAGE_TIMES_TO_KEEP + 10):
+            times.add(float(dt))
+        # only the most recent times are kept, oldest first
+        assert times.count == ghz_fpga_server.STAGE_TIMES_TO_KEEP + 10
+        assert times.times()[0] == 10.0
+        assert times.times()[-1] == ghz_fpga_server.STAGE_TIMES_TO_KEEP + 9
+        with mock.patch.object(self.server, "boardGroups", {("DE", 1): group}):
+            ans = self.server.sequence_pipeline_timing(self.ctx, [0, 50, 100], 4)
+        (server, port), stages = ans[0]
+        assert [stage[0] for stage in stages] == ghz_fpga_server.PIPELINE_STAGES
+        name, count, percentiles, bin_edges, counts = stages[4]
+        assert name == "read"
+        assert list(percentiles) == [10, 509.5, 1009]
+        assert len(bin_edges) == 5
+        assert counts.sum() == ghz_fpga_server.STAGE_TIMES_TO_KEEP
+        # stages without any times
+        name, count, percentiles, bin_edges, counts = stages[0]
+        assert count == 0
+        assert list(percentiles) == [0, 0, 0]
+        assert counts.sum() == 0
+
+    def test_pipeline_depth(self):
+        group = ghz_fpga_server.BoardGroup(self.server, mock.MagicMock(), 1)
+        num_pages = ghz_fpga_server.NUM_PAGES
+
+        def record(run, collect, read, extract):
+            for stage, dt in [
+                ("run", run),
+                ("collect", collect),
+                ("read", read),
+                ("extract", extract),
+            ]:
+                group.stageTimes[stage].clear()
+                for i in range(ghz_fpga_server.MIN_PIPELINE_TIMES):
+                    group.stageTimes[stage].add(dt)
+
+        # too few times to go by
+        assert group.pipelineDepth() == num_pages
+        record(1.0, 1.0, 0.5, 0.5)
+        assert group.pipelineDepth() == num_pages + 1
+        record(1.0, 1.0, 0.1, 0.1)
+        assert group.pipelineDepth() == num_pages + 1
+        record(1.0, 1.0, 0.0, 0.0)
+        assert group.pipelineDepth() == num_pages
+        record(0.0, 0.0, 1.0, 1.0)
+        assert group.pipelineDepth() == ghz_fpga_server.MAX_PIPELINE_DEPTH
+
+        # the depth can change while sequences hold the pipe semaphore
+        sem = group.pipeSemaphore
+        acquired = []
+        for i in range(3):
+            sem.acquire().addCallback(acquired.append)
+        assert len(acquired) == 2
+        sem.setLimit(3)
+        assert len(acquired) == 3
+        sem.setLimit(1)
+        sem.acquire().addCallback(acquired.append)
+        held = []
+        group.acquirePipeline().addCallback(held.append)
+        sem.release()
+        sem.release()
+        assert len(acquired) == 3
+        sem.release()
+        assert len(acquired) == 4
+        assert held == []
+        sem.release()
+        assert held == [1]
+        group.releasePipeline(1)
+        assert sem.tokens == sem.limit == 1
+
     def _fake_run_sequence(self):
         """Emulate some of the logic of run_sequence for testing purposes."""
         s, c = self.server, self.ctx
@@ -213,7 +519,7 @@ class TestFPGAServer(object):
             p = runner.loadPacket(page=0, isMaster=is_master)
             self.load_packets.append(p)
             self.load_writes.append(
-                [np.fromstring(x[0][0], dtype="u1") for x in p.write.call_args_list]
+                [np.frombuffer(x[0][0], dtype="u1") for x in p.write.call_args_list]
             )
             self.run_packets.append(
                 runner.runPacket(
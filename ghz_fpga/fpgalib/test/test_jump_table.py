@@ -6,6 +6,8 @@ This is intended to test fpgalib/jump_table.py
 
 import numpy as np
 import pytest
+import fpgalib.dac  # registers the DAC builds
+import fpgalib.fpga as fpga
 import fpgalib.jump_table as jump_table
 
 
@@ -71,5 +73,61 @@ def test_table():
     assert np.array_equal(data[32:40], end.as_bytes())
 
 
+def referenceString(jt):
+    """Serialize a jump table entry by entry."""
+    data = np.zeros(jt.PACKET_LEN, dtype="u1")
+    for i, c in enumerate(jt.counters):
+        data[i * 4 : (i + 1) * 4] = [(c >> s) & 0xFF for s in (0, 8, 16, 24)]
+    data[16:19] = data[19:22] = [(jt.start_addr >> s) & 0xFF for s in (0, 8, 16)]
+    data[22] = 5
+    for i, jump in enumerate(jt.jumps):
+        data[24 + i * 8 : 32 + i * 8] = jump.as_bytes()
+    return data.tobytes()
+
+
+def test_table_serialize():
+    rng = np.random.RandomState(0)
+    for n in [0, 1, 5, jump_table.JumpTable.MAX_JUMPS]:
+        jumps = []
+        for i in range(n):
+            op = [
+                jump_table.END(),
+                jump_table.NOP(),
+                jump_table.IDLE(rng.randint(2**15)),
+                jump_table.JUMP(rng.randint(64)),
+                jump_table.CYCLE(rng.randint(4), rng.randint(64)),
+            ][i % 5]
+            fromAddr = rng.randint(2**24)
+            jumps.append(jump_table.JumpEntry(fromAddr, fromAddr + 2, op))
+        counters = list(rng.randint(0, 2**32, size=4, dtype=np.int64))
+        jt = jump_table.JumpTable(rng.randint(2**24), jumps, counters)
+        assert jt.toString() == referenceString(jt)
+        # an equal table reuses the serialized bytes
+        same = jump_table.JumpTable(jt.start_addr, list(jumps), list(counters))
+        assert same.toString() is jt.toString()
+        # a changed counter is serialized again
+        same.counters[3] = (same.counters[3] + 1) % 2**32
+        assert same.toString() == referenceString(same)
+        assert same.toString()[:12] == jt.toString()[:12]
+    with pytest.raises(ValueError):
+        jump_table.JumpTable(0, jumps + jumps[:1]).toString()
+
+
+def test_make_jump_table_cache():
+    build = fpga.REGISTRY[("DAC", 15)]
+    entries = [
+        build.make_jump_table_entry("CYCLE", [40, 20, 2, 0]),
+        build.make_jump_table_entry("END", [80]),
+    ]
+    jt = build.make_jump_table(entries, [10])
+    assert build.make_jump_table(list(entries), [10]) is jt
+    other = build.make_jump_table(entries, [11])
+    assert other is not jt
+    assert other.counters == [11, 0, 0, 0]
+    assert other.toString()[4:] == jt.toString()[4:]
+    with pytest.raises(ValueError):
+        build.make_jump_table([entries[1], entries[1]])
+
+
 if __name__ == "__main__":
     pytest.main(["-v", __file__])
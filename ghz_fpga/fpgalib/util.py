@@ -1,5 +1,7 @@
+import collections
 import time
 import os
+import numpy as np
 from twisted.internet import defer
 
 DUMP_NUM = 0
@@ -42,6 +44,105 @@ def littleEndian(data, bytes=4):
     return [(data >> ofs) & 0xFF for ofs in (0, 8, 16, 24)[:bytes]]
 
 
+class TimeRing(object):
+    """
+    A fixed size ring buffer of the most recent times (durations).
+    """
+
+    def __init__(self, size=100):
+        self.buffer = np.zeros(size)
+        self.count = 0  # number of times added, including overwritten ones
+
+    def __len__(self):
+        return min(self.count, len(self.buffer))
+
+    def add(self, dt):
+        self.buffer[self.count % len(self.buffer)] = dt
+        self.count += 1
+
+    def clear(self):
+        self.count = 0
+
+    def times(self):
+        """Returns an array of the stored times, oldest first."""
+        size = len(self.buffer)
+        if self.count <= size:
+            return self.buffer[: self.count].copy()
+        start = self.count % size
+        return np.concatenate((self.buffer[start:], self.buffer[:start]))
+
+    def percentiles(self, percents):
+        """Returns the given percentiles of the stored times (0 if empty)."""
+        if not len(self):
+            return np.zeros(len(percents))
+        return np.percentile(self.buffer[: len(self)], percents)
+
+    def histogram(self, bins=10):
+        """Returns (counts, binEdges) of the stored times."""
+        return np.histogram(self.buffer[: len(self)], bins=bins)
+
+
+class LRUCache(object):
+    """
+    A dict of at most size entries, dropping the least recently used.
+    """
+
+    def __init__(self, size=100):
+        self.size = size
+        self.entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, make):
+        """Get the value for key, calling make() to make it if necessary."""
+        if key in self.entries:
+            value = self.entries.pop(key)
+        else:
+            value = make()
+        self.entries[key] = value
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        self.entries.clear()
+
+
+class ResizableSemaphore(defer.DeferredSemaphore):
+    """
+    A DeferredSemaphore whose limit can be changed while it is in use.
+
+    After the limit is lowered below the number of current holders, the
+    waiting get tokens only once enough holders have released theirs.
+    """
+
+    def setLimit(self, limit):
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        self.tokens += limit - self.limit
+        self.limit = limit
+        self._wake()
+
+    def acquire(self):
+        d = defer.Deferred()
+        if self.tokens > 0:
+            self.tokens -= 1
+            d.callback(self)
+        else:
+            self.waiting.append(d)
+        return d
+
+    def release(self):
+        self.tokens += 1
+        self._wake()
+
+    def _wake(self):
+        while self.tokens > 0 and self.waiting:
+            self.tokens -= 1
+            self.waiting.pop(0).callback(self)
+
+
 class TimedLock(object):
     """
     A lock that times how long it takes to acquire.
@@ -52,18 +153,14 @@ class TimedLock(object):
 
     def __init__(self):
         self.waiting = []
+        self.timeRing = TimeRing(self.TIMES_TO_KEEP)
 
     @property
     def times(self):
-        if not hasattr(self, "_times"):
-            self._times = []
-        return self._times
+        return list(self.timeRing.times())
 
     def addTime(self, dt):
-        times = self.times
-        times.append(dt)
-        if len(times) > self.TIMES_TO_KEEP:
-            times.pop(0)
+        self.timeRing.add(dt)
 
     def meanTime(self):
         times = self.times
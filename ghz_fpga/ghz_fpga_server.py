@@ -189,6 +189,7 @@ timeout = 20
 ### END NODE INFO
 """
 
+import collections
 import itertools
 import logging
 import os
@@ -211,7 +212,7 @@ import labrad.util
 import fpgalib.adc as adc
 import fpgalib.dac as dac
 import fpgalib.fpga as fpga
-from fpgalib.util import TimedLock, LoggingPacket
+from fpgalib.util import TimedLock, TimeRing, LoggingPacket, ResizableSemaphore
 
 
 # The logging level is set at the bottom of the file where the server starts.
@@ -232,6 +233,41 @@ LOGGING_PACKET = False
 
 
 NUM_PAGES = 2
+# Most sequences let into BoardGroup.run at once (see pipelineDepth), and
+# the number of times each stage must have been recorded before the depth
+# adapts to them.
+MAX_PIPELINE_DEPTH = 4
+MIN_PIPELINE_TIMES = 10
+
+# Number of run, collect and read packets each board group keeps for reuse
+# by later sequences with the same configuration.
+PACKET_CACHE_SIZE = 64
+# Page key for content loaded by sequences that are not pageable
+ALL_PAGES = "all"
+# Stages of BoardGroup.run whose wall times are recorded, and the number of
+# times kept for each stage.
+PIPELINE_STAGES = ["build", "load", "run", "collect", "read", "extract"]
+STAGE_TIMES_TO_KEEP = 1000
+# Settings Run Sequence Batch can apply to a board before each point, by
+# setting name.
+BATCH_SETTINGS = {
+    "SRAM": "dac_sram",
+    "SRAM dual block": "dac_sram_dual_block",
+    "Memory": "dac_memory",
+    "Start Delay": "start_delay",
+    "Loop Delay": "loop_delay",
+    "Jump Table Clear": "jump_table_clear",
+    "Jump Table Add Entry": "jump_table_add_entry",
+    "Jump Table Set Counters": "jump_table_set_counters",
+    "ADC Run Mode": "adc_run_mode",
+    "ADC Trigger Table": "adc_trigger_table",
+    "ADC Mixer Table": "adc_mixer_table",
+    "ADC Demod Phase": "adc_demod_frequency",
+    "ADC Demod Threshold": "adc_demod_threshold",
+}
+# Time to wait for responses of boards which are not in the board group
+# configuration once the configured boards have responded to detection.
+DETECTION_DRAIN_TIMEOUT = 0.05
 
 I2C_RB = 0x100
 I2C_ACK = 0x200
@@ -277,19 +313,30 @@ class BoardGroup(object):
         self.directEthernetServer = directEthernetServer
         self.port = port
         self.ctx = None
-        self.pipeSemaphore = defer.DeferredSemaphore(NUM_PAGES)
+        self.pipeSemaphore = ResizableSemaphore(NUM_PAGES)
         self.pageNums = itertools.cycle(list(range(NUM_PAGES)))
         self.pageLocks = [TimedLock() for _ in range(NUM_PAGES)]
         self.runLock = TimedLock()
         self.readLock = TimedLock()
         self.setupState = set()
-        self.runWaitTimes = []
+        self.runWaitTimes = TimeRing(100)
+        self.stageTimes = dict(
+            (stage, TimeRing(STAGE_TIMES_TO_KEEP)) for stage in PIPELINE_STAGES
+        )
         self.prevTriggers = 0
+        self.packetCache = collections.OrderedDict()
+        # (board name, page) -> hash of the SRAM and memory last loaded to
+        # that page. Page is ALL_PAGES for sequences that are not pageable,
+        # or the name of a part loaded apart from the SRAM, like
+        # dac.JUMP_TABLE.
+        self.loadedContent = {}
 
     @inlineCallbacks
     def init(self):
         """Set up the direct ethernet server in our own context."""
         self.ctx = self.directEthernetServer.context()
+        self.packetCache.clear()
+        self.forgetLoaded()
         p = self.directEthernetServer.packet(context=self.ctx)
         p.connect(self.port)
         yield p.send()
@@ -313,6 +360,8 @@ class BoardGroup(object):
             "{} {}".format(name, boardName) for (boardName, delay) in boards
         ]
         self.boardDelays = [delay for (boardName, delay) in boards]
+        self.packetCache.clear()
+        self.forgetLoaded()
 
     @inlineCallbacks
     def detectBoards(self):
@@ -321,11 +370,10 @@ class BoardGroup(object):
         The autodetect operation is guarded by board group locks so that it
         will not conflict with sequences running on this board group.
         """
+        # Acquire all locks so we can ping boards without interfering with
+        # board group operations.
+        held = yield self.acquirePipeline()
         try:
-            # Acquire all locks so we can ping boards without interfering with
-            # board group operations.
-            for i in range(NUM_PAGES):
-                yield self.pipeSemaphore.acquire()
             for pageLock in self.pageLocks:
                 yield pageLock.acquire()
             yield self.runLock.acquire()
@@ -352,8 +400,7 @@ class BoardGroup(object):
             returnValue(found)
         finally:
             # Release all locks once we're done with autodetection.
-            for i in range(NUM_PAGES):
-                self.pipeSemaphore.release()
+            self.releasePipeline(held)
             for pageLock in self.pageLocks:
                 pageLock.release()
             self.runLock.release()
@@ -371,7 +418,12 @@ class BoardGroup(object):
 
         macs = [dac.DAC.macFor(board) for board in range(256)]
         return self._doDetection(
-            macs, dac.DAC.regPing(), dac.DAC.READBACK_LEN, callback
+            macs,
+            dac.DAC.regPing(),
+            dac.DAC.READBACK_LEN,
+            callback,
+            timeout,
+            self.numConfigured("DAC"),
         )
 
     def detectADCs(self, timeout=1.0):
@@ -386,11 +438,24 @@ class BoardGroup(object):
 
         macs = [adc.ADC.macFor(board) for board in range(256)]
         return self._doDetection(
-            macs, adc.ADC.regPing(), adc.ADC.READBACK_LEN, callback
+            macs,
+            adc.ADC.regPing(),
+            adc.ADC.READBACK_LEN,
+            callback,
+            timeout,
+            self.numConfigured("ADC"),
+        )
+
+    def numConfigured(self, boardType):
+        """Number of boards of a type ('DAC' or 'ADC') in the configuration."""
+        return len(
+            [name for name in self.boardOrder if name.rsplit(" ", 2)[1] == boardType]
         )
 
     @inlineCallbacks
-    def _doDetection(self, macs, packet, respLength, callback, timeout=1.0):
+    def _doDetection(
+        self, macs, packet, respLength, callback, timeout=1.0, numExpected=0
+    ):
         """
         Try to detect a boards at the specified mac addresses.
 
@@ -398,6 +463,14 @@ class BoardGroup(object):
         from one of the given mac addresses, the callback function will be
         called and should return data to be added to the list of found
         devices.
+
+        All detection packets are sent at once, together with a request that
+        waits for and reads the responses of the numExpected boards in the
+        board group configuration. Responses of other boards have arrived by
+        then, and are read with the short DETECTION_DRAIN_TIMEOUT. Only if
+        some of the expected boards do not respond do we wait for the full
+        timeout, after which the responses of the others are read the same
+        way.
         """
         try:
             ctx = self.directEthernetServer.context()
@@ -411,20 +484,38 @@ class BoardGroup(object):
             for mac in macs:
                 p.destination_mac(mac)
                 p.write(packet.tostring())
-            yield p.send(context=ctx)
-            # Listen for responses.
-            start = time.time()
-            found = []
-            while (len(found) < len(macs)) and (time.time() - start < timeout):
+            # Collect the expected responses in the same round trip. This is
+            # a separate packet so that its timeout does not fail the first.
+            r = self.directEthernetServer.packet()
+            if numExpected:
+                r.collect(numExpected)
+                r.read(numExpected, key="responses")
+            r.timeout(T.Value(DETECTION_DRAIN_TIMEOUT, "s"))
+            sent = p.send(context=ctx)
+            received = r.send(context=ctx)
+            yield sent
+            responses = []
+            try:
+                ans = yield received
+                if numExpected:
+                    responses.extend(ans["responses"])
+            except T.Error as e:
+                logging.error("expected boards missing: {}".format(e))
+            # Listen for the remaining responses. If the collect failed these
+            # include the responses of the expected boards that did respond.
+            drainStart = time.time()
+            while len(responses) < len(macs) and time.time() - drainStart < timeout:
                 try:
                     ans = yield self.directEthernetServer.read(1, context=ctx)
-                    src, dst, eth, data = ans[0]
-                    if src in macs:
-                        devInfo = callback(src, data)
-                        found.append(devInfo)
+                    responses.append(ans[0])
                 except T.Error as e:
-                    logging.error("timeout exception: {}".format(e))
+                    logging.info("timeout exception: {}".format(e))
                     break  # Read timeout.
+            found = []
+            for src, dst, eth, data in responses:
+                if src in macs:
+                    devInfo = callback(src, data)
+                    found.append(devInfo)
             returnValue(found)
         finally:
             # Expire the detection context.
@@ -447,18 +538,57 @@ class BoardGroup(object):
         Call a function in test mode.
 
         This makes sure that all currently-executing pipeline stages
-        are finished by acquiring the pipe semaphore for all pages,
-        then runs the function, and finally releases the semaphore
-        to allow the pipeline to continue.
+        are finished by acquiring the whole pipe semaphore, then runs the
+        function, and finally releases the semaphore to allow the pipeline
+        to continue.
         """
-        for i in range(NUM_PAGES):
-            yield self.pipeSemaphore.acquire()
+        held = yield self.acquirePipeline()
         try:
             ans = yield func(*a, **kw)
             returnValue(ans)
         finally:
-            for i in range(NUM_PAGES):
-                self.pipeSemaphore.release()
+            self.releasePipeline(held)
+
+    @inlineCallbacks
+    def acquirePipeline(self):
+        """Acquire all tokens of the pipe semaphore.
+
+        Waits until no sequences are running. Returns the number of tokens
+        held, to be given back with releasePipeline.
+        """
+        held = 0
+        # the depth may grow while we wait, until we hold all tokens
+        while held < self.pipeSemaphore.limit:
+            yield self.pipeSemaphore.acquire()
+            held += 1
+        returnValue(held)
+
+    def releasePipeline(self, held):
+        for i in range(held):
+            self.pipeSemaphore.release()
+
+    def pipelineDepth(self):
+        """Number of sequences to let into run at once, from stage times.
+
+        Pageable sequences load and run on the NUM_PAGES pages in turn, so
+        that many are on the boards at once. After collecting, a sequence
+        still has to be read and extracted, while holding its place in the
+        pipe. When that takes longer than running and collecting, the next
+        sequence for the freed page would wait for it, and the boards would
+        idle. So one more sequence is let in for each run and collect time
+        that reading and extracting takes, up to MAX_PIPELINE_DEPTH.
+        """
+        medians = {}
+        for stage in ["run", "collect", "read", "extract"]:
+            times = self.stageTimes[stage]
+            if len(times) < MIN_PIPELINE_TIMES:
+                return NUM_PAGES
+            medians[stage] = times.percentiles([50])[0]
+        onBoards = medians["run"] + medians["collect"]
+        offBoards = medians["read"] + medians["extract"]
+        if offBoards >= onBoards * (MAX_PIPELINE_DEPTH - NUM_PAGES):
+            return MAX_PIPELINE_DEPTH
+        return NUM_PAGES + int(np.ceil(offBoards / onBoards))
 
     def makePackets(self, runners, page, reps, timingOrder, sync=249):
         """Make packets to run a sequence on this board group.
@@ -489,7 +619,9 @@ class BoardGroup(object):
         are in the time-critical pipeline sections
 
 
-        loadPkts: list of packets, one for each board
+        loadPkts: list of (packet, content key), one for each board. The
+                  content key identifies the data written by the packet,
+                  see unloadedPackets.
         setupPkts: list of (packet, setup state). Only for ADC
         runPkts: wait, run, both. These packets are sent in the master
                  context, and are placed carefully in order so that the
@@ -504,19 +636,22 @@ class BoardGroup(object):
         context set to that device's context. This ensures that the
         packets have the right destination MAC and therefore arrive in
         the right place.
+
+        Run, collect and read packets do not depend on the sequence data, so
+        they are taken from the packet cache when an earlier sequence used
+        the same boards, page, modes, delays and reps (see cachedPackets).
         """
         # Dictionary of devices to be run.
         runnerInfo = dict((runner.dev.devName, runner) for runner in runners)
 
         # Upload sequence data (pipelined).
         loadPkts = []
+        isMaster = True
         for board in self.boardOrder:
             if board in runnerInfo:
                 runner = runnerInfo[board]
-                isMaster = len(loadPkts) == 0
-                p = runner.loadPacket(page, isMaster)
-                if p is not None:
-                    loadPkts.append(p)
+                loadPkts.extend(self.loadPackets(runner, page, isMaster))
+                isMaster = False
 
         # Setup board state (not pipelined).
         # Build a list of (setupPacket, setupState).
@@ -554,14 +689,112 @@ class BoardGroup(object):
                     # Idle mode.
                     pass
         boards = boards[1:] + boards[:1]  # move master to the end.
-        runPkts = self.makeRunPackets(boards)
+        # The register bytes hold the page, master/slave mode, delay and reps
+        # of each board, so they identify the run packets completely.
+        runKey = ("run",) + tuple((dev, regs.tobytes()) for dev, regs in boards)
+        runPkts = self.cachedPackets(runKey, lambda: self.makeRunPackets(boards))
         # Collect and read (or discard) timing results.
         seqTime = max(runner.seqTime for runner in runners)
-        collectPkts = [runner.collectPacket(seqTime, self.ctx) for runner in runners]
-        readPkts = [runner.readPacket(timingOrder) for runner in runners]
+        collectPkts = [
+            self.cachedPackets(
+                ("collect", runner.dev, runner.nPackets, seqTime),
+                lambda runner=runner: runner.collectPacket(seqTime, self.ctx),
+            )
+            for runner in runners
+        ]
+        readPkts = [
+            self.cachedPackets(
+                ("read", runner.dev, runner.nPackets, tuple(timingOrder)),
+                lambda runner=runner: runner.readPacket(timingOrder),
+            )
+            for runner in runners
+        ]
 
         return loadPkts, setupPkts, runPkts, collectPkts, readPkts
 
+    def loadPackets(self, runner, page, isMaster):
+        """Load packets of a runner, with the key of the content they write.
+
+        Returns a list of (packet, key), where key is ((board name, page),
+        hash), or None if the runner cannot hash its content, in which case
+        its load packet is always sent. DAC load packets come in parts (see
+        loadParts), e.g. jump table and SRAM, which are keyed separately so
+        that a part is only sent when it changed.
+        """
+        if not isinstance(runner, dac.DacRunner_Build7):
+            p = runner.loadPacket(page, isMaster)
+            return [] if p is None else [(p, None)]
+        loadPkts = []
+        for part, p, contentHash in runner.loadParts(page, isMaster):
+            if part is None:
+                part = page if runner.pageable() else ALL_PAGES
+            loadPkts.append((p, ((runner.dev.devName, part), contentHash)))
+        return loadPkts
+
+    def unloadedPackets(self, loadPkts):
+        """Drop the load packets whose content is already on the boards.
+
+        Must be called with the page locks held, so that every earlier
+        sequence on the same pages has sent its load packets (and marked
+        them with markLoaded) or given up on them (forgetLoaded).
+        """
+        return [
+            (p, key)
+            for p, key in loadPkts
+            if key is None or self.loadedContent.get(key[0]) != key[1]
+        ]
+
+    def markLoaded(self, loadPkts):
+        """Remember the content written by load packets that were sent."""
+        for p, key in loadPkts:
+            if key is None:
+                continue
+            (board, page), contentHash = key
+            if page == ALL_PAGES:
+                # SRAM longer than a page overwrites the other pages
+                for b, p in list(self.loadedContent):
+                    if b == board and _is_sram_page(p):
+                        del self.loadedContent[(b, p)]
+            elif _is_sram_page(page):
+                # and this page overwrites part of such long SRAM
+                self.loadedContent.pop((board, ALL_PAGES), None)
+            self.loadedContent[(board, page)] = contentHash
+
+    def forgetLoaded(self, boards=None):
+        """Forget what was loaded to some or (by default) all boards.
+
+        The next sequence then writes its SRAM and memory or jump table in
+        full. Call this whenever the content of a board may have changed
+        outside of run, e.g. board resets, direct SRAM writes and timeouts.
+        """
+        if boards is None:
+            self.loadedContent.clear()
+            return
+        for key in list(self.loadedContent):
+            if key[0] in boards:
+                del self.loadedContent[key]
+
+    def cachedPackets(self, key, makePackets):
+        """Get packets from the packet cache, making them if necessary.
+
+        Sending a packet does not change it, so packets can be sent again
+        by every later sequence that would build the same packets. The key
+        must therefore identify everything that goes into them. Records
+        that change from run to run, like the number of triggers the run
+        packets wait for, are given keys and patched before sending.
+
+        The least recently used packets are dropped once the cache holds
+        PACKET_CACHE_SIZE entries.
+        """
+        if key in self.packetCache:
+            pkts = self.packetCache.pop(key)
+        else:
+            pkts = makePackets()
+        self.packetCache[key] = pkts
+        if len(self.packetCache) > PACKET_CACHE_SIZE:
+            self.packetCache.popitem(last=False)
+        return pkts
+
     def makeRunPackets(self, data):
         """Create packets to run a set of boards.
 
@@ -601,9 +834,23 @@ class BoardGroup(object):
 
     @inlineCallbacks
     def run(
-        self, runners, reps, setupPkts, setupState, sync, getTimingData, timingOrder
+        self,
+        runners,
+        reps,
+        setupPkts,
+        setupState,
+        sync,
+        getTimingData,
+        timingOrder,
+        reduce=False,
     ):
-        """Run a sequence on this board group."""
+        """Run a sequence on this board group.
+
+        If reduce is True, ADC demodulation data is read in chunks and
+        reduced to per-trigger statistics as the chunks arrive (see
+        readReduction), and a tuple of (means, variances, counts) arrays is
+        returned instead of the data.
+        """
         # Check whether this sequence will fit in just one page.
         if all(runner.pageable() for runner in runners):
             # Lock just one page.
@@ -625,8 +872,10 @@ class BoardGroup(object):
 
         # Prepare packets.
         logging.info("making packets")
+        start = time.time()
         pkts = self.makePackets(runners, page, reps, timingOrder, sync)
         loadPkts, boardSetupPkts, runPkts, collectPkts, readPkts = pkts
+        self.stageTimes["build"].add(time.time() - start)
 
         # Add setup packets from boards (ADCs) to that provided in the args:
         # setupPkts is a list.
@@ -637,6 +886,10 @@ class BoardGroup(object):
         try:
             yield self.pipeSemaphore.acquire()
             logging.info("pipe semaphore acquired")
+            # Sets the depth for the sequences after this one. Not done
+            # before acquiring, so that the depth does not change while
+            # acquirePipeline holds all tokens.
+            self.pipeSemaphore.setLimit(self.pipelineDepth())
             try:
                 # Stage 1: load.
                 for pageLock in pageLocks:  # Lock pages to be written.
@@ -647,14 +900,23 @@ class BoardGroup(object):
                 # kosher at this time.
                 # TODO: Need to check what 'load packets' is for ADC and make
                 # sure sending load packets here is ok.
-                loadDone = self.sendAll(loadPkts, "Load")
+                loadPkts = self.unloadedPackets(loadPkts)
+                loadStart = time.time()
+                loadDone = self.sendAll([p for p, key in loadPkts], "Load")
                 # stage 2: run
                 # Send a request for the run lock, do not wait for response.
                 runNow = self.runLock.acquire()
                 try:
-                    yield loadDone  # wait until load is finished.
+                    try:
+                        yield loadDone  # wait until load is finished.
+                    except Exception:
+                        self.forgetLoaded([r.dev.devName for r in runners])
+                        raise
+                    self.markLoaded(loadPkts)
+                    self.stageTimes["load"].add(time.time() - loadStart)
                     yield runNow  # Wait for acquisition of the run lock.
                     logging.info("run lock acquired")
+                    runStart = time.time()
                     # Set the number of triggers needed before we can actually
                     # run. We expect to get one trigger for each board that
                     # had to run and return data. This is the number of
@@ -711,15 +973,15 @@ class BoardGroup(object):
                     # XXX How does this work? Why is r['nTriggers'] the wait
                     # time?
                     # print "fpga server: r['nTriggers']: %s" % (r['nTriggers'])
-                    self.runWaitTimes.append(r["nTriggers"]["s"])
-                    if len(self.runWaitTimes) > 100:
-                        self.runWaitTimes.pop(0)
+                    self.runWaitTimes.add(r["nTriggers"]["s"])
+                    self.stageTimes["run"].add(time.time() - runStart)
 
                     yield self.readLock.acquire()  # wait for our turn to read
                     logging.info("read lock acquired")
                     # stage 3: collect
                     # Collect appropriate number of packets and then trigger
                     # the master context.
+                    collectStart = time.time()
                     collectAll = defer.DeferredList(
                         [p.send() for p in collectPkts], consumeErrors=True
                     )
@@ -752,6 +1014,7 @@ class BoardGroup(object):
                 # Wait for data to be collected.
                 results = yield collectAll
                 logging.info("results collected")
+                self.stageTimes["collect"].add(time.time() - collectStart)
             finally:
                 for pageLock in pageLocks:
                     pageLock.release()
@@ -769,12 +1032,45 @@ class BoardGroup(object):
             # stage 4: read
             # no timeout, so go ahead and read data
             boardOrder = [runner.dev.devName for runner in runners]
-            readAll = self.sendAll(readPkts, "Read", boardOrder)
+            readStart = time.time()
+            # ADCs whose data is reduced are read in chunks, which are
+            # reduced as they arrive, instead of with their read packet
+            reduced = [
+                reduce
+                and getTimingData
+                and isinstance(runner, adc.AdcRunner_Build7)
+                and any(s.startswith(runner.dev.devName + "::") for s in timingOrder)
+                for runner in runners
+            ]
+            readAll = self.sendAll(
+                [p for p, r in zip(readPkts, reduced) if not r],
+                "Read",
+                [name for name, r in zip(boardOrder, reduced) if not r],
+            )
+            reduceAll = defer.DeferredList(
+                [
+                    self.readReduction(runner)
+                    for runner, r in zip(runners, reduced)
+                    if r
+                ],
+                fireOnOneErrback=True,
+                consumeErrors=True,
+            )
             self.readLock.release()
             # This line scales really badly with incrasing stats
             # At 9600 stats the next line takes 10s out of 20s per
             # sequence.
-            results = yield readAll  # wait for read to complete
+            try:
+                results = yield readAll  # wait for read to complete
+            finally:
+                try:
+                    reductions = yield reduceAll
+                except defer.FirstError as e:
+                    e.subFailure.raiseException()
+            reductions = [reduction for success, reduction in reductions]
+            results = [reductions.pop(0) if r else results.pop(0) for r in reduced]
+            extractStart = time.time()
+            self.stageTimes["read"].add(extractStart - readStart)
 
             # List the DACs that support the data readback.
             timingDataDACs = [
@@ -820,16 +1116,33 @@ class BoardGroup(object):
                         # relevant part to the list of returned data
                         idx = boardOrder.index(boardName)
                         runner = runners[idx]
-                        result = [data for src, dest, eth, data in results[idx]["read"]]
-                        # Array of all timing results (DAC)
-                        extracted = runner.extract(result)
+                        if reduce:
+                            if not isinstance(runner, adc.AdcRunner_Build7):
+                                raise RuntimeError(
+                                    "Reduction supported only for ADC build 7"
+                                )
+                            # Running statistics of all demod channels,
+                            # reduced while reading
+                            extracted = results[idx]
+                        else:
+                            result = [
+                                data for src, dest, eth, data in results[idx]["read"]
+                            ]
+                            # Array of all timing results (DAC)
+                            extracted = runner.extract(result)
                         # Wrap the DAC timing results in a tuple for
                         # the data format consistency.
                         if type(runner) == dac.DacRunner_Build8:
                             extracted = (extracted,)
                         extractedData[boardName] = extracted
                     # Add extracted data to list of data to be returned
-                    if channel != None:
+                    if reduce:
+                        if channel is None:
+                            raise RuntimeError(
+                                "Reduction supported only for ADC demod channels"
+                            )
+                        extractedChannel = extracted.channel(channel)
+                    elif channel != None:
                         # If this is an ADC demod channel, grab that
                         # channel's data only
                         if type(runner) == adc.AdcRunner_Build1:
@@ -843,6 +1156,11 @@ class BoardGroup(object):
                     else:
                         extractedChannel = extracted
                     answers.append(extractedChannel)
+                if reduce:
+                    # (means, variances, counts), each indexed by timing order
+                    # first
+                    answers = [np.array(x) for x in zip(*answers)]
+                self.stageTimes["extract"].add(time.time() - extractStart)
                 returnValue(tuple(answers))
         finally:
             self.pipeSemaphore.release()
@@ -869,10 +1187,34 @@ class BoardGroup(object):
                     msg += "{} : {}\n\n".format(i, m)
             raise Exception(msg)
 
+    def readReduction(self, runner):
+        """Read the demodulation data of an ADC in chunks and reduce it.
+
+        Each chunk is added to the reduction when it arrives and then
+        dropped, so that the data of all stats is never held in memory.
+        Returns a deferred firing with the DemodReduction.
+        """
+        try:
+            reduction = runner.makeReduction()
+        except RuntimeError:
+            # discard the data, so that the next run does not read it
+            error = defer.fail()
+            discard = runner.dev.discard(runner.nPackets).send()
+            discard.addBoth(lambda _: error)
+            return discard
+
+        def add(result):
+            packets = [data for src, dest, eth, data in result["read"]]
+            runner.addToReduction(reduction, packets)
+
+        reads = [p.send().addCallback(add) for p in runner.reductionReadPackets()]
+        d = defer.DeferredList(reads, fireOnOneErrback=True, consumeErrors=True)
+        d.addCallbacks(lambda _: reduction, lambda failure: failure.value.subFailure)
+        return d
+
     def extractTiming(self, packets):
         """Extract timing data coming back from a readPacket."""
-        data = "".join(data[3:63] for data in packets)
-        return np.fromstring(data, dtype="<u2").astype("u4")
+        return dac.DacRunner_Build8.extract(packets)
 
     @inlineCallbacks
     def recoverFromTimeout(self, runners, results):
@@ -892,6 +1234,9 @@ class BoardGroup(object):
         collection failed.
         """
         print("RECOVERING FROM TIMEOUT")
+        # The boards were left in an unknown state, so load them in full next
+        # time.
+        self.forgetLoaded([runner.dev.devName for runner in runners])
 
         # Get execution counts.
         for runner, (success, result) in zip(runners, results):
@@ -1389,6 +1734,24 @@ class FPGAServer(DeviceServer):
         ch["dPhi"] = dPhi
         ch["phi0"] = phi0
 
+    @setting(43, "ADC Readout Mode", mode="s", returns="")
+    def adc_readout_mode(self, c, mode):
+        """
+        Set the demodulator readout mode for the current ADC board, 'iq' or
+        'bits'. (ADC build 7 only)
+
+        In 'bits' mode each demodulated IQ point is thresholded with its
+        channel's "ADC Demod Threshold" and Run Sequence returns the states
+        packed into 32-bit words.
+        """
+        mode = mode.lower()
+        assert mode in ["iq", "bits"], 'unknown mode: "{}"'.format(mode)
+        dev = self.selectedADC(c)
+        if not isinstance(dev, adc.ADC_Build7):
+            raise Exception("Readout mode supported only for ADC build 7")
+        d = c.setdefault(dev, {})
+        d["mode"] = mode
+
     @setting(44, "ADC Run Mode", mode="s", returns="")
     def adc_run_mode(self, c, mode):
         """
@@ -1450,6 +1813,24 @@ class FPGAServer(DeviceServer):
         channel = info.setdefault(channel, {})
         channel["mixerTable"] = data
 
+    @setting(49, "ADC Demod Threshold", channel="w", threshold="v", angle="v")
+    def adc_demod_threshold(self, c, channel, threshold, angle=0.0):
+        """Set the IQ threshold for a given demodulator channel
+
+        A stat is above threshold when I*cos(angle) + Q*sin(angle) is larger
+        than threshold. Used for the threshold counts of reduced runs and in
+        the 'bits' readout mode.
+
+        Args:
+            channel (int): demodulator channel for which to set the threshold.
+            threshold (float): threshold in demodulator units.
+            angle (float): angle of the IQ projection axis in radians.
+        """
+        dev = self.selectedADC(c)
+        info = c.setdefault(dev, {})
+        channel = info.setdefault(channel, {})
+        channel["threshold"] = (threshold, angle)
+
     # multiboard sequence execution
 
     @setting(
@@ -1459,9 +1840,18 @@ class FPGAServer(DeviceServer):
         getTimingData="b",
         setupPkts="?{(((ww), s, ((s?)(s?)(s?)...))...)}",
         setupState="*s",
-        returns=["*4i", "*3i", "*2i", ""],
+        reduce="b",
+        returns=["*4i", "*3i", "*3w", "*2i", "(*3v, *3v, *2i)", ""],
     )
-    def run_sequence(self, c, reps=30, getTimingData=True, setupPkts=[], setupState=[]):
+    def run_sequence(
+        self,
+        c,
+        reps=30,
+        getTimingData=True,
+        setupPkts=[],
+        setupState=[],
+        reduce=False,
+    ):
         """Executes a sequence on one or more boards.
 
         Args:
@@ -1482,6 +1872,10 @@ class FPGAServer(DeviceServer):
                 the setup packets will not be sent for this point.  For example,
                 the setupState might describe the amplitude and frequency of
                 the various microwave sources for this sequence.
+            reduce:
+                if True, ADC demodulation data is averaged over stats on the
+                server and only per-trigger statistics are returned. ADC
+                build 7 demod channels only.
 
         Returns:
             If ADC boards all in average mode, data returned as a *3i. The three
@@ -1493,12 +1887,22 @@ class FPGAServer(DeviceServer):
                 (demod channel, stat, retrigger, I/Q).
             retrigger indexes multiple triggers in a sequence.
 
+            If ADC boards are in demodulate mode with 'bits' readout, data is
+            returned as a *3w indexed (demod channel, stat, word). Bit k of
+            word w is the thresholded state of retrigger 32*w + k.
+
             If only DACs present, we return no data unless the build
             number for at least some of the DAC boards is 8.
             In the later case, the data is returned as *i.
 
             ADC boards must be either all in average mode or all in demodulate
             mode.
+
+            If reduce is True, data is returned as a cluster of
+            (means *3v, variances *3v, counts *2i). Means and variances are
+            indexed (demod channel, retrigger, I/Q). Counts, indexed
+            (demod channel, retrigger), are the number of stats above the
+            channel's "ADC Demod Threshold", or -1 if it has none.
         """
         logging.info("Run sequence")
         logging.debug("Setup packets: {}".format(setupPkts))
@@ -1568,6 +1972,7 @@ class FPGAServer(DeviceServer):
                     c["master_sync"],
                     getTimingData,
                     timingOrder,
+                    reduce,
                 )
                 # For ADCs in demodulate mode, store their I and Q ranges to
                 # check for possible clipping.
@@ -1579,7 +1984,7 @@ class FPGAServer(DeviceServer):
                         and runner.dev.devName in timingOrder
                     ):
                         c[runner.dev]["ranges"] = runner.ranges
-                if ans is not None:
+                if ans is not None and not reduce:
                     ans = np.asarray(ans)
                 returnValue(ans)
             except TimeoutError as err:
@@ -1600,6 +2005,110 @@ class FPGAServer(DeviceServer):
                         logfile.write("retrying...")
                         attempt += 1
 
+    @setting(
+        51,
+        "Run Sequence Batch",
+        points="*(*(ss?), ?, *s)",
+        reps="w",
+        getTimingData="b",
+        reduce="b",
+        returns=["*5i", "*4i", "*4w", "*3i", "(*4v, *4v, *3i)", ""],
+    )
+    def run_sequence_batch(self, c, points, reps=30, getTimingData=True, reduce=False):
+        """Runs a sequence for each of a list of points and stacks the data.
+
+        Each point is a cluster of (deltas, setupPkts, setupState). deltas is
+        a list of (setting name, board name, data) clusters, which are
+        applied to the board like calling the setting with data (a cluster
+        for several arguments) before the point runs. See BATCH_SETTINGS for
+        the settings that can be used. setupPkts and setupState are as for
+        Run Sequence.
+
+        The points run as if Run Sequence were called for each of them, but
+        without a request per point, and with as many points in flight as
+        the board group can pipeline. The data of the points is stacked,
+        with the point as the first index; reduced data is a cluster of the
+        stacked means, variances and counts. The settings of the last point
+        are kept in the context.
+
+        The deltas must keep the shape of the data, e.g. a trigger table
+        must keep its number of triggers and channels. A point whose data
+        has a different shape than the first point's fails the batch, as
+        does an empty list of points.
+        """
+        if not points:
+            raise ValueError("Run Sequence Batch needs at least one point")
+        # Enough points in flight for the deepest pipeline, and one more
+        # that has its packets ready when the pipe has room.
+        maxInFlight = MAX_PIPELINE_DEPTH + 1
+        inFlight = []
+        answers = []
+        selected = c.get("device")
+        try:
+            for deltas, setupPkts, setupState in points:
+                self.applyDeltas(c, deltas)
+                inFlight.append(
+                    self.run_sequence(
+                        c, reps, getTimingData, setupPkts, setupState, reduce
+                    )
+                )
+                while len(inFlight) >= maxInFlight:
+                    ans = yield inFlight.pop(0)
+                    self.addBatchAnswer(answers, ans)
+            while inFlight:
+                ans = yield inFlight.pop(0)
+                self.addBatchAnswer(answers, ans)
+        finally:
+            if selected is None:
+                c.pop("device", None)
+            else:
+                c["device"] = selected
+            # let the points still running finish before failing
+            if inFlight:
+                yield defer.DeferredList(inFlight, consumeErrors=True)
+        if reduce:
+            means, variances, counts = zip(*answers)
+            returnValue((np.array(means), np.array(variances), np.array(counts)))
+        if answers[0] is None:
+            returnValue(None)
+        returnValue(np.array(answers))
+
+    @staticmethod
+    def addBatchAnswer(answers, ans):
+        """Add the data of a batch point, checking it stacks with the others."""
+
+        def shape(ans):
+            if isinstance(ans, tuple):
+                return tuple(np.shape(x) for x in ans)
+            return None if ans is None else np.shape(ans)
+
+        if answers and shape(ans) != shape(answers[0]):
+            raise ValueError(
+                "point {} gave data of shape {}, but point 0 gave {}; the "
+                "deltas of a batch must keep the shape of the data".format(
+                    len(answers), shape(ans), shape(answers[0])
+                )
+            )
+        answers.append(ans)
+
+    def applyDeltas(self, c, deltas):
+        """Apply a list of (setting name, board name, data) to the context."""
+        for name, board, data in deltas:
+            if name not in BATCH_SETTINGS:
+                raise ValueError(
+                    "'{}' cannot be used in a batch, only {}".format(
+                        name, ", ".join(sorted(BATCH_SETTINGS))
+                    )
+                )
+            self.select_device(c, board)
+            func = getattr(self, BATCH_SETTINGS[name])
+            if data is None:
+                func(c)
+            elif isinstance(data, tuple):
+                func(c, *data)
+            else:
+                func(c, data)
+
     @setting(52, "Daisy Chain", boards="*s", returns="*s")
     def sequence_boards(self, c, boards=None):
         """
@@ -1694,7 +2203,7 @@ class FPGAServer(DeviceServer):
         for (server, port), group in sorted(self.boardGroups.items()):
             pageTimes = [lock.times for lock in group.pageLocks]
             runTime = group.runLock.times
-            runWaitTime = group.runWaitTimes
+            runWaitTime = list(group.runWaitTimes.times())
             readTime = group.readLock.times
             ans.append(
                 (
@@ -1704,6 +2213,49 @@ class FPGAServer(DeviceServer):
             )
         return ans
 
+    @setting(
+        60,
+        "Pipeline Timing",
+        percents="*v",
+        bins="w",
+        returns="*((sw)*(sw*v*v*w))",
+    )
+    def sequence_pipeline_timing(self, c, percents=[5, 25, 50, 75, 95], bins=20):
+        """Get wall time statistics of the stages of running sequences.
+
+        For each board group, this returns for each stage of the pipeline
+        (build, load, run, collect, read and extract) a cluster of:
+            stage name
+            number of times recorded since the server started
+            the given percentiles of the last STAGE_TIMES_TO_KEEP times [s]
+            histogram bin edges [s]
+            histogram counts (bins of them)
+
+        build: making the packets for a sequence
+        load: uploading memory, SRAM and jump tables
+        run: from getting the run lock until the run packet returned
+        collect: waiting for the boards to finish and send their data
+        read: reading the data from the direct ethernet server
+        extract: parsing the data, including any reduction
+        """
+        ans = []
+        for (server, port), group in sorted(self.boardGroups.items()):
+            stages = []
+            for stage in PIPELINE_STAGES:
+                times = group.stageTimes[stage]
+                counts, binEdges = times.histogram(bins)
+                stages.append(
+                    (
+                        stage,
+                        times.count,
+                        times.percentiles(percents),
+                        binEdges,
+                        counts.astype("u4"),
+                    )
+                )
+            ans.append(((server, port), stages))
+        return ans
+
     @setting(200, "PLL Init", returns="")
     def pll_init(self, c, data):
         """Sends the initialization sequence to the PLL. (DAC and ADC)
@@ -1711,12 +2263,14 @@ class FPGAServer(DeviceServer):
         The sequence is [0x1FC093, 0x1FC092, 0x100004, 0x000C11].
         """
         dev = self.selectedDevice(c)
+        dev.boardGroup.forgetLoaded([dev.devName])
         yield dev.initPLL()
 
     @setting(201, "PLL Reset", returns="")
     def pll_reset(self, c):
         """Resets the FPGA internal GHz serializer PLLs. (DAC only)"""
         dev = self.selectedDAC(c)
+        dev.boardGroup.forgetLoaded([dev.devName])
         yield dev.resetPLL()
 
     @setting(202, "PLL Query", returns="b")
@@ -1765,6 +2319,7 @@ class FPGAServer(DeviceServer):
             raise ValueError("Cannot play less than 20 ns of data.")
 
         dev = self.selectedDAC(c)
+        dev.boardGroup.forgetLoaded([dev.devName])
         yield dev.runSram(data, loop, blockDelay)
 
     @setting(2081, "DAC Write SRAM", data="*w")
@@ -1779,6 +2334,7 @@ class FPGAServer(DeviceServer):
         This command just writes data into the board's SRAM buffer, that's it.
         """
         dev = self.selectedDAC(c)
+        dev.boardGroup.forgetLoaded([dev.devName])
         yield dev._sendSRAM(np.array(data, dtype="<u4").tostring())
 
     @setting(
@@ -2108,6 +2664,7 @@ class FPGAServer(DeviceServer):
         """
         cmd, shift = dac.DAC.getCommand({"A": (2, 0), "B": (3, 14)}, chan)
         dev = self.selectedDAC(c)
+        dev.boardGroup.forgetLoaded([dev.devName])
         ans = yield dev.runBIST(cmd, shift, data)
         # This is coming back with 64-bit ints, the coercing of which needs to
         # be fixed in pylabrad for now we manually cast to 32-bit (long)
@@ -2142,6 +2699,7 @@ class FPGAServer(DeviceServer):
         (string, data) with all the calibration parameters.
         """
         dev = self.selectedDAC(c)
+        dev.boardGroup.forgetLoaded([dev.devName])
         ans = []
         yield dev.initPLL()
         time.sleep(0.100)
@@ -2257,7 +2815,12 @@ class FPGAServer(DeviceServer):
         demods = dict((i, info[i]) for i in range(dev.DEMOD_CHANNELS) if i in info)
         yield dev.runCalibrate()
 
-    @setting(2602, "ADC Run Demod", mode="s", returns="*3i{I,Q}, *i, *i")
+    @setting(
+        2602,
+        "ADC Run Demod",
+        mode="s",
+        returns=["*3i{I,Q}, *i, *i", "*3w{bits}, *i, *i"],
+    )
     # @setting(2602, 'ADC Run Demod', returns='*i')
     def adc_run_demod(self, c, mode="iq"):
         """
@@ -2305,6 +2868,11 @@ def _assert_has_jump_table(dev):
     assert dev.HAS_JUMP_TABLE, "device is not a jump table board: {}".format(dev)
 
 
+def _is_sram_page(page):
+    """Whether a loadedContent page key is SRAM (not e.g. the jump table)."""
+    return page == ALL_PAGES or isinstance(page, int)
+
+
 def _process_setup_packets(cxn, setupPkts):
     """
     Process packets sent in flattened form into actual labrad packets on the